@@ -17,6 +17,7 @@ from __future__ import print_function
 
 from collections import Mapping
 import asyncio
+import hashlib
 import inspect
 import json
 import os
@@ -51,6 +52,7 @@ class AsyncRemoteLibrary():
     def __init__(self, library, ws):
         self._library = RemoteLibraryFactory(library)
         self.ws = ws
+        self._metadata = None
 
     def get_keyword_names(self):
         # return self._library.get_keyword_names() + ['stop_remote_server']
@@ -77,6 +79,31 @@ class AsyncRemoteLibrary():
             return []
         return self._library.get_keyword_tags(name)
 
+    def get_library_version(self):
+        return self._get_library_metadata()['version']
+
+    def get_library_metadata(self):
+        """
+        The arguments, documentation and tags of all the keywords in one call for the server to cache,
+        the version is a digest of them so that it changes along with the library
+        """
+        return self._get_library_metadata()
+
+    def _get_library_metadata(self):
+        if self._metadata is None:
+            names = self.get_keyword_names()
+            keywords = {}
+            for name in names:
+                keywords[name] = {'args': self.get_keyword_arguments(name),
+                                  'doc': self.get_keyword_documentation(name),
+                                  'tags': self.get_keyword_tags(name)}
+            for name in '__intro__', '__init__':
+                keywords.setdefault(name, {'doc': self.get_keyword_documentation(name)})
+            metadata = {'names': names, 'keywords': keywords}
+            digest = hashlib.sha1(json.dumps(metadata, sort_keys=True, default=str).encode()).hexdigest()
+            self._metadata = dict(metadata, version=digest)
+        return self._metadata
+
 
 class SignalHandler(object):
 
@@ -32,6 +32,72 @@ class Config:
     LOG_FILE_MAX_BYTES = 100 * 1024 * 1024
     LOG_FILE_BACKUP_COUNT = 10
 
+    # 'notify': the event loop is woken up by push_event() of the same process
+    # 'change_stream': also watch the event queue collection for events pushed by other processes,
+    #                  requires MongoDB running as a replica set, fall back to 'notify' otherwise
+    EVENT_DISPATCH_MODE = 'notify'
+    # seconds to re-check the event queue when no notification comes, None to disable it
+    EVENT_POLL_INTERVAL = 30
+    # worker threads serving the endpoints, robot processes are supervised asynchronously apart from them
+    SCHEDULER_WORKERS = 8
+    # run several task runners sharing the task queues, each of them owns the endpoints it has claimed
+    # by an expiring lease, endpoints of a dead runner are taken over by the others once the leases expire,
+    # it requires EVENT_DISPATCH_MODE 'change_stream' or EVENT_POLL_INTERVAL of at most 5 seconds, and
+    # XMLRPC_BRIDGE_ADDRESS reachable from the other nodes
+    RUNNER_MULTI_NODE = False
+    RUNNER_LEASE_TTL = 30
+    RUNNER_LEASE_RENEW_INTERVAL = 10
+    # seconds between the websocket pings of the RPC proxy and to wait for the pongs, an endpoint
+    # goes offline as soon as its connections close, or when it stops answering the pings
+    LIVENESS_PING_INTERVAL = 5
+    LIVENESS_PING_TIMEOUT = 5
+    # prepare the launch of the next task of an endpoint while it's running a task, and post-process
+    # the finished tasks in the background, so that back-to-back tasks start without dead time
+    PIPELINED_LAUNCH = False
+    # seconds to gather the notifications to the same user into one digest mail, 0 to send them one by one
+    NOTIFICATION_DIGEST_DELAY = 0
+    # times to retry sending a mail, the delay in seconds before the first retry doubles for each retry
+    NOTIFICATION_RETRIES = 3
+    NOTIFICATION_RETRY_BACKOFF = 5
+    # idle robot executors kept forked from a process which has imported Robot Framework and the libraries
+    # of ROBOT_POOL_PRELOAD, 0 to start each robot process cold, it works only on the platforms having fork()
+    ROBOT_POOL_SIZE = 0
+    ROBOT_POOL_PRELOAD = None  # None for the default modules of task_runner.util.robot_pool
+    # bytes of the console output of a running task kept in memory, the rest is spilled to disk
+    CONSOLE_BUFFER_SIZE = 1024 * 1024
+    # seconds between the samples of the robot process trees' resource usage from /proc, 0 to not account it
+    RESOURCE_SAMPLE_INTERVAL = 1
+    # worker threads parsing output.xml and compressing the result files of the finished tasks apart from the scheduler's
+    BACKGROUND_WORKERS = 2
+    # post-processing jobs waiting for the background workers, a task finishing beyond that waits for a free slot
+    BACKGROUND_QUEUE_SIZE = 100
+    # test cases inserted at once when the output.xml of a finished task is parsed into the case results, 0 to not parse it
+    RESULT_INGEST_BATCH_SIZE = 1000
+    # result files of a finished task no smaller than that are precompressed into .gz siblings served to gzip clients, 0 to not do it
+    RESULT_GZIP_MIN_SIZE = 64 * 1024
+    # task ids resolved to their rooms by the relay of the test logs, kept for at most RELAY_CACHE_TTL seconds
+    RELAY_CACHE_SIZE = 4096
+    RELAY_CACHE_TTL = 6 * 3600
+    # seconds the relay drops the test logs of a task id not found before looking it up again
+    RELAY_UNKNOWN_TTL = 10
+    # seconds to coalesce the test logs of a task into one message to the browsers, and the characters
+    # per second a room may receive, the oldest output is dropped if the browsers can't keep up
+    RELAY_FLUSH_DELAY = 0.05
+    RELAY_ROOM_RATE = 512 * 1024
+    # the XML RPC bridge for the robot processes, it lives in the process serving the RPC proxy
+    XMLRPC_BRIDGE_ADDRESS = '127.0.0.1'
+    XMLRPC_BRIDGE_PORT = 8270
+    # seconds to wait for an endpoint to run a keyword called through the bridge, it fails after that
+    XMLRPC_KEYWORD_TIMEOUT = 3600
+    # port of the msgpack framed bridge for the suites importing the BinaryRemote library instead of Remote,
+    # 0 to serve only XML-RPC, the library falls back to XML-RPC too if msgpack is not installed
+    BINARY_BRIDGE_PORT = 8271
+    # port of a Prometheus exporter of the runner's metrics for the runners without a web server, 0 to not start it,
+    # the web server exposes them at /setting/metrics too
+    METRICS_PORT = 0
+    # message queue for the runners without a web server to emit Socket.IO messages, eg. redis://127.0.0.1:6379/0
+    SOCKETIO_MESSAGE_QUEUE = None
+
     @classmethod
     def init_app(cls, app):
         # email errors to the administrators
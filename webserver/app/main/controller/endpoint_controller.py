@@ -194,7 +194,7 @@ class EndpointController(Resource):
             taskqueue_stat = ({
                 'endpoint': taskqueue.endpoint.name,
                 'priority': taskqueue.priority,
-                'waiting': len(taskqueue.tasks),
+                'waiting': taskqueue.size(),
                 'status': taskqueue.endpoint.status,
                 'endpoint_uid': taskqueue.endpoint.uid,
                 'tasks': []
@@ -252,16 +252,14 @@ class EndpointController(Resource):
                     return response_message(ENOENT, 'task not found for ' + task['task_id']), 404
                 tasks.append(t)
 
+            set1 = set(tasks)
+            set2 = set(queue.tasks)
             if not queue.flush():
                 return response_message(EPERM, 'task queue {} {} flushing failed'.format(queue.endpoint.uid, queue.priority)), 401
 
-            queue.acquire_lock()
-            set1 = set(tasks)
-            set2 = set(queue.tasks)
             task_cancel_set = set2 - set1
             for task in task_cancel_set:
                 task.update(status='cancelled')
-            queue.release_lock()
 
             for task in tasks:
                 # no need to lock task as task queue has been just flushed, no runner is supposed to hold it yet
@@ -4,8 +4,10 @@ from urllib.parse import urlparse
 from pathlib import Path
 from ..util.dto import SettingDto
 from ..util.response import *
-from flask import send_from_directory, request, current_app
+from flask import Response, send_from_directory, request, current_app
 from flask_restx import Resource
+from task_runner.runner import get_scheduler_stats, get_relay_stats, get_metrics
+from task_runner.util.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 api = SettingDto.api
 
@@ -18,6 +20,36 @@ class rpc_request(Resource):
         """
         return {'rpc_port': 5555}
 
+@api.route('/scheduler')
+class scheduler_request(Resource):
+    @api.doc('Get the task scheduler\'s utilization')
+    def get(self):
+        """
+        Get the task scheduler's utilization
+        """
+        stats = get_scheduler_stats()
+        if stats is None:
+            return response_message(ENOENT, 'Task scheduler is not running'), 404
+        return response_message(SUCCESS, **stats)
+
+@api.route('/relay')
+class relay_request(Resource):
+    @api.doc('Get the statistics of the test log relay and the keyword bridge')
+    def get(self):
+        """
+        Get the statistics of the test log relay and the keyword bridge
+        """
+        return response_message(SUCCESS, **get_relay_stats())
+
+@api.route('/metrics')
+class metrics_request(Resource):
+    @api.doc('Get the metrics of the task runner in the Prometheus text format')
+    def get(self):
+        """
+        Get the metrics of the task runner in the Prometheus text format
+        """
+        return Response(get_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 @api.route('/download')
 class download_request(Resource):
     @api.param('file', description='The file path')
@@ -7,6 +7,25 @@ from task_runner.runner import ROOM_MESSAGES
 def handle_message(message):
     print(message, request.sid)
 
+def emit_console_log(org_team, json):
+    """
+    Replay the console of a running task from the byte offset the client has seen,
+    the client asks for more by the event "replay" with the next offset if there is
+    """
+    task_id = json['task_id']
+    if org_team not in ROOM_MESSAGES or task_id not in ROOM_MESSAGES[org_team] or not ROOM_MESSAGES[org_team][task_id]:
+        return
+    console = ROOM_MESSAGES[org_team][task_id]
+    offset = int(json.get('offset', 0))
+    message, next_offset = console.read(offset)
+    emit('console log', {
+        'task_id': task_id,
+        'message': message,
+        'offset': offset,
+        'next_offset': next_offset,
+        'more': next_offset < console.size
+    })
+
 def handle_join_room(json):
     if 'X-Token' not in json:
         return
@@ -18,9 +37,7 @@ def handle_join_room(json):
 
     if 'task_id' not in json:
         return
-    task_id = json['task_id']
-    if org_team in ROOM_MESSAGES and task_id in ROOM_MESSAGES[org_team] and ROOM_MESSAGES[org_team][task_id]:
-        emit('console log', {'task_id': task_id, 'message': ROOM_MESSAGES[org_team][task_id].getvalue()})
+    emit_console_log(org_team, json)
 
 def handle_enter_room(json):
     if 'X-Token' not in json:
@@ -32,9 +49,17 @@ def handle_enter_room(json):
 
     if 'task_id' not in json:
         return
-    task_id = json['task_id']
-    if org_team in ROOM_MESSAGES and task_id in ROOM_MESSAGES[org_team] and ROOM_MESSAGES[org_team][task_id]:
-        emit('console log', {'task_id': task_id, 'message': ROOM_MESSAGES[org_team][task_id].getvalue()})
+    emit_console_log(org_team, json)
+
+def handle_replay(json):
+    if 'X-Token' not in json:
+        return
+    if not Auth.is_user_authenticated(json['X-Token']):
+        return
+
+    if 'task_id' not in json:
+        return
+    emit_console_log(get_room_id(json), json)
 
 def handle_leave_room(json):
     if 'X-Token' not in json:
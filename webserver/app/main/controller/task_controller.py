@@ -1,20 +1,28 @@
+import math
 import os
+import uuid
 from pathlib import Path
 from datetime import date, datetime, timedelta
 
-from flask import request, Response, send_from_directory, current_app
+from flask import request, current_app
 from flask_restx import Resource
+from bson import ObjectId
 from mongoengine import ValidationError
+from mongoengine.queryset.visitor import Q
 
 from ..util.decorator import token_required, organization_team_required_by_args, organization_team_required_by_json, task_required
 from ..util.get_path import get_test_result_path
-from ..util import push_event, js2python_bool
+from ..util import push_event, push_events, js2python_bool, get_room_id
+from ..util.console_log import ConsoleLogReader, CONSOLE_LOG_READ_LIMIT
 from ..util.tarball import path_to_dict
-from ..model.database import Task, Test, Endpoint, TaskQueue, EVENT_CODE_CANCEL_TASK, EVENT_CODE_START_TASK, QUEUE_PRIORITY_DEFAULT, QUEUE_PRIORITY_MAX, QUEUE_PRIORITY_MIN
+from ..util.result_file import send_result_file, drop_compressed_siblings
+from ..model.database import Task, Test, Endpoint, TaskQueue, QueuedTask, User, EVENT_CODE_CANCEL_TASK, EVENT_CODE_START_TASK, QUEUE_PRIORITY_DEFAULT, QUEUE_PRIORITY_MAX, QUEUE_PRIORITY_MIN, \
+        TASK_TRACE_PHASES
 from ..util.dto import TaskDto
 # from ..util.dto import Organization_team as _organization_team
 from ..config import get_config
 from ..util.response import response_message, EINVAL, ENOENT, SUCCESS, ERANGE, EPERM, UNKNOWN_ERROR
+from task_runner.runner import ROOM_MESSAGES
 
 api = TaskDto.api
 _task = TaskDto.task
@@ -22,6 +30,19 @@ _organization_team = TaskDto.organization_team
 _task_update = TaskDto.task_update
 _task_cancel = TaskDto.task_cancel
 _task_stat = TaskDto.task_stat
+_task_bulk = TaskDto.task_bulk
+_task_bulk_cancel = TaskDto.task_bulk_cancel
+
+TASK_BULK_LIMIT = 1000
+TASK_COST_KEYS = ('cpu_time', 'peak_rss', 'read_bytes', 'write_bytes', 'wall_time')
+TASK_LATENCY_PERCENTILES = (50, 90, 95, 99)
+TASK_LATENCY_LIMIT = 10000
+
+def percentile(values, p):
+    """
+    The nearest-rank percentile of the sorted values
+    """
+    return values[max(math.ceil(len(values) * p / 100), 1) - 1]
 
 @api.route('/result')
 class TaskStatistics(Resource):
@@ -40,8 +61,7 @@ class TaskStatistics(Resource):
         if not os.path.exists(result_dir):
             return response_message(ENOENT, 'Task result directory not found'), 404
 
-        with open(result_dir / 'output.xml', encoding='utf-8') as f:
-            return Response(f.read(), mimetype='text/xml')
+        return send_result_file(Path(os.getcwd()) / result_dir, 'output.xml', mimetype='text/xml')
 
 @api.route('/result_files')
 class ScriptDownloadList(Resource):
@@ -60,7 +80,7 @@ class ScriptDownloadList(Resource):
         if not os.path.exists(result_dir):
             return response_message(ENOENT, 'Task result directory not found'), 404
 
-        result_files = path_to_dict(result_dir)
+        result_files = drop_compressed_siblings(path_to_dict(result_dir))
 
         return response_message(SUCCESS, files=result_files)
 
@@ -83,7 +103,350 @@ class ScriptDownload(Resource):
         task = kwargs['task']
 
         result_dir = get_test_result_path(task)
-        return send_from_directory(Path(os.getcwd()) / result_dir, file_path, as_attachment=True)
+        return send_result_file(Path(os.getcwd()) / result_dir, file_path, as_attachment=True)
+
+@api.route('/cost')
+class TaskCost(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @api.doc('rank_the_test_suites_by_cost')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('days', default=7, description='Rank the tasks run in the last days')
+    @api.param('sort_by', default='cpu_time', description='One of ' + ', '.join(TASK_COST_KEYS))
+    @api.param('limit', default=20, description='The number of test suites to return')
+    def get(self, **kwargs):
+        """
+        Rank the test suites by the resources their robot processes used
+
+        The usage of the tasks run in the last days is summed up per test suite, the peak RSS is
+        the largest one of them. The costliest test suites come first.
+        """
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        days = request.args.get('days', default=7, type=int)
+        sort_by = request.args.get('sort_by', default='cpu_time')
+        limit = request.args.get('limit', default=20, type=int)
+        if days <= 0 or limit <= 0:
+            return response_message(EINVAL, 'Field days and limit should be larger than 0'), 400
+        if sort_by not in TASK_COST_KEYS:
+            return response_message(EINVAL, 'Field sort_by should be one of ' + ', '.join(TASK_COST_KEYS)), 400
+
+        group = {'_id': '$test', 'test_suite': {'$first': '$test_suite'}, 'tasks': {'$sum': 1}}
+        for key in TASK_COST_KEYS:
+            group[key] = {'$max' if key == 'peak_rss' else '$sum': '$resources.' + key}
+        pipeline = [
+            {'$match': {'organization': organization.pk, 'team': team.pk if team else None,
+                        'run_date': {'$gte': datetime.utcnow() - timedelta(days=days)},
+                        'resources.cpu_time': {'$exists': True}}},
+            {'$group': group},
+            {'$sort': {sort_by: -1}},
+            {'$limit': limit},
+        ]
+        suites = list(Task._get_collection().aggregate(pipeline))
+        paths = {test.pk: test.path for test in Test.objects(pk__in=[suite['_id'] for suite in suites]).only('path')}
+        for suite in suites:
+            suite['path'] = paths.get(suite['_id'], '')
+            suite['cpu_time_per_task'] = suite['cpu_time'] / suite['tasks']
+            suite['wall_time_per_task'] = suite['wall_time'] / suite['tasks']
+            del suite['_id']
+        return response_message(SUCCESS, test_suites=suites)
+
+@api.route('/trace')
+class TaskTrace(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @task_required
+    @api.doc('get_the_task_trace')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('task_id', description='The task ID')
+    def get(self, **kwargs):
+        """
+        Get the timeline of a task and the seconds spent in each phase
+
+        A phase is null if the task hasn't passed it, eg. startup and execution of a task which
+        calls no remote keyword.
+        """
+        task = kwargs['task']
+        marks = {mark: date.isoformat() for mark, date in task.trace_marks().items()}
+        return response_message(SUCCESS, status=task.status, marks=marks, phases=task.trace_phases())
+
+@api.route('/latency')
+class TaskLatency(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @api.doc('get_the_latency_percentiles_of_the_task_phases')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('days', default=7, description='Take the tasks finished in the last days')
+    @api.param('endpoint_uid', description='Take only the tasks run on the endpoint')
+    @api.param('test_suite', description='Take only the tasks of the test suite')
+    def get(self, **kwargs):
+        """
+        Get the percentiles of the seconds the finished tasks spent in each phase
+
+        At most the latest 10000 finished tasks are taken.
+        """
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        days = request.args.get('days', default=7, type=int)
+        if days <= 0:
+            return response_message(EINVAL, 'Field days should be larger than 0'), 400
+        query = {'organization': organization, 'team': team,
+                 'trace__finished__gte': datetime.utcnow() - timedelta(days=days)}
+        endpoint_uid = request.args.get('endpoint_uid', default=None)
+        if endpoint_uid:
+            endpoint = Endpoint.objects(uid=endpoint_uid, organization=organization, team=team).first()
+            if not endpoint:
+                return response_message(ENOENT, 'Endpoint not found'), 404
+            query['endpoint_run'] = endpoint
+        test_suite = request.args.get('test_suite', default=None)
+        if test_suite:
+            query['test_suite'] = test_suite
+
+        samples = {phase: [] for phase, _, _ in TASK_TRACE_PHASES}
+        tasks = Task.objects(**query).only('schedule_date', 'trace').order_by('-schedule_date').limit(TASK_LATENCY_LIMIT)
+        count = 0
+        for task in tasks:
+            count += 1
+            for phase, seconds in task.trace_phases().items():
+                if seconds is not None:
+                    samples[phase].append(seconds)
+
+        phases = {}
+        for phase, values in samples.items():
+            values.sort()
+            phases[phase] = {'count': len(values)}
+            if values:
+                phases[phase]['mean'] = sum(values) / len(values)
+                phases[phase]['max'] = values[-1]
+                for p in TASK_LATENCY_PERCENTILES:
+                    phases[phase]['p{}'.format(p)] = percentile(values, p)
+        return response_message(SUCCESS, tasks=count, phases=phases)
+
+@api.route('/console')
+class TaskConsole(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @task_required
+    @api.doc('get_the_console_log')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('task_id', description='The task ID')
+    @api.param('offset', description='The byte offset to read from, poll with the returned next_offset to follow the log')
+    @api.param('limit', description='The maximum bytes to read from the offset')
+    @api.param('start_line', description='The line number to read from')
+    @api.param('lines', default=1000, description='The number of lines to read, the last lines if neither offset nor start_line is specified')
+    def get(self, **kwargs):
+        """Get a byte range, a line range or the tail of the console log of a task"""
+        task = kwargs['task']
+
+        offset = request.args.get('offset', default=None, type=int)
+        limit = request.args.get('limit', default=CONSOLE_LOG_READ_LIMIT, type=int)
+        start_line = request.args.get('start_line', default=None, type=int)
+        lines = request.args.get('lines', default=1000, type=int)
+        if limit <= 0 or lines <= 0:
+            return response_message(EINVAL, 'Field limit and lines should be larger than 0'), 400
+        limit = min(limit, CONSOLE_LOG_READ_LIMIT)
+
+        try:
+            log = ConsoleLogReader(get_test_result_path(task))
+        except FileNotFoundError:
+            return response_message(ENOENT, 'Console log not found'), 404
+
+        with log:
+            size = log.size
+            if offset is not None:
+                data, next_offset = log.read(offset, limit)
+                message = data.decode('utf-8', errors='replace')
+                if offset >= size:
+                    # the output not written to the log yet is still in the console buffer of the running task
+                    room_id = get_room_id(str(task.organization.id), str(task.team.id) if task.team else '')
+                    console = ROOM_MESSAGES.get(room_id, {}).get(str(task.id))
+                    if console:
+                        message, next_offset = console.read(offset, limit)
+                        size = console.size
+                return response_message(SUCCESS, message=message, offset=offset, next_offset=next_offset, size=size)
+            if start_line is not None:
+                ret, next_offset = log.read_lines(start_line, lines)
+            else:
+                ret, start_line, next_offset = log.tail(lines)
+            return response_message(SUCCESS, lines=ret, start_line=start_line, next_offset=next_offset, size=size)
+
+@api.route('/bulk')
+class TaskBulk(Resource):
+    @token_required
+    @organization_team_required_by_json
+    @api.doc('run_test_suites_in_bulk')
+    @api.expect(_task_bulk)
+    def post(self, **kwargs):
+        """
+        Run many test suites at once
+
+        A task is created for each test suite and each of its variable sets, a parallelized one
+        for each endpoint as well. The tasks are validated and queued in bulk, each endpoint
+        gets one start event for all its tasks.
+        """
+        data = request.json
+        if data is None:
+            return response_message(EINVAL, 'The request data is empty'), 400
+        items = data.get('tasks', None)
+        if not isinstance(items, list) or len(items) == 0:
+            return response_message(EINVAL, 'Field tasks should be a non-empty list'), 400
+
+        organization = kwargs['organization']
+        team = kwargs['team']
+        user = kwargs['user']
+
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                return response_message(EINVAL, 'Task {} should be a dictionary'.format(i)), 400
+            if item.get('test_suite', None) == None or item.get('path', None) == None:
+                return response_message(EINVAL, 'Task {}: Field test_suite and path are required'.format(i)), 400
+            endpoint_list = item.get('endpoint_list', None)
+            if not isinstance(endpoint_list, list) or len(endpoint_list) == 0:
+                return response_message(EINVAL, 'Task {}: Endpoint list should be a non-empty list'.format(i)), 400
+            try:
+                item['endpoint_list'] = [str(uuid.UUID(uid)) for uid in endpoint_list]
+                item['priority'] = int(item.get('priority', QUEUE_PRIORITY_DEFAULT))
+            except (TypeError, ValueError, AttributeError):
+                return response_message(EINVAL, 'Task {}: Endpoint list or priority is invalid'.format(i)), 400
+            if item['priority'] < QUEUE_PRIORITY_MIN or item['priority'] > QUEUE_PRIORITY_MAX:
+                return response_message(ERANGE, 'Task {}: Task priority is out of range'.format(i)), 400
+            variable_sets = item.get('variable_sets', [item.get('variables', {})])
+            if not isinstance(variable_sets, list) or len(variable_sets) == 0 or \
+                    not all(isinstance(variables, dict) for variables in variable_sets):
+                return response_message(EINVAL, 'Task {}: Variables should be a dictionary'.format(i)), 400
+            item['variable_sets'] = variable_sets
+            if not isinstance(item.get('test_cases', []), list):
+                return response_message(EINVAL, 'Task {}: Testcases should be a list'.format(i)), 400
+
+        count = sum(len(item['variable_sets']) * (len(item['endpoint_list']) if js2python_bool(item.get('parallelization', False)) else 1)
+                    for item in items)
+        if count > TASK_BULK_LIMIT:
+            return response_message(ERANGE, 'Too many tasks, at most {} tasks at once'.format(TASK_BULK_LIMIT)), 400
+
+        tests = {}
+        for test in Test.objects(organization=organization, team=team,
+                                 test_suite__in=list({item['test_suite'] for item in items}),
+                                 path__in=list({item['path'] for item in items})):
+            tests.setdefault((test.test_suite, test.path), []).append(test)
+
+        uids = list({uid for item in items for uid in item['endpoint_list']})
+        endpoints = {str(endpoint.uid): endpoint for endpoint in Endpoint.objects(uid__in=uids, organization=organization, team=team)}
+        if len(endpoints) != len(uids):
+            return response_message(EINVAL, 'An uid in the endpoint list is invalid'), 400
+
+        endpoint_ids = [endpoint.pk for endpoint in endpoints.values()]
+        queues = set()
+        busy = set(QueuedTask._get_collection().distinct('endpoint', {'endpoint': {'$in': endpoint_ids}}))
+        for q in TaskQueue.objects(endpoint__in=endpoint_ids, organization=organization, team=team).only('endpoint', 'priority', 'running_task').as_pymongo():
+            queues.add((q['endpoint'], q['priority']))
+            if q.get('running_task'):
+                busy.add(q['endpoint'])
+
+        tasks = []
+        entries = []
+        for i, item in enumerate(items):
+            test = tests.get((item['test_suite'], item['path']), [])
+            if len(test) == 0:
+                return response_message(ENOENT, 'Task {}: The requested test suite is not found'.format(i)), 404
+            if len(test) != 1:
+                return response_message(EINVAL, 'Task {}: Found duplicate test suites'.format(i)), 401
+            for uid in item['endpoint_list']:
+                if (endpoints[uid].pk, item['priority']) not in queues:
+                    return response_message(ENOENT, 'Task {}: Task queue not found for endpoint {}'.format(i, uid)), 404
+
+            parallelization = js2python_bool(item.get('parallelization', False))
+            for variables in item['variable_sets']:
+                for endpoint_uids in ([[uid] for uid in item['endpoint_list']] if parallelization else [item['endpoint_list']]):
+                    task = Task(id=ObjectId(), test=test[0], test_suite=item['test_suite'], testcases=item.get('test_cases', []),
+                                endpoint_list=item['endpoint_list'], priority=item['priority'], parallelization=parallelization,
+                                variables=variables, tester=user, upload_dir=item.get('upload_dir', ''),
+                                organization=organization, team=team)
+                    try:
+                        task.validate()
+                    except ValidationError:
+                        return response_message(EINVAL, 'Task {}: Task validation failed'.format(i)), 400
+                    tasks.append(task)
+                    entries.extend((task, endpoints[uid]) for uid in endpoint_uids)
+
+        Task.objects.insert(tasks, load_bulk=False)
+        TaskQueue.push_many(entries)
+
+        queued = {}
+        running = {}
+        for task, endpoint in entries:
+            uid = str(endpoint.uid)
+            queued.setdefault(uid, []).append(str(task.id))
+            if endpoint.pk not in busy and (uid not in running or running[uid].priority < task.priority):
+                running[uid] = task
+        messages = [{'endpoint_uid': uid, 'task_ids': task_ids} for uid, task_ids in queued.items()]
+        if not push_events(organization, team, EVENT_CODE_START_TASK, messages):
+            return response_message(EPERM, 'Pushing the event to event queue failed'), 403
+
+        return response_message(SUCCESS, succeeded=[str(task.id) for task in tasks],
+                                running=list({str(task.id) for task in running.values()}))
+
+    @token_required
+    @organization_team_required_by_json
+    @api.doc('cancel_tasks_in_bulk')
+    @api.expect(_task_bulk_cancel)
+    def delete(self, **kwargs):
+        """
+        Cancel all the tasks matching a filter
+
+        The waiting and running tasks are matched unless the field status is given. A cancel
+        event is pushed for each task matched, they are pushed at once.
+        """
+        data = request.json
+        if data is None:
+            return response_message(EINVAL, 'The request data is empty'), 400
+
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        query = Q(organization=organization, team=team)
+        status = data.get('status', ['waiting', 'running'])
+        if not isinstance(status, list) or not set(status) <= {'waiting', 'running'}:
+            return response_message(EINVAL, 'Field status should be a list of waiting or running'), 400
+        query &= Q(status__in=status)
+        task_ids = data.get('task_ids', None)
+        if task_ids is not None:
+            if not isinstance(task_ids, list) or not all(ObjectId.is_valid(task_id) for task_id in task_ids):
+                return response_message(EINVAL, 'Field task_ids should be a list of task ids'), 400
+            query &= Q(pk__in=task_ids)
+        if data.get('test_suite', None):
+            query &= Q(test_suite=data['test_suite'])
+        if data.get('priority', None) is not None:
+            query &= Q(priority=data['priority'])
+        if data.get('endpoint_uid', None):
+            endpoint = Endpoint.objects(uid=data['endpoint_uid'], organization=organization, team=team).first()
+            if not endpoint:
+                return response_message(ENOENT, 'Endpoint not found'), 404
+            query &= Q(endpoint_list=str(endpoint.uid)) | Q(endpoint_run=endpoint)
+        if data.get('tester', None):
+            tester = User.objects(email=data['tester']).first()
+            if not tester:
+                return response_message(ENOENT, 'Tester not found'), 404
+            query &= Q(tester=tester)
+
+        tasks = list(Task.objects(query).only('id', 'priority', 'endpoint_run').limit(TASK_BULK_LIMIT + 1).as_pymongo())
+        if len(tasks) > TASK_BULK_LIMIT:
+            return response_message(ERANGE, 'Too many tasks, at most {} tasks at once'.format(TASK_BULK_LIMIT)), 400
+
+        endpoint_ids = list({task['endpoint_run'] for task in tasks if task.get('endpoint_run')})
+        uids = {endpoint.pk: str(endpoint.uid) for endpoint in Endpoint.objects(pk__in=endpoint_ids).only('uid')}
+        messages = [{'endpoint_uid': uids.get(task.get('endpoint_run'), ''),
+                     'priority': task.get('priority', QUEUE_PRIORITY_DEFAULT),
+                     'task_id': str(task['_id'])} for task in tasks]
+        if not push_events(organization, team, EVENT_CODE_CANCEL_TASK, messages):
+            return response_message(EPERM, 'Pushing the event to event queue failed'), 403
+
+        return response_message(SUCCESS, cancelled=[message['task_id'] for message in messages])
 
 @api.route('/')
 class TaskController(Resource):
@@ -252,10 +615,10 @@ class TaskController(Resource):
                         failed.append(str(new_task.id))
                         current_app.logger.error('Task queue not found')
                     else:
-                        if not taskqueue.running_task and len(taskqueue.tasks) == 0:
+                        if not taskqueue.running_task and taskqueue.size() == 0:
                             running.append(str(new_task.id))
                         ret = taskqueue.push(new_task)
-                        if ret == None:
+                        if not ret:
                             failed.append(str(new_task.id))
                             current_app.logger.error('Failed to push task to the task queue')
                         else:
@@ -278,10 +641,10 @@ class TaskController(Resource):
                     failed.append(str(task.id))
                     current_app.logger.error('Task queue not found')
                 else:
-                    if not taskqueue.running_task and len(taskqueue.tasks) == 0:
+                    if not taskqueue.running_task and taskqueue.size() == 0:
                         running.append(str(task.id))
                     ret = taskqueue.push(task)
-                    if ret == None:
+                    if not ret:
                         failed.append(str(task.id))
                         current_app.logger.error('Failed to push task to the task queue')
                     else:
@@ -12,7 +12,7 @@ from mongoengine import DoesNotExist, ValidationError
 from ..util.decorator import token_required, organization_team_required_by_args, organization_team_required_by_json
 from ..util.get_path import get_test_results_root
 from ..config import get_config
-from ..model.database import QUEUE_PRIORITY_MAX, QUEUE_PRIORITY_MIN, Endpoint, Task, TestResult
+from ..model.database import QUEUE_PRIORITY_MAX, QUEUE_PRIORITY_MIN, CaseResult, Endpoint, Task, TestResult
 from ..util.dto import TestResultDto
 from ..util.response import response_message, ENOENT, EINVAL, SUCCESS, EPERM
 
@@ -22,6 +22,7 @@ _record_test_result = TestResultDto.record_test_result
 _test_result = TestResultDto.test_result
 
 USERS_ROOT = Path(get_config().USERS_ROOT)
+CASE_HISTORY_LIMIT = 1000
 
 
 @api.route('/')
@@ -191,3 +192,142 @@ class TestResultUpload(Resource):
         except ValidationError as e:
             current_app.logger.exception(e)
             return response_message(EPERM, "Test result validation failed"), 400
+
+@api.route('/cases')
+class CaseResultHistory(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @api.doc('get_the_history_of_the_test_cases')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('test_suite', description='The test suite name')
+    @api.param('name', description='The test case name')
+    @api.param('status', description='PASS, FAIL or SKIP')
+    @api.param('tag', description='Take only the test cases having the tag')
+    @api.param('days', default=30, description='Take the test cases run in the last days')
+    @api.param('limit', default=100, description='The number of test cases to return')
+    def get(self, **kwargs):
+        """
+        Get the results of the test cases parsed from the output.xml of the tasks, the latest ones first
+        """
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        days = request.args.get('days', default=30, type=int)
+        limit = request.args.get('limit', default=100, type=int)
+        if days <= 0 or limit <= 0:
+            return response_message(EINVAL, 'Field days and limit should be larger than 0'), 400
+        query = {'organization': organization, 'team': team, 'start_date__gte': datetime.utcnow() - timedelta(days=days)}
+        for field in ('test_suite', 'name', 'status'):
+            value = request.args.get(field, default=None)
+            if value:
+                query[field] = value
+        tag = request.args.get('tag', default=None)
+        if tag:
+            query['tags'] = tag
+
+        cases = CaseResult.objects(**query).order_by('-start_date').limit(min(limit, CASE_HISTORY_LIMIT)) \
+                .exclude('organization', 'team').as_pymongo()
+        ret = []
+        for case in cases:
+            case['id'] = str(case.pop('_id'))
+            case['task'] = str(case['task'])
+            case['endpoint'] = str(case['endpoint']) if case.get('endpoint') else None
+            ret.append(case)
+        return response_message(SUCCESS, cases=ret)
+
+@api.route('/flaky')
+class CaseResultFlaky(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @api.doc('rank_the_flaky_test_cases')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('test_suite', description='Take only the test cases of the test suite')
+    @api.param('days', default=7, description='Take the test cases run in the last days')
+    @api.param('limit', default=20, description='The number of test cases to return')
+    def get(self, **kwargs):
+        """
+        Rank the test cases which both passed and failed by how often their status flipped from run to run
+        """
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        days = request.args.get('days', default=7, type=int)
+        limit = request.args.get('limit', default=20, type=int)
+        if days <= 0 or limit <= 0:
+            return response_message(EINVAL, 'Field days and limit should be larger than 0'), 400
+        match = {'organization': organization.pk, 'team': team.pk if team else None,
+                 'start_date': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+        test_suite = request.args.get('test_suite', default=None)
+        if test_suite:
+            match['test_suite'] = test_suite
+
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'start_date': 1}},
+            {'$group': {'_id': {'test_suite': '$test_suite', 'name': '$name'},
+                        'statuses': {'$push': '$status'},
+                        'passed': {'$sum': {'$cond': [{'$eq': ['$status', 'PASS']}, 1, 0]}},
+                        'failed': {'$sum': {'$cond': [{'$eq': ['$status', 'FAIL']}, 1, 0]}}}},
+            {'$match': {'passed': {'$gt': 0}, 'failed': {'$gt': 0}}},
+        ]
+        cases = []
+        for case in CaseResult._get_collection().aggregate(pipeline, allowDiskUse=True):
+            statuses = case['statuses']
+            flips = sum(1 for a, b in zip(statuses, statuses[1:]) if a != b)
+            cases.append({
+                'test_suite': case['_id']['test_suite'],
+                'name': case['_id']['name'],
+                'runs': len(statuses),
+                'passed': case['passed'],
+                'failed': case['failed'],
+                'flips': flips,
+                'flip_rate': flips / (len(statuses) - 1),
+                'last_status': statuses[-1],
+            })
+        cases.sort(key=lambda case: (case['flip_rate'], case['runs']), reverse=True)
+        return response_message(SUCCESS, cases=cases[:limit])
+
+@api.route('/trend')
+class CaseResultTrend(Resource):
+    @token_required
+    @organization_team_required_by_args
+    @api.doc('get_the_daily_trend_of_the_test_cases')
+    @api.param('organization', description='The organization ID')
+    @api.param('team', description='The team ID')
+    @api.param('test_suite', description='The test suite name')
+    @api.param('name', description='Take only the test case')
+    @api.param('days', default=30, description='Take the test cases run in the last days')
+    def get(self, **kwargs):
+        """
+        Get the runs, the pass rate and the mean duration of the test cases per day
+        """
+        organization = kwargs['organization']
+        team = kwargs['team']
+
+        days = request.args.get('days', default=30, type=int)
+        if days <= 0:
+            return response_message(EINVAL, 'Field days should be larger than 0'), 400
+        test_suite = request.args.get('test_suite', default=None)
+        if not test_suite:
+            return response_message(EINVAL, 'Field test_suite is required'), 400
+        match = {'organization': organization.pk, 'team': team.pk if team else None, 'test_suite': test_suite,
+                 'start_date': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+        name = request.args.get('name', default=None)
+        if name:
+            match['name'] = name
+
+        pipeline = [
+            {'$match': match},
+            {'$group': {'_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$start_date'}},
+                        'runs': {'$sum': 1},
+                        'passed': {'$sum': {'$cond': [{'$eq': ['$status', 'PASS']}, 1, 0]}},
+                        'duration': {'$avg': '$duration'}}},
+            {'$sort': {'_id': 1}},
+        ]
+        trend = []
+        for day in CaseResult._get_collection().aggregate(pipeline):
+            trend.append({'date': day['_id'], 'runs': day['runs'], 'passed': day['passed'],
+                          'pass_rate': day['passed'] / day['runs'], 'mean_duration': day['duration']})
+        return response_message(SUCCESS, trend=trend)
@@ -3,10 +3,13 @@ import time
 import jwt
 import re
 
+from bson import DBRef
 from flask import current_app
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
 from .. import flask_bcrypt
 from ..config import key
-from mongoengine import Document, StringField, EmailField, ListField, ReferenceField, DateTimeField, DictField, URLField, BooleanField, IntField, UUIDField, FloatField
+from mongoengine import Document, NotUniqueError, ValidationError, StringField, EmailField, ListField, ReferenceField, DateTimeField, DictField, URLField, BooleanField, IntField, UUIDField, FloatField
+from mongoengine.queryset.visitor import Q
 from urllib.parse import urlparse
 
 QUEUE_PRIORITY_MIN = 1
@@ -23,7 +26,15 @@ EVENT_CODE_TASKQUEUE_DELETE = 205
 EVENT_CODE_EXIT_EVENT_TASK = 206
 EVENT_CODE_DELETE_ENDPOINT = 207
 
-LOCK_TIMEOUT = 50
+# the phases of a task's life between the marks of its trace, the task is scheduled at its schedule_date
+TASK_TRACE_PHASES = (
+    ('dispatch', 'scheduled', 'dispatched'),  # the start event waits in the event queue
+    ('queue', 'dispatched', 'popped'),  # the task waits for the endpoint
+    ('launch', 'popped', 'launched'),  # the robot arguments are prepared and the process is spawned
+    ('startup', 'launched', 'first_keyword'),  # robot starts up until it calls the first remote keyword
+    ('execution', 'first_keyword', 'finished'),
+    ('total', 'scheduled', 'finished'),
+)
 
 class IPAddressField(StringField):
     """A field that validates input as an IP address, may including port.
@@ -210,9 +221,31 @@ class Task(Document):
     test_results = ListField(ReferenceField('TestResult'))
     organization = ReferenceField(Organization) # embedded document from Test
     team = ReferenceField(Team) # embedded document from Test
+    resources = DictField()  # cpu_time, peak_rss, read_bytes, write_bytes, wall_time and processes of the robot process tree
+    trace = DictField()  # {mark: datetime} of the marks of TASK_TRACE_PHASES the task has passed
 
     meta = {'collection': 'tasks'}
 
+    def trace_marks(self):
+        marks = dict(self.trace or {})
+        if self.schedule_date:
+            marks['scheduled'] = self.schedule_date
+        return marks
+
+    def trace_phases(self):
+        '''
+        Return {phase: seconds} of the phases the task has passed, a phase is None if any of its marks is missing
+        '''
+        marks = self.trace_marks()
+        phases = {}
+        for phase, start, end in TASK_TRACE_PHASES:
+            if start in marks and end in marks:
+                # the start event may be handled after an earlier event of the endpoint has launched the task
+                phases[phase] = max((marks[end] - marks[start]).total_seconds(), 0)
+            else:
+                phases[phase] = None
+        return phases
+
 class Endpoint(Document):
     schema_version = StringField(max_length=10, default='1')
     name = StringField(max_length=100)
@@ -226,60 +259,178 @@ class Endpoint(Document):
 
     meta = {'collection': 'endpoints'}
 
+class QueuedTask(Document):
+    '''
+    A task waiting in the queue of an endpoint, the next task to run is the
+    oldest one of the highest priority
+    '''
+    schema_version = StringField(max_length=10, default='1')
+    task = ReferenceField(Task, required=True)
+    endpoint = ReferenceField(Endpoint, required=True)
+    priority = IntField(min_value=QUEUE_PRIORITY_MIN, max_value=QUEUE_PRIORITY_MAX, default=QUEUE_PRIORITY_DEFAULT)
+    enqueue_date = DateTimeField(default=datetime.datetime.utcnow)
+    organization = ReferenceField(Organization)
+    team = ReferenceField(Team)
+    claimed_by = StringField(max_length=100)  # the runner popping it, see TaskQueue.pop_next()
+    claimed_at = DateTimeField()
+
+    meta = {
+        'collection': 'queued_tasks',
+        'indexes': [
+            {'fields': ['endpoint', '-priority', 'enqueue_date', 'id']},
+            'task',
+            {'fields': ['claimed_by'], 'sparse': True}
+        ]
+    }
+
+QUEUED_TASK_ORDER = [('priority', DESCENDING), ('enqueue_date', ASCENDING), ('_id', ASCENDING)]
+
 class TaskQueue(Document):
     '''
-    Per endpoint per priority queue
+    Per endpoint per priority queue, the queued tasks are stored in QueuedTask
     '''
     schema_version = StringField(max_length=10, default='1')
     priority = IntField(min_value=QUEUE_PRIORITY_MIN, max_value=QUEUE_PRIORITY_MAX, default=QUEUE_PRIORITY_DEFAULT)
-    tasks = ListField(ReferenceField(Task))
     endpoint = ReferenceField(Endpoint)
     running_task = ReferenceField(Task)
-    rw_lock = BooleanField(default=False)
+    rw_lock = BooleanField(default=False)  # obsolete, queue operations are atomic updates
     organization = ReferenceField(Organization)
     team = ReferenceField(Team)
     to_delete = BooleanField(default=False)
 
-    meta = {'collection': 'task_queues'}
-
-    def acquire_lock(self):
-        for i in range(LOCK_TIMEOUT):
-            ret = self.modify({'rw_lock': False}, rw_lock=True)
-            if ret:
-                return True
-            time.sleep(0.1)
-        else:
-            return False
+    meta = {
+        'collection': 'task_queues',
+        'strict': False  # the field tasks of old documents is migrated by migrate_embedded_tasks()
+    }
 
-    def release_lock(self):
-        self.modify(rw_lock=False)
+    @property
+    def queued(self):
+        return QueuedTask.objects(endpoint=self.endpoint, priority=self.priority, claimed_by=None)
 
-    def pop(self):
-        if not self.acquire_lock():
+    @property
+    def tasks(self):
+        return [q.task for q in self.queued.order_by('enqueue_date', 'id').select_related()]
+
+    def size(self):
+        return self.queued.count()
+
+    @classmethod
+    def pop_next(cls, endpoint, runner=None):
+        '''
+        Pop the oldest task of the highest priority queued for the endpoint and make it the running task
+        of its queue, return (task queue, task) or (None, None) if nothing is queued, the task is a DBRef
+        if it has been deleted
+
+        The task is claimed with one indexed query and removed from the queue only after it has become
+        the running task, a runner crashed in between leaves the claim to release_claims().
+        '''
+        collection = QueuedTask._get_collection()
+        ret = collection.find_one_and_update(
+            {'endpoint': endpoint.pk, 'claimed_by': None},
+            {'$set': {'claimed_by': runner or '', 'claimed_at': datetime.datetime.utcnow()}},
+            projection={'task': True, 'priority': True},
+            sort=QUEUED_TASK_ORDER)
+        if not ret:
+            return None, None
+        taskqueue = cls.objects(endpoint=endpoint, priority=ret['priority']).modify(new=True, set__running_task=ret['task'])
+        collection.delete_one({'_id': ret['_id']})
+        task = Task.objects(pk=ret['task']).first()
+        return taskqueue, task if task else DBRef(Task._get_collection_name(), ret['task'])
+
+    @classmethod
+    def release_claims(cls, endpoint=None, exclude_runner=None):
+        '''
+        Put the tasks claimed by pop_next() of the runners gone back to their queues, those which have
+        become the running task are removed, return the number of the tasks put back
+        '''
+        query = {'claimed_by': {'$nin': [None, exclude_runner]} if exclude_runner is not None else {'$ne': None}}
+        if endpoint:
+            query['endpoint'] = endpoint.pk
+        collection = QueuedTask._get_collection()
+        released = 0
+        for claim in collection.find(query, projection={'task': True, 'endpoint': True, 'priority': True, 'claimed_by': True}):
+            if cls.objects(endpoint=claim['endpoint'], priority=claim['priority'], running_task=claim['task']).count():
+                collection.delete_one({'_id': claim['_id']})
+                continue
+            ret = collection.update_one({'_id': claim['_id'], 'claimed_by': claim['claimed_by']},
+                                        {'$unset': {'claimed_by': '', 'claimed_at': ''}})
+            released += ret.modified_count
+        return released
+
+    @classmethod
+    def peek_next(cls, endpoint):
+        '''
+        Return the task to be popped next for the endpoint without removing it, None if nothing is queued
+        or the task has been deleted
+        '''
+        ret = QueuedTask._get_collection().find_one({'endpoint': endpoint.pk, 'claimed_by': None},
+                                                   projection={'task': True}, sort=QUEUED_TASK_ORDER)
+        if not ret:
             return None
-        if 'tasks' not in self or len(self.tasks) == 0:
-            task = None
-        else:
-            task = self.tasks[0]
-        self.modify(pop__tasks=-1)
-        self.modify(running_task=task)
-        self.release_lock()
-        return task
+        return Task.objects(pk=ret['task']).first()
+
+    @classmethod
+    def queued_among(cls, endpoint, task_ids):
+        '''
+        Return the set of the ids among task_ids which are still queued for the endpoint, claimed or not
+        '''
+        return set(QueuedTask._get_collection().distinct('task', {'endpoint': endpoint.pk, 'task': {'$in': list(task_ids)}}))
 
     def push(self, task):
-        return self.modify(push__tasks=task)
-    
-    def flush(self, cancelled=False):
-        if not self.acquire_lock():
+        queued = QueuedTask(task=task, endpoint=self.endpoint, priority=self.priority,
+                            organization=self.organization, team=self.team)
+        try:
+            queued.save()
+        except ValidationError:
             return False
+        return True
+
+    @classmethod
+    def push_many(cls, entries):
+        '''
+        Queue the (task, endpoint) pairs at the priorities of the tasks with one bulk insert,
+        return the number of the tasks queued
+        '''
+        queued = [QueuedTask(task=task, endpoint=endpoint, priority=task.priority,
+                             organization=task.organization, team=task.team) for task, endpoint in entries]
+        if queued:
+            QueuedTask.objects.insert(queued, load_bulk=False)
+        return len(queued)
+
+    def remove(self, task):
+        return self.queued.filter(task=task).delete() > 0
+
+    def flush(self, cancelled=False):
+        queued = list(self.queued.as_pymongo().only('id', 'task'))
+        if not queued:
+            return True
+        QueuedTask.objects(pk__in=[q['_id'] for q in queued]).delete()
         if cancelled:
-            for task in self.tasks:
-                task.update(status='cancelled')
-        self.tasks = []
-        self.save()
-        self.release_lock()
+            Task.objects(pk__in=[q['task'] for q in queued]).update(status='cancelled')
         return True
 
+    @classmethod
+    def migrate_embedded_tasks(cls):
+        '''
+        Move the tasks embedded in the task queue documents of old versions to QueuedTask
+        '''
+        collection = cls._get_collection()
+        migrated = 0
+        for doc in collection.find({'tasks.0': {'$exists': True}}):
+            enqueue_date = datetime.datetime.utcnow()
+            QueuedTask._get_collection().insert_many([{
+                'schema_version': '1',
+                'task': task,
+                'endpoint': doc.get('endpoint'),
+                'priority': doc.get('priority', QUEUE_PRIORITY_DEFAULT),
+                'enqueue_date': enqueue_date + datetime.timedelta(milliseconds=i),
+                'organization': doc.get('organization'),
+                'team': doc.get('team'),
+            } for i, task in enumerate(doc['tasks'])])
+            collection.update_one({'_id': doc['_id']}, {'$unset': {'tasks': ''}})
+            migrated += len(doc['tasks'])
+        return migrated
+
 class TestResult(Document):
     schema_version = StringField(max_length=10, default='1')
     test_case = StringField(max_length=100, required=True)
@@ -293,6 +444,34 @@ class TestResult(Document):
 
     meta = {'collection': 'test_results'}
 
+class CaseResult(Document):
+    '''
+    The result of a test case parsed from the output.xml of a task, the history of a test case is an index scan
+    '''
+    schema_version = StringField(max_length=10, default='1')
+    task = ReferenceField(Task, required=True)
+    organization = ReferenceField(Organization)
+    team = ReferenceField(Team)
+    endpoint = ReferenceField(Endpoint)
+    test_suite = StringField(max_length=100)  # the test suite of the task
+    suite = StringField()  # long name of the robot suite containing the test case
+    name = StringField(required=True)
+    status = StringField(max_length=10)
+    start_date = DateTimeField()
+    duration = FloatField()
+    tags = ListField(StringField())
+    message = StringField()
+    failed_keyword = StringField()
+
+    meta = {
+        'collection': 'case_results',
+        'indexes': [
+            'task',
+            {'fields': ['organization', 'team', 'test_suite', 'name', '-start_date']},
+            {'fields': ['organization', 'team', '-start_date']},
+        ]
+    }
+
 class Event(Document):
     schema_version = StringField(max_length=10, default='1')
     code = IntField(required=True)
@@ -305,50 +484,96 @@ class Event(Document):
     meta = {'collection': 'events'}
 
 class EventQueue(Document):
+    '''
+    The event queue shared by all task runners has no runner, a runner
+    has its own queue for the events forwarded by the other runners
+    '''
     schema_version = StringField(max_length=10, default='1')
     events = ListField(ReferenceField(Event))
-    rw_lock = BooleanField(default=False)
+    rw_lock = BooleanField(default=False)  # obsolete, queue operations are atomic updates
+    runner = StringField(max_length=100)
+    heartbeat = DateTimeField()
 
     meta = {'collection': 'event_queues'}
 
-    def acquire_lock(self):
-        for i in range(LOCK_TIMEOUT):
-            ret = self.modify({'rw_lock': False}, rw_lock=True)
-            if ret:
-                return True
-            time.sleep(0.1)
-        else:
-            return False
-
-    def release_lock(self):
-        self.modify(rw_lock=False)
-
     def pop(self):
-        if not self.acquire_lock():
+        '''
+        Pop the first event in one atomic update,
+        return None if the queue is empty or a DBRef if the event has been deleted
+        '''
+        ret = self._get_collection().find_one_and_update(
+            {'_id': self.pk, 'events.0': {'$exists': True}},
+            {'$pop': {'events': -1}},
+            projection={'events': {'$slice': 1}},
+            return_document=ReturnDocument.BEFORE)
+        if not ret:
             return None
-        if 'events' not in self or len(self.events) == 0:
-            event = None
-        else:
-            event = self.events[0]
-        self.modify(pop__events=-1)
-        self.release_lock()
-        return event
+        event_id = ret['events'][0]
+        event = Event.objects(pk=event_id).first()
+        return event if event else DBRef(Event._get_collection_name(), event_id)
 
     def push(self, event):
-        return self.modify(push__events=event)
-    
+        return self.update(push__events=event) == 1
+
+    def push_many(self, events):
+        ret = self._get_collection().update_one({'_id': self.pk}, {'$push': {'events': {'$each': [e.pk for e in events]}}})
+        return ret.matched_count == 1
+
     def flush(self, cancelled=False):
-        if not self.acquire_lock():
+        ret = self._get_collection().find_one_and_update(
+            {'_id': self.pk}, {'$set': {'events': []}},
+            projection={'events': True},
+            return_document=ReturnDocument.BEFORE)
+        if not ret:
             return False
-        if cancelled:
-            for event in self.events:
-                event.update(status='Cancelled')
+        if cancelled and ret.get('events'):
+            Event.objects(pk__in=ret['events']).update(status='Cancelled')
         self.events = []
-        self.save()
-        self.release_lock()
         return True
 
 
+class EndpointLease(Document):
+    '''
+    The ownership of an endpoint's task queues by a task runner, it expires
+    unless the runner keeps renewing it
+    '''
+    schema_version = StringField(max_length=10, default='1')
+    endpoint = ReferenceField(Endpoint, required=True, unique=True)
+    runner = StringField(max_length=100, required=True)
+    expires = DateTimeField(required=True)
+
+    meta = {
+        'collection': 'endpoint_leases',
+        'indexes': ['runner', 'expires']
+    }
+
+    @classmethod
+    def claim(cls, endpoint, runner, ttl):
+        '''
+        Claim or renew the lease of the endpoint, return None if it's held by another runner
+        '''
+        now = datetime.datetime.utcnow()
+        query = Q(endpoint=endpoint) & (Q(runner=runner) | Q(expires__lt=now))
+        try:
+            return cls.objects(query).modify(upsert=True, new=True, set__runner=runner,
+                                             set__expires=now + datetime.timedelta(seconds=ttl))
+        except NotUniqueError:
+            return None
+
+    @classmethod
+    def renew_all(cls, runner, ttl):
+        expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl)
+        return cls.objects(runner=runner).update(set__expires=expires)
+
+    @classmethod
+    def release(cls, endpoint, runner):
+        return cls.objects(endpoint=endpoint, runner=runner).delete()
+
+    @classmethod
+    def owner(cls, endpoint):
+        lease = cls.objects(endpoint=endpoint, expires__gte=datetime.datetime.utcnow()).first()
+        return lease.runner if lease else None
+
 class Package(Document):
     schema_version = StringField(max_length=10, default='1')
     package_type = StringField(required=True)
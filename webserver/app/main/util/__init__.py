@@ -1,7 +1,9 @@
 import sys
+from bson import ObjectId
 from flask import current_app
 
 from ..model.database import *
+from .notifier import EVENT_NOTIFIER
 
 def push_event(organization, team, code, message=None):
     event = Event(organization=organization, team=team, code=code)
@@ -9,7 +11,7 @@ def push_event(organization, team, code, message=None):
         event.message = message
     event.save()
 
-    eventqueue = EventQueue.objects().first()
+    eventqueue = EventQueue.objects(runner=None).first()
     if not eventqueue:
         current_app.logger.error('Event queue not found')
         return False
@@ -17,6 +19,29 @@ def push_event(organization, team, code, message=None):
     if not eventqueue.push(event):
         current_app.logger.error('Failed to push the event')
         return False
+
+    EVENT_NOTIFIER.notify()
+    return True
+
+def push_events(organization, team, code, messages):
+    """
+    Push an event for each message with one bulk insert and one queue update
+    """
+    events = [Event(id=ObjectId(), organization=organization, team=team, code=code, message=message) for message in messages]
+    if not events:
+        return True
+    Event.objects.insert(events, load_bulk=False)
+
+    eventqueue = EventQueue.objects(runner=None).first()
+    if not eventqueue:
+        current_app.logger.error('Event queue not found')
+        return False
+
+    if not eventqueue.push_many(events):
+        current_app.logger.error('Failed to push the events')
+        return False
+
+    EVENT_NOTIFIER.notify()
     return True
 
 def get_room_id(*data):
@@ -0,0 +1,244 @@
+import bisect
+import os
+import struct
+import threading
+import time
+import zlib
+
+from task_runner.util.console import read_utf8
+
+CONSOLE_LOG_FILE = 'console.log.gz'
+CONSOLE_LOG_INDEX = 'console.log.idx'
+CONSOLE_LOG_BLOCK_SIZE = 64 * 1024
+CONSOLE_LOG_FLUSH_DELAY = 1
+CONSOLE_LOG_READ_LIMIT = 256 * 1024
+
+# an index record is written after each block: (end byte offset, end compressed offset, lines till the end)
+_RECORD = struct.Struct('<QQQ')
+
+
+class ConsoleLogWriter():
+    """
+    Write the console output of a task into a compressed log file in its result directory
+
+    The output is compressed in independent gzip members of at most `block_size` bytes,
+    the file is still a valid gzip file. An index file records where each member ends
+    so that any range of the log can be read by decompressing only the members covering it.
+
+    The members are compressed and written by a thread of the writer, write() only appends
+    the output to the pending member so that it's cheap for the process supervisor's loop.
+    A pending member is written out when it's full or has been pending for `flush_delay`
+    seconds, whether the task keeps writing or has gone quiet.
+    """
+    def __init__(self, result_dir, block_size=CONSOLE_LOG_BLOCK_SIZE, flush_delay=CONSOLE_LOG_FLUSH_DELAY):
+        self.block_size = block_size
+        self.flush_delay = flush_delay
+        self.size = 0
+        self.compressed_size = 0
+        self.lines = 0
+        self._pending = bytearray()
+        self._pending_since = None
+        self._closed = False
+        self._log = open(os.path.join(result_dir, CONSOLE_LOG_FILE), 'wb')
+        self._index = open(os.path.join(result_dir, CONSOLE_LOG_INDEX), 'wb')
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # keeps the members in order, taken before self._cond
+        self._thread = threading.Thread(target=self._run, name='console_log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        with self._cond:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+                self._cond.notify()
+            self._pending += data
+            if len(self._pending) >= self.block_size:
+                self._cond.notify()
+
+    def flush(self):
+        self._drain(force=True)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        with self._io_lock:
+            self._log.close()
+            self._index.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._pending) < self.block_size:
+                    if self._pending_since is None:
+                        self._cond.wait()
+                        continue
+                    timeout = self._pending_since + self.flush_delay - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                closed = self._closed
+            self._drain(force=closed)
+            if closed:
+                return
+
+    def _drain(self, force=False):
+        """
+        Write out the full members, and the partial one if it's due or `force` is True
+        """
+        with self._io_lock:
+            with self._cond:
+                blocks = []
+                while len(self._pending) >= self.block_size:
+                    blocks.append(bytes(self._pending[:self.block_size]))
+                    del self._pending[:self.block_size]
+                if self._pending and (force or time.monotonic() - self._pending_since >= self.flush_delay):
+                    blocks.append(bytes(self._pending))
+                    self._pending = bytearray()
+                if not self._pending:
+                    self._pending_since = None
+            for block in blocks:
+                self._write_block(block)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(wbits=31)
+        block = compressor.compress(data) + compressor.flush()
+        self._log.write(block)
+        self._log.flush()
+        self.size += len(data)
+        self.compressed_size += len(block)
+        self.lines += data.count(b'\n')
+        # the index is written after the block so that a reader never sees a record of missing data
+        self._index.write(_RECORD.pack(self.size, self.compressed_size, self.lines))
+        self._index.flush()
+
+class _Records():
+    """
+    A lazy sequence view of one field of the index records for bisecting
+    """
+    def __init__(self, log, field):
+        self.log = log
+        self.field = field
+
+    def __len__(self):
+        return self.log.blocks
+
+    def __getitem__(self, i):
+        return self.log._record(i)[self.field]
+
+class ConsoleLogReader():
+    """
+    Read ranges of a console log written by ConsoleLogWriter, it could be still being written
+
+    Byte offsets are the ones of the uncompressed output, the same as the offsets
+    sent with the live console messages. Lines are counted from 0.
+    """
+    def __init__(self, result_dir):
+        self._log = open(os.path.join(result_dir, CONSOLE_LOG_FILE), 'rb')
+        self._index = open(os.path.join(result_dir, CONSOLE_LOG_INDEX), 'rb')
+        self.blocks = os.fstat(self._index.fileno()).st_size // _RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+    @property
+    def size(self):
+        return self._record(self.blocks - 1)[0]
+
+    @property
+    def lines(self):
+        """
+        Number of the lines, a trailing line without the line break counts as well
+        """
+        if self.blocks == 0:
+            return 0
+        lines = self._record(self.blocks - 1)[2]
+        if not self._block(self.blocks - 1).endswith(b'\n'):
+            lines += 1
+        return lines
+
+    def read(self, offset=0, limit=CONSOLE_LOG_READ_LIMIT):
+        """
+        Read at most `limit` bytes from the byte offset, return the data and the offset following it
+
+        The read ends before a character split by the limit, the offset returned is where it starts.
+        """
+        offset = min(max(offset, 0), self.size)
+        end = min(offset + limit + 3, self.size)
+        data = bytearray()
+        i = bisect.bisect_right(_Records(self, 0), offset)
+        while offset + len(data) < end:
+            start = self._record(i - 1)[0]
+            block = self._block(i)
+            data += block[offset + len(data) - start:end - start]
+            i += 1
+        size = read_utf8(data, limit)
+        return bytes(data[:size]), offset + size
+
+    def read_lines(self, start=0, count=1000):
+        """
+        Read `count` lines from the line `start`, return the lines without line breaks and the byte offset following them
+        """
+        if self.blocks == 0:
+            return [], 0
+        start = max(start, 0)
+        # the line begins in the block holding the line break ending its previous line
+        i = min(bisect.bisect_left(_Records(self, 2), start), self.blocks - 1)
+        skip = start - self._record(i - 1)[2]
+        offset = self.size
+        lines = []
+        partial = b''
+        while i < self.blocks and len(lines) < count:
+            block = partial + self._block(i)
+            offset = self._record(i)[0] - len(block)
+            pos = 0
+            while len(lines) < count:
+                end = block.find(b'\n', pos)
+                if end < 0:
+                    break
+                if skip:
+                    skip -= 1
+                else:
+                    lines.append(block[pos:end])
+                pos = end + 1
+            offset += pos
+            partial = block[pos:]
+            i += 1
+        if partial and i >= self.blocks and len(lines) < count and not skip:
+            lines.append(partial)
+            offset += len(partial)
+        return [self._decode(line) for line in lines], offset
+
+    def tail(self, count=1000):
+        """
+        Read the last `count` lines, return the lines, the number of the first line and the byte offset to follow from
+        """
+        total = self.lines
+        start = max(total - count, 0)
+        lines, offset = self.read_lines(start, count)
+        return lines, start, offset
+
+    def _record(self, i):
+        if i < 0:
+            return 0, 0, 0
+        self._index.seek(i * _RECORD.size)
+        return _RECORD.unpack(self._index.read(_RECORD.size))
+
+    def _block(self, i):
+        start = self._record(i - 1)[1]
+        end = self._record(i)[1]
+        self._log.seek(start)
+        return zlib.decompress(self._log.read(end - start), wbits=31)
+
+    def _decode(self, line):
+        return line.decode('utf-8', errors='replace').rstrip('\r')
@@ -114,6 +114,28 @@ class TaskDto:
         'test_cases': fields.List(fields.String()),
         'upload_dir': fields.String(description='The directory id of the upload files'),
     })
+    task_bulk_item = api.model('task_bulk_item', {
+        'test_suite': fields.String(required=True, description='The test suite name'),
+        'path': fields.String(required=True, description='The test suite\'s path name'),
+        'endpoint_list': fields.List(fields.String(description='The endpoints to run the test')),
+        'priority': fields.Integer(description='The priority of the task(larger number means higher importance)'),
+        'parallelization': fields.Boolean(default=False),
+        'variables': fields.Raw(description='The variables of the task'),
+        'variable_sets': fields.List(fields.Raw(), description='Run a task for each of the variable sets instead of variables'),
+        'test_cases': fields.List(fields.String()),
+        'upload_dir': fields.String(description='The directory id of the upload files'),
+    })
+    task_bulk = api.inherit('task_bulk', organization_team, {
+        'tasks': fields.List(fields.Nested(task_bulk_item), required=True, description='The test suites to run'),
+    })
+    task_bulk_cancel = api.inherit('task_bulk_cancel', organization_team, {
+        'task_ids': fields.List(fields.String(), description='Cancel only the tasks of these ids'),
+        'status': fields.List(fields.String(), description='Cancel the tasks in these states, waiting and running by default'),
+        'test_suite': fields.String(description='Cancel the tasks of the test suite'),
+        'endpoint_uid': fields.String(description='Cancel the tasks queued for or running on the endpoint'),
+        'priority': fields.Integer(description='Cancel the tasks of the priority'),
+        'tester': fields.String(description='Cancel the tasks of the tester\'s email'),
+    })
 
 class TestResultDto:
     api = Namespace('testresult', description='serve test result files')
@@ -0,0 +1,27 @@
+import threading
+
+
+class Notifier():
+    """
+    A wake-up signal shared by the producers and the consumer of a queue
+
+    The consumer clears the signal before draining the queue and waits on it
+    when the queue is empty, a producer sets it right after pushing an item,
+    so that no push is missed between draining and waiting.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    def wait(self, timeout=None):
+        """
+        Return True if notified, False if timeouted out
+        """
+        return self._event.wait(timeout)
+
+EVENT_NOTIFIER = Notifier()
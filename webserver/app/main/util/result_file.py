@@ -0,0 +1,100 @@
+import gzip
+import mimetypes
+import os
+import shutil
+import zlib
+
+from flask import Response, request, send_file
+from flask.helpers import safe_join
+from werkzeug.exceptions import NotFound
+
+GZIP_SUFFIX = '.gz'
+GZIP_BLOCK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+GZIP_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ('application/xml', 'application/json', 'application/javascript')
+
+
+def guess_mimetype(filename):
+    """
+    Return (mimetype, whether it's worth compressing) of a file
+    """
+    mimetype, encoding = mimetypes.guess_type(filename)
+    if encoding:
+        return 'application/gzip' if encoding == 'gzip' else 'application/octet-stream', False
+    if not mimetype:
+        return 'application/octet-stream', False
+    return mimetype, mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES or mimetype.endswith('+xml')
+
+def _gzip_stream(path):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(GZIP_BLOCK_SIZE), b''):
+            data = compressor.compress(block)
+            if data:
+                yield data
+    yield compressor.flush()
+
+def send_result_file(directory, filename, mimetype=None, as_attachment=False):
+    """
+    Send a file of the test results streamed from the disk
+
+    Range and conditional requests are handled by send_file(). A client accepting gzip gets the
+    .gz sibling written by compress_result_files() if it's up to date, otherwise a compressible file
+    is gzipped on the fly unless a range of it is requested, since the ranges of a stream can't be served.
+    """
+    path = safe_join(directory, filename)
+    if not os.path.isfile(path):
+        raise NotFound()
+    guessed, compressible = guess_mimetype(path)
+    mimetype = mimetype or guessed
+    attachment_filename = os.path.basename(path)
+    stat = os.stat(path)
+    accept_gzip = compressible and request.accept_encodings['gzip'] > 0
+
+    gzip_path = path + GZIP_SUFFIX
+    if accept_gzip and os.path.isfile(gzip_path) and os.path.getmtime(gzip_path) >= stat.st_mtime:
+        rv = send_file(gzip_path, mimetype=mimetype, as_attachment=as_attachment,
+                       attachment_filename=attachment_filename, conditional=True)
+        if rv.status_code in (200, 206):
+            rv.headers['Content-Encoding'] = 'gzip'
+    elif accept_gzip and stat.st_size >= GZIP_MIN_SIZE and 'Range' not in request.headers:
+        rv = Response(_gzip_stream(path), mimetype=mimetype, direct_passthrough=True)
+        rv.headers['Content-Encoding'] = 'gzip'
+        if as_attachment:
+            rv.headers.set('Content-Disposition', 'attachment', filename=attachment_filename)
+        rv.last_modified = int(stat.st_mtime)
+        rv.set_etag('{}-{}-gzip'.format(int(stat.st_mtime), stat.st_size), weak=True)
+        rv = rv.make_conditional(request)
+    else:
+        rv = send_file(path, mimetype=mimetype, as_attachment=as_attachment, conditional=True)
+    if compressible:
+        rv.vary.add('Accept-Encoding')
+    return rv
+
+def compress_result_files(result_dir, min_size):
+    """
+    Write a .gz sibling of each compressible file of the test results no smaller than min_size
+    """
+    for root, _, files in os.walk(result_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if not guess_mimetype(name)[1] or os.path.getsize(path) < min_size:
+                continue
+            temp = path + GZIP_SUFFIX + '.tmp'
+            with open(path, 'rb') as src, open(temp, 'wb') as raw, \
+                    gzip.GzipFile(name, 'wb', GZIP_LEVEL, raw) as dst:
+                shutil.copyfileobj(src, dst, GZIP_BLOCK_SIZE)
+            os.replace(temp, path + GZIP_SUFFIX)
+
+def drop_compressed_siblings(tree):
+    """
+    Drop the .gz siblings written by compress_result_files() from a tree of path_to_dict()
+    """
+    children = tree.get('children')
+    if children is not None:
+        labels = {child['label'] for child in children}
+        tree['children'] = [drop_compressed_siblings(child) for child in children
+                            if not (child['type'] == 'file' and child['label'].endswith(GZIP_SUFFIX)
+                                    and child['label'][:-len(GZIP_SUFFIX)] in labels)]
+    return tree
@@ -0,0 +1,133 @@
+import gzip
+import os
+import tempfile
+import time
+import unittest
+
+from app.main.util.console_log import ConsoleLogWriter, ConsoleLogReader, CONSOLE_LOG_FILE
+from task_runner.util.console import ConsoleBuffer, ConsolePump
+
+
+class TestConsolePump(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.pump = ConsolePump(self.batches.append, encoding='utf-8', batch_size=8, batch_delay=60)
+
+    def test_multibyte_character_split_across_chunks(self):
+        data = 'é\n'.encode('utf-8')
+        self.pump.feed(data[:1])
+        self.pump.feed(data[1:])
+        self.pump.close()
+        self.assertEqual(self.batches, ['é\r\n'])
+
+    def test_size_bounded_batch_is_cut_after_last_line(self):
+        self.pump.feed(b'abc\ndefgh')
+        self.assertEqual(self.batches, ['abc\r\n'])
+        self.pump.close()
+        self.assertEqual(self.batches, ['abc\r\n', 'defgh'])
+
+    def test_time_bounded_batch(self):
+        self.pump.batch_delay = 0
+        self.pump.feed(b'abc')
+        self.assertEqual(self.batches, ['abc'])
+        self.assertIsNone(self.pump.timeout)
+
+
+class TestConsoleBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = ConsoleBuffer(capacity=16)
+
+    def tearDown(self):
+        self.buffer.close()
+
+    def test_read_does_not_split_characters(self):
+        self.buffer.write('中文字符\r\n测试')
+        text, offset = self.buffer.read(0, 4)
+        self.assertEqual((text, offset), ('中', 3))
+        text, offset = self.buffer.read(offset, 7)
+        self.assertEqual((text, offset), ('文字', 9))
+        chunks = []
+        offset = 0
+        while offset < self.buffer.size:
+            text, offset = self.buffer.read(offset, 5)
+            chunks.append(text)
+        self.assertEqual(''.join(chunks), '中文字符\r\n测试')
+        self.assertNotIn('\ufffd', ''.join(chunks))
+
+    def test_limit_shorter_than_a_character(self):
+        self.buffer.write('中文')
+        self.assertEqual(self.buffer.read(0, 1), ('中', 3))
+
+
+class TestConsoleLog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.text = ''.join('line {}\r\n'.format(i) for i in range(100)) + 'last'
+        writer = ConsoleLogWriter(self.dir.name, block_size=64)
+        for i in range(0, len(self.text), 50):
+            writer.write(self.text[i:i + 50])
+        writer.close()
+        self.reader = ConsoleLogReader(self.dir.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.dir.cleanup()
+
+    def test_log_is_gzip_file(self):
+        with gzip.open(os.path.join(self.dir.name, CONSOLE_LOG_FILE)) as f:
+            self.assertEqual(f.read().decode(), self.text)
+
+    def test_read_byte_range_across_blocks(self):
+        data, offset = self.reader.read(60, 100)
+        self.assertEqual(data.decode(), self.text[60:160])
+        self.assertEqual(offset, 160)
+
+    def test_read_lines(self):
+        lines, offset = self.reader.read_lines(10, 2)
+        self.assertEqual(lines, ['line 10', 'line 11'])
+        self.assertEqual(self.text[offset:].split('\r\n')[0], 'line 12')
+
+    def test_tail(self):
+        lines, start, offset = self.reader.tail(2)
+        self.assertEqual(lines, ['line 99', 'last'])
+        self.assertEqual(start, 99)
+        self.assertEqual(offset, len(self.text))
+
+
+class TestConsoleLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_read_does_not_split_characters(self):
+        writer = ConsoleLogWriter(self.dir.name, block_size=8)
+        writer.write('中文字符测试')
+        writer.close()
+        with ConsoleLogReader(self.dir.name) as reader:
+            data, offset = reader.read(0, 4)
+            self.assertEqual((data.decode(), offset), ('中', 3))
+            data, offset = reader.read(offset, 8)
+            self.assertEqual((data.decode(), offset), ('文字', 9))
+
+    def test_quiet_output_is_flushed(self):
+        writer = ConsoleLogWriter(self.dir.name, flush_delay=0.05)
+        writer.write('abc')
+        deadline = time.monotonic() + 5
+        while writer.size == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with ConsoleLogReader(self.dir.name) as reader:
+            self.assertEqual(reader.read(0, 10), (b'abc', 3))
+        writer.write('def')
+        writer.close()
+        with ConsoleLogReader(self.dir.name) as reader:
+            self.assertEqual(reader.read(0, 10), (b'abcdef', 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import types
+import unittest
+from unittest import mock
+
+from task_runner import runner
+
+
+class Event():
+    def __init__(self, message):
+        self.message = message
+        self.organization = None
+        self.team = None
+
+class TestStartTaskHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.app = mock.Mock()
+        self.endpoint = mock.Mock(id='endpoint')
+        patches = [
+            mock.patch.object(runner, 'Endpoint'),
+            mock.patch.object(runner, 'SCHEDULER'),
+            mock.patch.object(runner, 'mark_tasks'),
+        ]
+        self.Endpoint, self.scheduler, self.mark_tasks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        self.Endpoint.objects.return_value.first.return_value = self.endpoint
+
+    def test_delete_endpoint(self):
+        runner.event_handler_start_task(self.app, Event({'endpoint_uid': 'uid', 'to_delete': True}))
+        self.mark_tasks.assert_not_called()
+        self.scheduler.schedule.assert_called_once()
+        self.assertEqual(self.scheduler.schedule.call_args[0][:3], ('endpoint', runner.process_task_per_endpoint, self.app))
+
+    def test_start_tasks(self):
+        runner.event_handler_start_task(self.app, Event({'endpoint_uid': 'uid', 'task_id': 't1'}))
+        self.mark_tasks.assert_called_once_with(['t1'], 'dispatched')
+        runner.event_handler_start_task(self.app, Event({'endpoint_uid': 'uid', 'task_ids': ['t2', 't3']}))
+        self.mark_tasks.assert_called_with(['t2', 't3'], 'dispatched')
+
+
+class TestMultiNodeConfig(unittest.TestCase):
+
+    def check(self, **config):
+        config = types.SimpleNamespace(**dict({'EVENT_DISPATCH_MODE': 'notify', 'EVENT_POLL_INTERVAL': 30,
+                                               'XMLRPC_BRIDGE_ADDRESS': '10.0.0.1'}, **config))
+        app = mock.Mock()
+        with mock.patch.object(runner, 'get_config', return_value=config):
+            return runner.check_multi_node_config(app), app.logger
+
+    def test_event_dispatch(self):
+        self.assertFalse(self.check()[0])
+        self.assertFalse(self.check(EVENT_POLL_INTERVAL=None)[0])
+        self.assertTrue(self.check(EVENT_POLL_INTERVAL=1)[0])
+        self.assertTrue(self.check(EVENT_DISPATCH_MODE='change_stream')[0])
+
+    def test_loopback_bridge_address(self):
+        ok, logger = self.check(EVENT_DISPATCH_MODE='change_stream', XMLRPC_BRIDGE_ADDRESS='127.0.0.1')
+        self.assertTrue(ok)
+        logger.warning.assert_called_once()
+        ok, logger = self.check(EVENT_DISPATCH_MODE='change_stream')
+        logger.warning.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
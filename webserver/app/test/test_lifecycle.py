@@ -0,0 +1,58 @@
+import threading
+import unittest
+
+from task_runner.util.lifecycle import CANCELLING, LAUNCHING, RUNNING, TaskLifecycle
+
+
+class Process():
+    def __init__(self):
+        self.terminated = False
+
+    def terminate(self):
+        self.terminated = True
+
+class TestTaskLifecycle(unittest.TestCase):
+
+    def test_cancel_while_launching(self):
+        states = TaskLifecycle()
+        self.assertTrue(states.launching('task'))
+        self.assertEqual(states.cancel('task'), (LAUNCHING, None))
+        self.assertEqual(states.state('task'), CANCELLING)
+        process = Process()
+        self.assertFalse(states.started('task', process))
+        self.assertEqual(states.cancel('task'), (CANCELLING, process))
+
+    def test_cancel_twice_while_launching(self):
+        states = TaskLifecycle()
+        states.launching('task')
+        self.assertEqual(states.cancel('task'), (LAUNCHING, None))
+        # no process to terminate yet, the worker does it in started()
+        self.assertEqual(states.cancel('task'), (CANCELLING, None))
+        process = Process()
+        self.assertFalse(states.started('task', process))
+        self.assertEqual(states.state('task'), CANCELLING)
+
+    def test_cancel_running(self):
+        states = TaskLifecycle()
+        process = Process()
+        states.launching('task')
+        self.assertTrue(states.started('task', process))
+        self.assertEqual(states.cancel('task'), (RUNNING, process))
+
+    def test_cancel_before_launching(self):
+        states = TaskLifecycle()
+        self.assertEqual(states.cancel('task'), (None, None))
+        self.assertFalse(states.launching('task'))
+        self.assertTrue(states.launching('task'))
+
+    def test_wait_for_exit(self):
+        states = TaskLifecycle()
+        states.launching('task')
+        states.started('task', Process())
+        threading.Timer(0.05, states.exited, args=('task',)).start()
+        self.assertTrue(states.wait('task', timeout=5))
+        self.assertIsNone(states.state('task'))
+
+
+if __name__ == '__main__':
+    unittest.main()
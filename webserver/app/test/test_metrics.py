@@ -0,0 +1,42 @@
+import unittest
+
+from task_runner.util.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_exposition(self):
+        registry = Registry()
+        counter = registry.counter('events_total', 'Events', ['code'])
+        gauge = registry.gauge('running', 'Running tasks')
+        counter.labels(1).inc()
+        counter.labels(1).inc(2)
+        counter.labels('a"b').inc()
+        gauge.set(3)
+        text = registry.exposition()
+        self.assertIn('# TYPE events_total counter\n', text)
+        self.assertIn('events_total{code="1"} 3.0\n', text)
+        self.assertIn('events_total{code="a\\"b"} 1.0\n', text)
+        self.assertIn('running 3.0\n', text)
+        self.assertRaises(ValueError, registry.gauge, 'running', 'Running tasks')
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        text = registry.exposition()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2.0\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3.0\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4.0\n', text)
+        self.assertIn('latency_seconds_sum 5.65\n', text)
+        self.assertIn('latency_seconds_count 4.0\n', text)
+
+    def test_function(self):
+        registry = Registry()
+        registry.gauge('queued', 'Queued tasks', ['endpoint']).set_function(lambda: {('ep1',): 2})
+        self.assertIn('queued{endpoint="ep1"} 2.0\n', registry.exposition())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import socketserver
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from flask import Flask
+
+from task_runner.util import notification
+from task_runner.util.notification import NotificationDispatcher, SMTPConnection, send_email
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local SMTP server accepting any login and recording the mails
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.mails = []
+        self.failures = 0
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN')
+            elif command == 'AUTH':
+                self.reply('235 Authenticated')
+            elif command == 'MAIL':
+                if self.server.failures > 0:
+                    self.server.failures -= 1
+                    self.reply('451 Try again later')
+                else:
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 Go ahead')
+                data = []
+                while True:
+                    line = self.rfile.readline().decode()
+                    if line == '.\r\n':
+                        break
+                    data.append(line)
+                self.server.mails.append(''.join(data))
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+def make_task(email='tester@abc.com'):
+    organization = SimpleNamespace(id='org')
+    test = SimpleNamespace(test_suite='smoke', organization=organization, team=None)
+    return SimpleNamespace(id='task', status='successful', test=test, tester=SimpleNamespace(email=email))
+
+class TestNotificationDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SMTPStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.chain = notification.notification_chain[:]
+        notification.notification_chain[:] = [send_email]
+
+    def tearDown(self):
+        notification.notification_chain[:] = self.chain
+        notification.DISPATCHER = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def start_dispatcher(self, **kwargs):
+        connection = SMTPConnection('127.0.0.1', self.server.server_address[1], 'user', 'password')
+        notification.DISPATCHER = NotificationDispatcher(Flask(__name__), connection, 'admin@abc.com', **kwargs)
+        notification.DISPATCHER.start()
+        return notification.DISPATCHER
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_connection_is_reused(self):
+        dispatcher = self.start_dispatcher()
+        for i in range(5):
+            dispatcher.dispatch(make_task())
+        self.wait_for(lambda: dispatcher.sent == 5)
+        self.assertEqual(len(self.server.mails), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_digest(self):
+        dispatcher = self.start_dispatcher(digest_delay=0.2)
+        for i in range(3):
+            dispatcher.dispatch(make_task())
+        dispatcher.dispatch(make_task('other@abc.com'))
+        self.wait_for(lambda: dispatcher.sent == 2)
+        self.assertEqual(sum('Test Reports for 3 tasks' in mail for mail in self.server.mails), 1)
+
+    def test_retry_with_backoff(self):
+        self.server.failures = 2
+        dispatcher = self.start_dispatcher(retries=3, backoff=0.05)
+        dispatcher.dispatch(make_task())
+        self.wait_for(lambda: dispatcher.sent == 1)
+        self.assertEqual(dispatcher.failed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from task_runner import runner
+from task_runner.util.cache import TTLCache
+from task_runner.util.relay import LogRelay
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expiry(self):
+        cache = TTLCache(4, 0.05)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(2, 60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (3, 1, 1))
+
+    def test_pop(self):
+        cache = TTLCache(2, 60)
+        cache.put('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', 0), 0)
+
+
+class TestLogRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.emits = []
+        self.relay = LogRelay(lambda *args: self.emits.append(args), batch_size=8, room_rate=1000, max_pending=16)
+
+    def test_messages_are_coalesced(self):
+        self.relay.feed('t1', 'room', 'ab')
+        self.relay.feed('t1', 'room', 'cd')
+        self.assertEqual(self.emits, [])
+        self.relay.flush()
+        self.assertEqual(self.emits, [('t1', 'room', 'abcd')])
+        self.assertEqual(self.relay.stats()['frames'], 2)
+        self.assertEqual(self.relay.stats()['pending_tasks'], 0)
+
+    def test_full_batch_is_emitted(self):
+        self.relay.feed('t1', 'room', 'abcdefgh')
+        self.assertEqual(self.emits, [('t1', 'room', 'abcdefgh')])
+
+    def test_oldest_output_is_dropped(self):
+        self.relay.batch_size = 1000
+        self.relay.feed('t1', 'room', 'x' * 10)
+        self.relay.feed('t1', 'room', 'y' * 10)
+        self.relay.flush()
+        self.assertEqual(self.emits, [('t1', 'room', '\r\n[4 characters of the test log dropped, the browsers can\'t keep up]\r\n'
+                                                   + 'x' * 6 + 'y' * 10)])
+        self.assertEqual(self.relay.stats()['dropped'], 4)
+
+    def test_room_rate_holds_output_back(self):
+        self.relay.room_rate = 4
+        self.relay.feed('t1', 'room', 'abcdefgh')
+        self.relay.feed('t1', 'room', 'ij')
+        self.relay.flush()
+        self.assertEqual(self.emits, [('t1', 'room', 'abcdefgh')])
+        self.assertEqual(self.relay.stats()['pending_tasks'], 1)
+
+
+class TestMessageRelay(unittest.TestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(runner, 'TASK_ROOMS', TTLCache(4, 60)),
+            mock.patch.object(runner, 'UNKNOWN_TASKS', TTLCache(4, 60)),
+            mock.patch.object(runner, 'LOG_RELAY'),
+            mock.patch.object(runner, 'get_task_room_id', side_effect=lambda task_id: 'room' if task_id == 'known' else None),
+        ]
+        _, _, self.log_relay, self.get_task_room_id = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+
+    def relay_test_logs(self, task_id, times):
+        loop = asyncio.new_event_loop()
+        try:
+            for i in range(times):
+                loop.run_until_complete(runner.relay_test_log(task_id, 'abc'))
+        finally:
+            loop.close()
+
+    def test_unknown_task_is_looked_up_once(self):
+        self.relay_test_logs('unknown', 3)
+        self.get_task_room_id.assert_called_once_with('unknown')
+        self.log_relay.feed.assert_not_called()
+
+    def test_known_task_is_relayed(self):
+        self.relay_test_logs('known', 2)
+        self.get_task_room_id.assert_called_once_with('known')
+        self.assertEqual(self.log_relay.feed.call_count, 2)
+        self.log_relay.feed.assert_called_with('known', 'room', 'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+
+from app.main.util.result_file import send_result_file, compress_result_files, drop_compressed_siblings
+from app.main.util.tarball import path_to_dict
+
+
+class TestResultFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data = b''.join(b'<msg>line %d</msg>\n' % i for i in range(1000))
+        with open(os.path.join(self.dir.name, 'output.xml'), 'wb') as f:
+            f.write(self.data)
+        app = Flask(__name__)
+        app.add_url_rule('/<path:name>', 'result', lambda name: send_result_file(self.dir.name, name))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_range(self):
+        rv = self.client.get('/output.xml', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(rv.status_code, 206)
+        self.assertEqual(rv.data, self.data[10:20])
+        rv = self.client.get('/output.xml', headers={'Range': 'bytes={}-'.format(len(self.data))})
+        self.assertEqual(rv.status_code, 416)
+
+    def test_conditional(self):
+        rv = self.client.get('/output.xml')
+        self.assertEqual(rv.data, self.data)
+        rv = self.client.get('/output.xml', headers={'If-None-Match': rv.headers['ETag']})
+        self.assertEqual(rv.status_code, 304)
+
+    def test_gzip(self):
+        rv = self.client.get('/output.xml', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(rv.data), self.data)
+        rv = self.client.get('/output.xml', headers={'Accept-Encoding': 'gzip', 'If-None-Match': rv.headers['ETag']})
+        self.assertEqual(rv.status_code, 304)
+
+        compress_result_files(self.dir.name, 1)
+        rv = self.client.get('/output.xml', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-1'})
+        self.assertEqual(rv.status_code, 206)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(rv.data, b'\x1f\x8b')
+        self.assertEqual(drop_compressed_siblings(path_to_dict(self.dir.name))['children'],
+                         [{'label': 'output.xml', 'type': 'file'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
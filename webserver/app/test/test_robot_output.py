@@ -0,0 +1,53 @@
+import io
+import unittest
+
+from task_runner.util.robot_output import iter_test_cases, suite_long_names
+
+OUTPUT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<robot generator="Robot 3.1.1" generated="20200101 12:00:00.000">
+<suite id="s1" name="Top">
+<suite id="s1-s1" name="Child">
+<test id="s1-s1-t1" name="Passes">
+<kw name="Log" library="BuiltIn">
+<status status="PASS" starttime="20200101 12:00:00.100" endtime="20200101 12:00:00.200"></status>
+</kw>
+<tags><tag>smoke</tag></tags>
+<status status="PASS" starttime="20200101 12:00:00.000" endtime="20200101 12:00:01.500" critical="yes"></status>
+</test>
+<test id="s1-s1-t2" name="Fails">
+<kw name="Check">
+<kw name="Should Be Equal" library="BuiltIn">
+<status status="FAIL" starttime="20200101 12:00:02.000" endtime="20200101 12:00:02.010"></status>
+</kw>
+<status status="FAIL" starttime="20200101 12:00:02.000" endtime="20200101 12:00:02.010"></status>
+</kw>
+<status status="FAIL" starttime="20200101 12:00:02.000" endtime="20200101 12:00:02.250" critical="yes">1 != 2</status>
+</test>
+<status status="FAIL" starttime="20200101 12:00:00.000" endtime="20200101 12:00:02.250"></status>
+</suite>
+<status status="FAIL" starttime="20200101 12:00:00.000" endtime="20200101 12:00:02.250"></status>
+</suite>
+<statistics><suite><stat pass="1" fail="1" id="s1" name="Top">Top</stat></suite></statistics>
+<errors></errors>
+</robot>
+'''
+
+
+class TestRobotOutput(unittest.TestCase):
+
+    def test_iter_test_cases(self):
+        suites = {}
+        cases = list(iter_test_cases(io.BytesIO(OUTPUT), suites))
+        self.assertEqual([case['name'] for case in cases], ['Passes', 'Fails'])
+        self.assertEqual(cases[0]['status'], 'PASS')
+        self.assertEqual(cases[0]['duration'], 1.5)
+        self.assertEqual(cases[0]['tags'], ['smoke'])
+        self.assertIsNone(cases[0]['failed_keyword'])
+        self.assertEqual(cases[1]['status'], 'FAIL')
+        self.assertEqual(cases[1]['message'], '1 != 2')
+        self.assertEqual(cases[1]['failed_keyword'], 'BuiltIn.Should Be Equal')
+        self.assertEqual(suite_long_names(suites)[cases[1]['suite_id']], 'Top.Child')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import uuid
+from unittest import mock
+
+from mongoengine import connect
+
+from app.main.model.database import Endpoint, QueuedTask, Task, TaskQueue
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipUnless(mongomock, 'mongomock is not installed')
+class TestTaskQueue(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect('test_task_queue', host='mongomock://localhost')
+
+    def setUp(self):
+        self.endpoint = Endpoint(uid=uuid.uuid4()).save()
+        self.taskqueue = TaskQueue(endpoint=self.endpoint).save()
+        self.task = Task(test_suite='suite').save()
+        self.taskqueue.push(self.task)
+
+    def tearDown(self):
+        for document in (Endpoint, QueuedTask, Task, TaskQueue):
+            document.drop_collection()
+
+    def test_pop_next(self):
+        taskqueue, task = TaskQueue.pop_next(self.endpoint, 'runner')
+        self.assertEqual(task, self.task)
+        self.assertEqual(taskqueue.running_task, self.task)
+        self.assertEqual(QueuedTask.objects.count(), 0)
+        self.assertEqual(TaskQueue.pop_next(self.endpoint, 'runner'), (None, None))
+
+    def test_crash_after_claim(self):
+        with mock.patch.object(TaskQueue, 'objects', side_effect=RuntimeError('crashed')):
+            self.assertRaises(RuntimeError, TaskQueue.pop_next, self.endpoint, 'dead')
+        # the claimed task is neither queued nor running until the claim is released
+        self.assertEqual(self.taskqueue.size(), 0)
+        self.assertEqual(TaskQueue.pop_next(self.endpoint, 'runner'), (None, None))
+        self.assertEqual(TaskQueue.release_claims(exclude_runner='runner'), 1)
+        self.assertEqual(TaskQueue.pop_next(self.endpoint, 'runner')[1], self.task)
+
+    def test_crash_after_running(self):
+        with mock.patch.object(QueuedTask._get_collection(), 'delete_one', side_effect=RuntimeError('crashed')):
+            self.assertRaises(RuntimeError, TaskQueue.pop_next, self.endpoint, 'dead')
+        # the running task is recovered from its queue, the claim is just dropped
+        self.assertEqual(TaskQueue.release_claims(endpoint=self.endpoint), 0)
+        self.assertEqual(QueuedTask.objects.count(), 0)
+        self.assertEqual(self.taskqueue.reload().running_task, self.task)
+
+    def test_queued_among(self):
+        other = Task(test_suite='other').save()
+        self.assertEqual(TaskQueue.queued_among(self.endpoint, [self.task.id, other.id]), {self.task.id})
+        TaskQueue.pop_next(self.endpoint, 'runner')
+        self.assertEqual(TaskQueue.queued_among(self.endpoint, [self.task.id, other.id]), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
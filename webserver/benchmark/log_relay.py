@@ -0,0 +1,70 @@
+"""
+Frame rate benchmark of the test log relay
+
+Chatty tasks write tiny messages as fast as the endpoints send them, the messages
+emitted to the rooms are counted when each message is emitted on its own, as the
+relay did before, and when they're coalesced by the LogRelay.
+
+    python -m benchmark.log_relay --tasks 10 --rooms 2 --seconds 3
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+sys.path.append('.')
+from task_runner.util.relay import LogRelay
+
+MESSAGE = 'INFO: step passed\r\n'
+
+
+class Counter():
+    def __init__(self):
+        self.emits = 0
+        self.characters = 0
+
+    def emit(self, task_id, room_id, message):
+        self.emits += 1
+        self.characters += len(message)
+
+async def produce(feed, tasks, rooms, seconds):
+    frames = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for i in range(tasks):
+            for j in range(100):
+                feed('task{}'.format(i), 'room{}'.format(i % rooms), MESSAGE)
+            frames += 100
+        # yield to the relay's flush timer as the websocket handlers would do between frames
+        await asyncio.sleep(0)
+    return frames
+
+async def run(name, feed, counter, tasks, rooms, seconds, relay=None):
+    flusher = asyncio.ensure_future(relay.run()) if relay else None
+    start = time.monotonic()
+    frames = await produce(feed, tasks, rooms, seconds)
+    if relay:
+        relay.flush()
+        flusher.cancel()
+    elapsed = time.monotonic() - start
+    print('{:<10} in {:>10.0f} frames/s | out {:>10.0f} frames/s | {:>6.1f} frames/s per room | {} characters dropped'.format(
+        name, frames / elapsed, counter.emits / elapsed, counter.emits / elapsed / rooms,
+        relay.dropped if relay else 0))
+
+def main():
+    parser = argparse.ArgumentParser(description='Test log relay frames per second, before and after coalescing')
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--rooms', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--room-rate', type=int, default=512 * 1024, help='characters per second a room may receive')
+    args = parser.parse_args()
+
+    counter = Counter()
+    asyncio.run(run('direct', counter.emit, counter, args.tasks, args.rooms, args.seconds))
+
+    counter = Counter()
+    relay = LogRelay(counter.emit, room_rate=args.room_rate)
+    asyncio.run(run('coalesced', relay.feed, counter, args.tasks, args.rooms, args.seconds, relay))
+
+if __name__ == '__main__':
+    main()
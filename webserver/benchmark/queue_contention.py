@@ -0,0 +1,140 @@
+"""
+Contention benchmark of the task queue
+
+Producers push tasks to the queue of one endpoint while consumers pop them
+concurrently, the current queue is compared with the former one which embedded
+the tasks in the task queue document guarded by a spin lock. It needs a MongoDB
+server, the benchmark database is dropped when it's done.
+
+    python -m benchmark.queue_contention --tasks 2000 --producers 4 --consumers 8
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append('.')
+from mongoengine import connect
+from app.main.model.database import Endpoint, QueuedTask, Task, TaskQueue
+
+LOCK_TIMEOUT = 50
+
+
+class LegacyQueue():
+    """
+    The former TaskQueue with embedded tasks and the read/write lock
+    """
+    def __init__(self, queue_id):
+        self.collection = TaskQueue._get_collection()
+        self.query = {'_id': queue_id}
+
+    def pop(self):
+        for i in range(LOCK_TIMEOUT):
+            if self.collection.find_one_and_update({'_id': self.query['_id'], 'rw_lock': False}, {'$set': {'rw_lock': True}}):
+                break
+            time.sleep(0.1)
+        else:
+            return None
+        tasks = self.collection.find_one(self.query)['tasks']
+        task = Task.objects(pk=tasks[0]).first() if tasks else None
+        self.collection.find_one_and_update(self.query, {'$pop': {'tasks': -1}})
+        self.collection.find_one_and_update(self.query, {'$set': {'running_task': task.pk if task else None}})
+        self.collection.find_one_and_update(self.query, {'$set': {'rw_lock': False}})
+        return task
+
+    def push(self, task):
+        return self.collection.find_one_and_update(self.query, {'$push': {'tasks': task.pk}})
+
+    def remaining(self):
+        return len(self.collection.find_one(self.query)['tasks'])
+
+class AtomicQueue():
+    def __init__(self, queue_id):
+        self.queue = TaskQueue.objects(pk=queue_id).first()
+
+    def pop(self):
+        return self.queue.pop_next(self.queue.endpoint)[1]
+
+    def push(self, task):
+        return self.queue.push(task)
+
+    def remaining(self):
+        return self.queue.size()
+
+def run(queue_class, endpoint, tasks, producers, consumers):
+    TaskQueue.drop_collection()
+    QueuedTask.drop_collection()
+    TaskQueue._get_collection().insert_one({'endpoint': endpoint.pk, 'priority': 2, 'tasks': [], 'rw_lock': False})
+    queue_id = TaskQueue._get_collection().find_one()['_id']
+    per_producer = [tasks[i::producers] for i in range(producers)]
+    popped = []
+    latencies = []
+    lock = threading.Lock()
+    produced = threading.Event()
+
+    def produce(batch):
+        queue = queue_class(queue_id)
+        for task in batch:
+            queue.push(task)
+
+    def consume():
+        queue = queue_class(queue_id)
+        while True:
+            start = time.perf_counter()
+            task = queue.pop()
+            elapsed = time.perf_counter() - start
+            if task:
+                with lock:
+                    popped.append(task.id)
+                    latencies.append(elapsed)
+            elif produced.is_set() and queue.remaining() == 0:
+                break
+
+    threads = [threading.Thread(target=produce, args=(batch,)) for batch in per_producer]
+    workers = [threading.Thread(target=consume) for i in range(consumers)]
+    start = time.perf_counter()
+    for t in threads + workers:
+        t.start()
+    for t in threads:
+        t.join()
+    produced.set()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'elapsed': elapsed,
+        'throughput': len(popped) / elapsed,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'lost': len(tasks) - len(set(popped)),
+        'duplicated': len(popped) - len(set(popped)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--consumers', type=int, default=8)
+    args = parser.parse_args()
+
+    connect('auto_test_benchmark', host=args.host, port=args.port)
+    Task.drop_collection()
+    Endpoint.drop_collection()
+    endpoint = Endpoint(name='benchmark').save()
+    tasks = [Task(test_suite='benchmark').save() for i in range(args.tasks)]
+
+    print('{:<8} {:>10} {:>10} {:>10} {:>10} {:>6} {:>10}'.format('mode', 'elapsed(s)', 'pops/s', 'p50(ms)', 'p99(ms)', 'lost', 'duplicated'))
+    for mode, queue_class in (('legacy', LegacyQueue), ('atomic', AtomicQueue)):
+        ret = run(queue_class, endpoint, tasks, args.producers, args.consumers)
+        print('{:<8} {elapsed:>10.2f} {throughput:>10.1f} {p50:>10.2f} {p99:>10.2f} {lost:>6} {duplicated:>10}'.format(mode, **ret))
+
+    for document in (Task, Endpoint, TaskQueue, QueuedTask):
+        document.drop_collection()
+
+if __name__ == '__main__':
+    main()
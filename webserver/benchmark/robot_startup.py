@@ -0,0 +1,86 @@
+"""
+Start latency benchmark of the robot processes, cold vs warm
+
+A trivial suite is run repeatedly by a fresh robot process and by the executors of
+the warm pool. The latency to the first console output and the time to finish the
+suite are reported. It needs Robot Framework installed and a platform having fork().
+
+    python -m benchmark.robot_startup --runs 20 --size 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+from task_runner.util.robot_pool import RobotPool, is_supported
+
+SUITE = """*** Test Cases ***
+Smoke
+    Log    Hello
+"""
+
+
+async def run_once(spawn, args):
+    start = time.perf_counter()
+    process = await spawn(args)
+    first = None
+    while True:
+        data = await process.stdout.read(64 * 1024)
+        if not data:
+            break
+        if first is None:
+            first = time.perf_counter() - start
+    returncode = await process.wait()
+    if returncode != 0:
+        raise RuntimeError('robot exited with {}'.format(returncode))
+    return first, time.perf_counter() - start
+
+async def run(spawn, args, runs):
+    results = [await run_once(spawn, args) for i in range(runs)]
+    return [r[0] for r in results], [r[1] for r in results]
+
+def report(name, first, total):
+    print('{:<6} first output p50 {:7.1f} ms p99 {:7.1f} ms | finished p50 {:7.1f} ms p99 {:7.1f} ms'.format(
+        name,
+        statistics.median(first) * 1000, sorted(first)[int(len(first) * 0.99)] * 1000,
+        statistics.median(total) * 1000, sorted(total)[int(len(total) * 0.99)] * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description='Robot start latency, cold vs warm')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--size', type=int, default=2, help='idle executors of the warm pool')
+    args = parser.parse_args()
+
+    if not is_supported():
+        print('The warm pool is not supported on this platform')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = os.path.join(tmp, 'smoke.robot')
+        with open(suite, 'w') as f:
+            f.write(SUITE)
+        robot_args = ['robot', '--outputdir', tmp, '--output', 'NONE', '--report', 'NONE', '--log', 'NONE', suite]
+
+        async def cold(args):
+            return await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.STDOUT)
+
+        first, total = asyncio.run(run(cold, robot_args, args.runs))
+        report('cold', first, total)
+
+        pool = RobotPool(os.path.join(tmp, 'pool.sock'), args.size)
+        if not pool.start():
+            print('Failed to start the warm pool')
+            return
+        try:
+            first, total = asyncio.run(run(pool.exec, robot_args, args.runs))
+            report('warm', first, total)
+        finally:
+            pool.stop()
+
+if __name__ == '__main__':
+    main()
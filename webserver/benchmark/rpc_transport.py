@@ -0,0 +1,97 @@
+"""
+Keyword call round trips through the XML-RPC bridge and through the msgpack framed bridge
+
+A stand-in endpoint echoes the argument of each keyword call, small text arguments and large
+binary ones are sent from one client connection like a robot process does.
+
+    python -m benchmark.rpc_transport --calls 2000 --large-size 1048576
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+import xmlrpc.client
+
+sys.path.append('.')
+from task_runner.robotlib.msgpackrpc import MsgpackRemoteClient, msgpack
+from task_runner.util.binaryrpc import BinaryRPCServer
+from task_runner.util.xmlrpcserver import XMLRPCServer
+
+PATH = '/endpoint/backing_file'
+
+
+class EchoEndpoint():
+    """
+    Answer the requests forwarded to the endpoint the way the remote library does
+    """
+    def __init__(self):
+        self.request = self
+
+    async def get_keyword_names(self):
+        return ['echo']
+
+    async def run_keyword(self, name, args, kwargs):
+        return {'status': 'PASS', 'return': args[0], 'output': ''}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_bridges():
+    loop = asyncio.new_event_loop()
+    rpc_proxy = {'loop': loop, PATH: EchoEndpoint()}
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    xmlrpc_port = free_port()
+    xmlrpc_bridge = XMLRPCServer(rpc_proxy, host='127.0.0.1', port=xmlrpc_port)
+    xmlrpc_bridge.daemon = True
+    xmlrpc_bridge.start()
+
+    binary_bridge = BinaryRPCServer(rpc_proxy, host='127.0.0.1', port=0)
+    binary_port = asyncio.run_coroutine_threadsafe(binary_bridge.start(), loop).result()
+    return xmlrpc_port, binary_port
+
+def measure(name, call, payload, calls):
+    assert call(payload) == payload
+    start = time.perf_counter()
+    for i in range(calls):
+        call(payload)
+    elapsed = time.perf_counter() - start
+    print('{:<8} {:>10} bytes | {:>8.0f} calls/s | {:>8.1f} us/call | {:>8.1f} MB/s'.format(
+        name, len(payload), calls / elapsed, elapsed / calls * 1e6, len(payload) * calls / elapsed / 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description='Keyword call throughput of the XML-RPC and msgpack bridges')
+    parser.add_argument('--calls', type=int, default=2000, help='calls with the small argument')
+    parser.add_argument('--large-calls', type=int, default=50, help='calls with the large argument')
+    parser.add_argument('--large-size', type=int, default=1024 * 1024, help='bytes of the large binary argument')
+    args = parser.parse_args()
+    if not msgpack:
+        sys.exit('msgpack is not installed')
+
+    xmlrpc_port, binary_port = start_bridges()
+    time.sleep(0.2)
+    server = xmlrpc.client.ServerProxy('http://127.0.0.1:{}{}'.format(xmlrpc_port, PATH))
+    client = MsgpackRemoteClient('127.0.0.1', binary_port, PATH)
+
+    def xmlrpc_call(payload):
+        # the Remote library sends the bytes as Binary and converts the Binary results back to bytes
+        arg = xmlrpc.client.Binary(payload) if isinstance(payload, bytes) else payload
+        ret = server.run_keyword('echo', [arg], {})['return']
+        return ret.data if isinstance(ret, xmlrpc.client.Binary) else ret
+
+    def binary_call(payload):
+        ret = client.run_keyword('echo', [payload], {})['return']
+        return ret.data if isinstance(ret, xmlrpc.client.Binary) else ret
+
+    small = 'Set WiFi SSID to robotest'
+    large = bytes(range(256)) * (args.large_size // 256)
+    for name, call in (('xmlrpc', xmlrpc_call), ('msgpack', binary_call)):
+        measure(name, call, small, args.calls)
+        measure(name, call, large, args.large_calls)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""
+Load simulation of the task runner
+
+The real event loop, scheduler and endpoint workers of task_runner.runner serve simulated endpoints.
+The tasks are submitted as TaskController.post does, their launches are prepared by the runner, only
+the robot command is replaced by benchmark/stub_robot.py running for the duration and writing the
+console output of the arrival. The arrivals are generated as a Poisson process, or replayed from a
+trace of JSON lines {"at": seconds, "endpoint": index, "duration": seconds, "output": bytes}
+recorded from a database by the record command.
+
+Each scale runs in a process of its own. The throughput, the percentiles of the queue wait (scheduled
+to launched) and of the dispatch latency (scheduled to the start event handled) taken from the tasks'
+traces, and the CPU time and peak RSS of the runner are reported. --check compares them with the
+baseline saved by --save-baseline and fails on regressions. The numbers depend on the machine, so the
+baseline isn't committed, save it with the same workload on the machine running --check, eg. from the
+base branch before the change to measure.
+
+It needs a MongoDB server, or mongomock for an in-memory stand-in with --mongo mongomock://localhost
+(it doesn't make the queue operations atomic across the threads, the numbers are only indicative).
+The benchmark database is dropped when it's done.
+
+    python -m benchmark.scheduler_load bench --endpoints 10 100 1000 --tasks 2000 --rate 100 --save-baseline
+    python -m benchmark.scheduler_load bench --trace arrivals.jsonl --check
+    python -m benchmark.scheduler_load record --mongo mongodb://127.0.0.1:27017 --database auto_test --days 1 arrivals.jsonl
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from bson import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+STUB_ROBOT = os.path.join(ROOT, 'benchmark', 'stub_robot.py')
+BASELINE = os.path.join(ROOT, 'benchmark', 'scheduler_baseline.json')
+DATABASE = 'auto_test_benchmark'
+
+# (name, unit, True if higher is better, absolute slack allowed besides the tolerance)
+RESULTS = (
+    ('throughput', 'tasks/s', True, 0),
+    ('queue_wait_p50', 's', False, 0.05),
+    ('queue_wait_p90', 's', False, 0.05),
+    ('queue_wait_p99', 's', False, 0.05),
+    ('dispatch_p50', 's', False, 0.05),
+    ('dispatch_p99', 's', False, 0.05),
+    ('cpu_time', 's', False, 0.5),
+    ('peak_rss', 'MB', False, 16),
+)
+
+
+class NullSocket():
+    """
+    The Socket.IO server of the runner, the messages to the browsers are only counted
+    """
+    def __init__(self):
+        self.messages = 0
+
+    def emit(self, *args, **kwargs):
+        self.messages += 1
+
+class NullDispatcher():
+    def dispatch(self, task):
+        pass
+
+def generate_arrivals(tasks, rate, endpoints, duration, output, seed):
+    rng = random.Random(seed)
+    at = 0
+    arrivals = []
+    for i in range(tasks):
+        at += rng.expovariate(rate)
+        arrivals.append({'at': at, 'endpoint': rng.randrange(endpoints),
+                         'duration': duration * rng.uniform(0.5, 1.5), 'output': output})
+    return arrivals
+
+def load_arrivals(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[max(math.ceil(len(values) * p / 100), 1) - 1]
+
+def simulate(args, arrivals):
+    """
+    Serve the arrivals with the runner in this process, return the results
+    """
+    # the result directories of the tasks are made relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='scheduler_load_')
+    os.chdir(workdir)
+
+    from mongoengine import connect
+    from app.main import create_app
+    from app.main.config import get_config
+    from app.main.model.database import Endpoint, EndpointLease, Event, EventQueue, Organization, QueuedTask, Task, \
+            TaskQueue, Test, EVENT_CODE_START_TASK, QUEUE_PRIORITY, QUEUE_PRIORITY_DEFAULT
+    from app.main.util import push_event
+    from task_runner import runner
+    from task_runner.util import notification
+
+    get_config().SCHEDULER_WORKERS = args.workers
+    get_config().PIPELINED_LAUNCH = args.pipelined
+    connect(args.database, host=args.mongo)
+    documents = (Organization, Test, Endpoint, TaskQueue, QueuedTask, Task, Event, EventQueue, EndpointLease)
+    for document in documents:
+        document.drop_collection()
+
+    app = create_app('dev')
+    app.logger.setLevel(logging.WARNING)
+    app.app_context().push()
+    socket = NullSocket()
+    runner.install_sio(socket)
+    notification.DISPATCHER = NullDispatcher()
+
+    prepare_launch = runner.prepare_launch
+    def stub_launch(task, endpoint_uid):
+        args = prepare_launch(task, endpoint_uid)
+        return [sys.executable, '-S', STUB_ROBOT, '--duration', task.variables['stub_duration'],
+                '--output', task.variables['stub_output']] + args[1:]
+    runner.prepare_launch = stub_launch
+
+    organization = Organization(name='benchmark', path='benchmark').save()
+    test = Test(test_suite='benchmark', organization=organization).save()
+    endpoints = [Endpoint(id=ObjectId(), name='endpoint {}'.format(i), uid=uuid.uuid4(), organization=organization,
+                          enable=True, status='Online') for i in range(args.endpoints)]
+    Endpoint.objects.insert(endpoints, load_bulk=False)
+    queues = {}
+    for endpoint in endpoints:
+        for priority in QUEUE_PRIORITY:
+            queues[(endpoint.pk, priority)] = TaskQueue(endpoint=endpoint, priority=priority, organization=organization)
+    TaskQueue.objects.insert(list(queues.values()), load_bulk=False)
+    EventQueue().save()
+
+    runner.start_scheduler(app)
+    runner.start_event_thread(app)
+
+    submitted = []
+    submitter_cpu = []
+    def submit():
+        start = time.monotonic()
+        for arrival in arrivals:
+            time.sleep(max(start + arrival['at'] / args.speed - time.monotonic(), 0))
+            endpoint = endpoints[arrival['endpoint'] % len(endpoints)]
+            priority = arrival.get('priority', QUEUE_PRIORITY_DEFAULT)
+            task = Task(test=test, test_suite=test.test_suite, endpoint_list=[endpoint.uid], priority=priority,
+                        variables={'stub_duration': str(arrival['duration']), 'stub_output': str(arrival.get('output', 0))},
+                        organization=organization)
+            task.save()
+            queues[(endpoint.pk, priority)].push(task)
+            push_event(organization, None, EVENT_CODE_START_TASK, {'endpoint_uid': str(endpoint.uid), 'task_id': str(task.id)})
+            submitted.append(task.pk)
+        submitter_cpu.append(time.thread_time())
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    thread = threading.Thread(target=submit, name='submitter')
+    thread.start()
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        if thread.is_alive():
+            continue
+        if Task.objects(pk__in=submitted, status__in=('waiting', 'running')).count() == 0:
+            break
+    else:
+        print('Timed out, the results cover only the finished tasks', file=sys.stderr)
+    thread.join()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    queue_wait = []
+    dispatch = []
+    first = last = None
+    finished = 0
+    for task in Task.objects(pk__in=submitted).only('schedule_date', 'run_date', 'status', 'trace'):
+        first = min(first or task.schedule_date, task.schedule_date)
+        if task.run_date:
+            queue_wait.append((task.run_date - task.schedule_date).total_seconds())
+        phases = task.trace_phases()
+        if phases['dispatch'] is not None:
+            dispatch.append(phases['dispatch'])
+        if task.status in ('successful', 'failed') and 'finished' in task.trace:
+            finished += 1
+            last = max(last or task.trace['finished'], task.trace['finished'])
+    queue_wait.sort()
+    dispatch.sort()
+    elapsed = (last - first).total_seconds() if finished else 0
+
+    results = {
+        'tasks': len(submitted),
+        'finished': finished,
+        'elapsed': elapsed,
+        'throughput': finished / elapsed if elapsed else 0,
+        'queue_wait_p50': percentile(queue_wait, 50),
+        'queue_wait_p90': percentile(queue_wait, 90),
+        'queue_wait_p99': percentile(queue_wait, 99),
+        'dispatch_p50': percentile(dispatch, 50),
+        'dispatch_p99': percentile(dispatch, 99),
+        # the submissions are made by the web server, they're not counted as the runner's work
+        'cpu_time': usage.ru_utime + usage.ru_stime - cpu_start - sum(submitter_cpu),
+        'peak_rss': usage.ru_maxrss / 1024,  # ru_maxrss is in KB on Linux
+        'messages': socket.messages,
+    }
+
+    for document in documents:
+        document.drop_collection()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def run_scale(endpoints, args):
+    """
+    Run the simulation of a scale in a process of its own and return its results
+    """
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    command = [sys.executable, '-m', 'benchmark.scheduler_load', 'scale', '--endpoints', str(endpoints), '--results', path,
+               '--mongo', args.mongo, '--database', args.database, '--workers', str(args.workers),
+               '--tasks', str(args.tasks), '--rate', str(args.rate), '--duration', str(args.duration),
+               '--output', str(args.output), '--seed', str(args.seed), '--speed', str(args.speed),
+               '--timeout', str(args.timeout)]
+    if args.trace:
+        command.extend(['--trace', os.path.abspath(args.trace)])
+    if args.pipelined:
+        command.append('--pipelined')
+    try:
+        if subprocess.run(command, cwd=ROOT).returncode != 0:
+            raise RuntimeError('The simulation of {} endpoints failed'.format(endpoints))
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.unlink(path)
+
+def workload(args):
+    if args.trace:
+        return {'trace': os.path.basename(args.trace), 'speed': args.speed, 'workers': args.workers, 'pipelined': args.pipelined}
+    return {'tasks': args.tasks, 'rate': args.rate, 'duration': args.duration, 'output': args.output, 'seed': args.seed,
+            'workers': args.workers, 'pipelined': args.pipelined}
+
+def check(results, baseline, tolerance):
+    """
+    Return the regressions of the results against the baseline
+    """
+    regressions = []
+    for scale, result in results.items():
+        if scale not in baseline:
+            print('No baseline of {} endpoints'.format(scale))
+            continue
+        for name, unit, higher, slack in RESULTS:
+            value, expected = result.get(name), baseline[scale].get(name)
+            if value is None or expected is None:
+                continue
+            if higher and value < expected * (1 - tolerance) - slack or \
+                    not higher and value > expected * (1 + tolerance) + slack:
+                regressions.append('{} endpoints: {} {:.3f} {} against {:.3f} {}'.format(scale, name, value, unit, expected, unit))
+    return regressions
+
+def bench(args):
+    if args.check and not os.path.exists(args.baseline):
+        print('No baseline at {}, save one with --save-baseline first'.format(args.baseline), file=sys.stderr)
+        return 2
+    results = {}
+    print('{:>9} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'endpoints', 'tasks', 'tasks/s', 'wait p50', 'wait p90', 'wait p99', 'disp p50', 'disp p99', 'cpu(s)', 'rss(MB)'))
+    for endpoints in args.endpoints:
+        result = run_scale(endpoints, args)
+        results[str(endpoints)] = result
+        print('{:>9} {finished:>6} {throughput:>9.2f} {queue_wait_p50:>8.3f} {queue_wait_p90:>8.3f} {queue_wait_p99:>8.3f} '
+              '{dispatch_p50:>8.3f} {dispatch_p99:>8.3f} {cpu_time:>8.2f} {peak_rss:>8.1f}'.format(
+                  endpoints, **{k: v if v is not None else float('nan') for k, v in result.items()}))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'workload': workload(args), 'scales': results}, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+        return 0
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['workload'] != workload(args):
+            print('The workload differs from the baseline\'s {}, the results may not be comparable'.format(baseline['workload']))
+        regressions = check(results, baseline['scales'], args.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            return 1
+        print('No regression against the baseline')
+    return 0
+
+def record(args):
+    """
+    Record the arrivals of the tasks scheduled in the last days of a database into a trace
+    """
+    from mongoengine import connect
+    from app.main.model.database import Task
+
+    connect(args.database, host=args.mongo)
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=args.days)
+    start = None
+    endpoints = {}
+    count = 0
+    with open(args.trace, 'w') as f:
+        for task in Task.objects(schedule_date__gte=since).only('schedule_date', 'endpoint_list', 'priority', 'trace') \
+                .order_by('schedule_date'):
+            if not task.endpoint_list:
+                continue
+            start = start or task.schedule_date
+            marks = task.trace or {}
+            if 'launched' in marks and 'finished' in marks:
+                duration = (marks['finished'] - marks['launched']).total_seconds()
+            else:
+                duration = args.duration
+            for uid in task.endpoint_list:
+                arrival = {'at': (task.schedule_date - start).total_seconds(),
+                           'endpoint': endpoints.setdefault(str(uid), len(endpoints)),
+                           'duration': duration, 'output': args.output, 'priority': task.priority}
+                f.write(json.dumps(arrival) + '\n')
+                count += 1
+    print('Recorded {} arrivals on {} endpoints'.format(count, len(endpoints)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load simulation of the task runner')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    def add_common(command):
+        command.add_argument('--mongo', default='mongodb://127.0.0.1:27017', help='MongoDB URL, or mongomock://localhost')
+        command.add_argument('--database', default=DATABASE)
+        command.add_argument('--duration', type=float, default=1, help='mean seconds of a task')
+        command.add_argument('--output', type=int, default=16 * 1024, help='console output bytes of a task')
+
+    def add_workload(command):
+        add_common(command)
+        command.add_argument('--workers', type=int, default=8, help='workers of the task scheduler')
+        command.add_argument('--pipelined', action='store_true', help='pipeline the launches of the tasks')
+        command.add_argument('--tasks', type=int, default=1000, help='tasks to generate')
+        command.add_argument('--rate', type=float, default=50, help='tasks arriving per second')
+        command.add_argument('--seed', type=int, default=1)
+        command.add_argument('--trace', help='replay the arrivals of the trace instead of generating them')
+        command.add_argument('--speed', type=float, default=1, help='replay the trace this many times faster')
+        command.add_argument('--timeout', type=float, default=600, help='seconds to wait for the tasks of a scale')
+
+    command = commands.add_parser('bench', help='run the scales and compare them with the baseline')
+    add_workload(command)
+    command.add_argument('--endpoints', type=int, nargs='+', default=[10, 100, 1000])
+    command.add_argument('--baseline', default=BASELINE, help='baseline file of --save-baseline and --check')
+    command.add_argument('--save-baseline', action='store_true', help='save the results as the baseline of this machine')
+    command.add_argument('--check', action='store_true', help='exit with 1 if any result regressed')
+    command.add_argument('--tolerance', type=float, default=0.2, help='relative regression allowed')
+
+    command = commands.add_parser('scale', help='simulate one scale and print its results as JSON')
+    add_workload(command)
+    command.add_argument('--endpoints', type=int, default=10)
+    command.add_argument('--results', help='write the results to the file instead')
+
+    command = commands.add_parser('record', help='record the task arrivals of a database into a trace')
+    add_common(command)
+    command.add_argument('--days', type=float, default=1)
+    command.add_argument('trace')
+
+    args = parser.parse_args()
+    if args.command == 'bench':
+        sys.exit(bench(args))
+    if args.command == 'record':
+        record(args)
+        return
+    if args.trace:
+        arrivals = load_arrivals(args.trace)
+    else:
+        arrivals = generate_arrivals(args.tasks, args.rate, args.endpoints, args.duration, args.output, args.seed)
+    results = simulate(args, arrivals)
+    if args.results:
+        with open(args.results, 'w') as f:
+            json.dump(results, f)
+    else:
+        print(json.dumps(results, indent=2))
+    sys.stdout.flush()
+    # the runner's threads are not meant to be stopped
+    os._exit(0)
+
+if __name__ == '__main__':
+    main()
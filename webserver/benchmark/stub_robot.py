@@ -0,0 +1,36 @@
+"""
+A stand-in of the robot process for the scheduler load benchmark
+
+It writes `--output` bytes of console output spread over `--duration` seconds and exits with
+`--returncode`, the robot options it's launched with are ignored. Run it with `python -S` to keep
+the start-up cost small.
+"""
+import argparse
+import sys
+import time
+
+LINE = b'Stub Keyword'.ljust(63, b'.') + b' | PASS |\n'
+STEP = 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=1)
+    parser.add_argument('--output', type=int, default=0)
+    parser.add_argument('--returncode', type=int, default=0)
+    args, _ = parser.parse_known_args()
+
+    steps = max(int(args.duration / STEP), 1)
+    lines = args.output // len(LINE)
+    deadline = time.monotonic()
+    for i in range(steps):
+        chunk = lines * (i + 1) // steps - lines * i // steps
+        if chunk:
+            sys.stdout.buffer.write(LINE * chunk)
+            sys.stdout.buffer.flush()
+        deadline += args.duration / steps
+        time.sleep(max(deadline - time.monotonic(), 0))
+    sys.exit(args.returncode)
+
+if __name__ == '__main__':
+    main()
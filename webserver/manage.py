@@ -11,10 +11,11 @@ from app import blueprint
 from app.main import create_app
 from mongoengine import connect
 from app.main.config import get_config
-from task_runner.runner import start_event_thread, start_heartbeat_thread, start_rpc_proxy, initialize_runner, install_sio
+from task_runner.runner import start_scheduler, start_event_thread, start_lease_thread, start_heartbeat_thread, start_rpc_proxy, \
+            initialize_runner, install_sio, event_loop_parent, check_multi_node_config
 from flask_socketio import SocketIO, send, emit
 from app.main.controller.socketio_controller import handle_message, \
-            handle_join_room, handle_enter_room, handle_leave_room
+            handle_join_room, handle_enter_room, handle_leave_room, handle_replay
 
 app = create_app(os.getenv('BOILERPLATE_ENV') or 'dev')
 get_config().init_app(app)
@@ -22,7 +23,8 @@ app.register_blueprint(blueprint)
 
 async_mode = 'threading' if os.name == 'nt' else 'eventlet'
 cors_allowed_origins = '*' if os.getenv('BOILERPLATE_ENV') != 'prod' else None
-socketio = SocketIO(app, async_mode=async_mode, cors_allowed_origins=cors_allowed_origins)
+socketio = SocketIO(app, async_mode=async_mode, cors_allowed_origins=cors_allowed_origins,
+                    message_queue=get_config().SOCKETIO_MESSAGE_QUEUE)
 install_sio(socketio)
 
 app.app_context().push()
@@ -34,16 +36,38 @@ manager = Manager(app)
 
 @manager.command
 def run():
+    if get_config().RUNNER_MULTI_NODE and not check_multi_node_config(app):
+        return 1
     connect(get_config().MONGODB_DATABASE, host=get_config().MONGODB_URL, port=get_config().MONGODB_PORT)
     # workaround for dual runnings of the server
     if 'WERKZEUG_RUN_MAIN' in os.environ and os.environ['WERKZEUG_RUN_MAIN'] == 'true':
+        start_scheduler(app)
         start_event_thread(app)
+        start_lease_thread(app)
         start_heartbeat_thread(app)
         start_rpc_proxy(app)
-        initialize_runner()
+        initialize_runner(app)
     #app.run(host='0.0.0.0')
     socketio.run(app, host='0.0.0.0')
 
+@manager.command
+def runner():
+    """Runs an extra task runner sharing the task queues with the server, requires RUNNER_MULTI_NODE."""
+    if not get_config().RUNNER_MULTI_NODE:
+        app.logger.error('RUNNER_MULTI_NODE is required to run the extra task runner')
+        return 1
+    if not check_multi_node_config(app):
+        return 1
+    if not get_config().SOCKETIO_MESSAGE_QUEUE:
+        app.logger.warning('SOCKETIO_MESSAGE_QUEUE is not set, test reports can\'t reach the browsers')
+    connect(get_config().MONGODB_DATABASE, host=get_config().MONGODB_URL, port=get_config().MONGODB_PORT)
+    start_scheduler(app)
+    start_lease_thread(app)
+    # the keyword bridges of the robot processes launched by this runner, along with the RPC proxy they forward to
+    start_rpc_proxy(app)
+    initialize_runner(app)
+    event_loop_parent(app)
+
 @manager.command
 def test():
     """Runs the unit tests."""
@@ -57,6 +81,7 @@ socketio.on_event('message', handle_message)
 socketio.on_event('join', handle_join_room)
 socketio.on_event('enter', handle_enter_room)
 socketio.on_event('leave', handle_leave_room)
+socketio.on_event('replay', handle_replay)
 
 @socketio.on('connect')
 def test_connect():
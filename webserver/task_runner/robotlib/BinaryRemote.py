@@ -0,0 +1,52 @@
+"""
+A drop-in replacement of Robot Framework's Remote library speaking msgpack frames to the keyword bridge
+
+    Library    BinaryRemote    ${remote_daemon_address}    10    WITH NAME    EndpointDaemon1
+
+The task runner puts this directory on the robot processes' python path and passes the port of the
+binary bridge as ${port_binary}. The keyword calls go through one persistent connection, the bytes
+arguments and return values are sent as they are instead of base64 in XML. It falls back to XML-RPC
+at the same URI when msgpack is not installed or the binary bridge is not available.
+"""
+import socket
+from urllib.parse import urlparse
+
+from robot.api import logger
+from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
+from robot.libraries.Remote import Remote
+from robot.utils import timestr_to_secs
+
+from msgpackrpc import MsgpackRemoteClient, msgpack
+
+
+def _binary_port():
+    try:
+        port = BuiltIn().get_variable_value('${port_binary}')
+    except RobotNotRunningError:
+        return None
+    return int(port) if port else None
+
+class BinaryRemote(Remote):
+    ROBOT_LIBRARY_SCOPE = 'TEST SUITE'
+
+    def __init__(self, uri='http://127.0.0.1:8270', timeout=None):
+        """Connects to the keyword bridge at ``uri`` like the Remote library does.
+
+        The msgpack transport is used when the port of the binary bridge is
+        given by the ``${port_binary}`` variable, otherwise the keywords are
+        called with XML-RPC.
+        """
+        super().__init__(uri, timeout)
+        port = _binary_port()
+        if not port:
+            return
+        if not msgpack:
+            logger.info('msgpack is not installed, calling the keywords with XML-RPC')
+            return
+        parts = urlparse(self._uri)
+        try:
+            self._client = MsgpackRemoteClient(parts.hostname, port, parts.path,
+                                               timestr_to_secs(timeout) if timeout else None)
+        except socket.error as err:
+            logger.info('Binary bridge at port {} is not available, calling the keywords with XML-RPC: {}'.format(port, err))
+
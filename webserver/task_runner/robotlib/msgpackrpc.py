@@ -0,0 +1,115 @@
+"""
+The msgpack framing of the binary keyword bridge, shared by the BinaryRemote library and the bridge
+
+Each frame is the length of its msgpack payload as 4 bytes in network order followed by the payload.
+"""
+import socket
+import struct
+from xmlrpc.client import Binary
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+def _default(obj):
+    if isinstance(obj, Binary):
+        return obj.data
+    return str(obj)
+
+def pack(obj):
+    """
+    Encode a message to a frame, the length of the msgpack payload followed by the payload
+    """
+    payload = msgpack.packb(obj, use_bin_type=True, default=_default)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def unpack(payload):
+    return msgpack.unpackb(payload, raw=False)
+
+class MsgpackRemoteClient():
+    """
+    The counterpart of XmlRpcRemoteClient, it sends [msgid, method, path, params] and receives [msgid, error, result]
+    """
+    def __init__(self, host, port, path, timeout=None):
+        self.address = (host, port)
+        self.path = path
+        self.timeout = timeout
+        self.msgid = 0
+        self._sock = None
+        self._rfile = None
+        self.connect()
+
+    def connect(self):
+        self.close()
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._sock.makefile('rb')
+
+    def close(self):
+        if self._sock:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+
+    def call(self, method, *params):
+        if not self._sock:
+            self.connect()
+        self.msgid += 1
+        try:
+            self._sock.sendall(pack([self.msgid, method, self.path, params]))
+            header = self._rfile.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                raise ConnectionError('connection closed by the bridge')
+            size, = FRAME_HEADER.unpack(header)
+            if size > MAX_FRAME_SIZE:
+                raise ConnectionError('frame of {} bytes is too large'.format(size))
+            payload = self._rfile.read(size)
+            if len(payload) < size:
+                raise ConnectionError('connection closed by the bridge')
+            msgid, error, result = unpack(payload)
+            if msgid != self.msgid:
+                raise ConnectionError('answer to call {} received for call {}'.format(msgid, self.msgid))
+        except (socket.error, ValueError):
+            self.close()
+            raise
+        if error:
+            raise RuntimeError(error)
+        return result
+
+    def get_keyword_names(self):
+        try:
+            return self.call('get_keyword_names')
+        except (socket.error, RuntimeError) as err:
+            raise TypeError(err)
+
+    def get_keyword_arguments(self, name):
+        try:
+            return self.call('get_keyword_arguments', name)
+        except (socket.error, RuntimeError):
+            raise TypeError
+
+    def get_keyword_types(self, name):
+        raise TypeError
+
+    def get_keyword_tags(self, name):
+        try:
+            return self.call('get_keyword_tags', name)
+        except (socket.error, RuntimeError):
+            raise TypeError
+
+    def get_keyword_documentation(self, name):
+        try:
+            return self.call('get_keyword_documentation', name)
+        except (socket.error, RuntimeError):
+            raise TypeError
+
+    def run_keyword(self, name, args, kwargs):
+        try:
+            return self.call('run_keyword', name, args, kwargs)
+        except socket.error as err:
+            raise RuntimeError('Connection to remote server broken: %s' % err)
@@ -1,62 +1,110 @@
 import argparse
 import asyncio
-import chardet
 import datetime
 import functools
+import ipaddress
 import json
 import os
 import queue
 import re
 import shutil
 import signal
+import socket
 import subprocess
 import sys
 import tarfile
+import tempfile
 import threading
 import time
 import traceback
+import uuid
 import xmlrpc.client
 from io import StringIO
 from pathlib import Path
+from xml.etree.ElementTree import ParseError
 
 import eventlet
 import mongoengine
 import websockets
 from mongoengine import ValidationError
 from app.main.config import get_config
-from app.main.model.database import Endpoint, Task, TaskQueue, EventQueue, Organization, Team, \
-        EVENT_CODE_CANCEL_TASK, EVENT_CODE_START_TASK, EVENT_CODE_UPDATE_USER_SCRIPT, QUEUE_PRIORITY
+from app.main.model.database import CaseResult, Endpoint, EndpointLease, Task, TaskQueue, QueuedTask, EventQueue, Organization, Team, \
+        EVENT_CODE_CANCEL_TASK, EVENT_CODE_START_TASK, EVENT_CODE_UPDATE_USER_SCRIPT
 from app.main.util import get_room_id
+from app.main.util.console_log import ConsoleLogWriter
+from app.main.util.notifier import EVENT_NOTIFIER
 from app.main.util.get_path import get_test_result_path, get_upload_files_root, get_user_scripts_root
 from app.main.util.tarball import make_tarfile_from_dir
+from app.main.util.result_file import compress_result_files
 from bson import DBRef, ObjectId
 from mongoengine import connect
+from pymongo.errors import OperationFailure
 from sanic import Sanic
 from sanic.websocket import WebSocketProtocol
+from task_runner.util.cache import TTLCache
+from task_runner.util.console import ConsoleBuffer, ConsolePump, console_env
 from task_runner.util.dbhelper import db_update_test
+from task_runner.util.keywords import KeywordMetadataCache
+from task_runner.util.lifecycle import CANCELLING, LAUNCHING, RUNNING, TaskLifecycle
+from task_runner.util.liveness import LivenessTracker
+from task_runner.util.metrics import METRICS, DURATION_BUCKETS, serve as serve_metrics
+from task_runner.util import robot_pool
+from task_runner.util.scheduler import BackgroundExecutor, TaskScheduler
+from task_runner.util.relay import LogRelay
+from task_runner.util.robot_output import iter_test_cases, suite_long_names
+from task_runner.util import resources
 from task_runner.util.notification import (notification_chain_call,
                                            notification_chain_init)
 from task_runner.util.xmlrpcserver import XMLRPCServer
+from task_runner.util.binaryrpc import BinaryRPCServer, is_supported as binary_bridge_supported
 from wsrpc import WebsocketRPC
 from asyncio.exceptions import CancelledError
 from sanic.websocket import ConnectionClosed
 
-ROBOT_PROCESSES = {}  # {task id: process instance}
-TASK_THREADS = {}     # {taskqueue id: idle counter (int)}}
-TASK_LOCK = threading.Lock()
-ROOM_MESSAGES = {}  # {"organziation:team": old_message, new_message}
+TASK_STATES = TaskLifecycle()  # the tasks launched by this runner and their robot processes
+SCHEDULER = None
+BACKGROUND = None  # executor of the heavy post-processing jobs, kept off the scheduler's workers
+RESOURCES = None  # resource monitor of the robot process trees
+RUNNER_ID = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+ROOM_MESSAGES = {}  # {"organziation:team": {task id: console buffer}}
 RPC_PROXIES = {}    # {"endpoint_id": (websocket, rpc)}
 RPC_SOCKET = None
-TASKS_CACHED = {}
+TASK_ROOMS = TTLCache(get_config().RELAY_CACHE_SIZE, get_config().RELAY_CACHE_TTL)  # {task id: room id} for the relay
+UNKNOWN_TASKS = TTLCache(get_config().RELAY_CACHE_SIZE, get_config().RELAY_UNKNOWN_TTL)  # {task id: True} not found by the relay
+PREPARED_LAUNCHES = {}  # {endpoint id: {task id: robot arguments}} prepared while the endpoint is busy
+PREPARE_LOCKS = {}  # {endpoint id: lock of its prepared launches}
+FIRST_KEYWORDS = {}  # {endpoint uid: task id} of the tasks launched which haven't called a remote keyword yet
+MULTI_NODE_POLL_INTERVAL = 5  # the longest poll interval of the event queues without change streams in multi-node mode
+ROBOT_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'robotlib')  # BinaryRemote for the suites
 
 RPC_APP = Sanic('RPC Proxy app')
+RPC_APP.config.WEBSOCKET_PING_INTERVAL = get_config().LIVENESS_PING_INTERVAL
+RPC_APP.config.WEBSOCKET_PING_TIMEOUT = get_config().LIVENESS_PING_TIMEOUT
+LIVENESS = LivenessTracker()
+KEYWORD_METADATA = KeywordMetadataCache()
+
+EVENTS_PROCESSED = METRICS.counter('robotest_events_total', 'Events processed by the event loop', ['code'])
+EVENT_DISPATCH_LAG = METRICS.histogram('robotest_event_dispatch_lag_seconds', 'Seconds from an event being triggered to being handled')
+EVENT_HANDLER_DURATION = METRICS.histogram('robotest_event_handler_seconds', 'Seconds spent handling an event', ['code'])
+TASK_QUEUE_WAIT = METRICS.histogram('robotest_task_queue_wait_seconds', 'Seconds from a task being scheduled to being launched',
+                                    buckets=DURATION_BUCKETS)
+TASK_LAUNCH_DURATION = METRICS.histogram('robotest_task_launch_seconds', 'Seconds from a task being popped to its robot process being spawned')
+TASK_RUN_DURATION = METRICS.histogram('robotest_task_run_seconds', 'Seconds a task has been running, by its final status', ['status'],
+                                      buckets=DURATION_BUCKETS)
+TASKS_FINISHED = METRICS.counter('robotest_tasks_finished_total', 'Tasks finished by this runner', ['status'])
+TASKS_RUNNING = METRICS.gauge('robotest_tasks_running', 'Tasks launched by this runner and not exited yet')
+TASKS_QUEUED = METRICS.gauge('robotest_tasks_queued', 'Tasks waiting in the queues, by endpoint', ['endpoint'])
+SCHEDULER_WORKERS = METRICS.gauge('robotest_scheduler_workers', 'Workers of the task scheduler by state', ['state'])
+SCHEDULER_ENDPOINTS = METRICS.gauge('robotest_scheduler_endpoints', 'Endpoints served by the task scheduler by state', ['state'])
+RPC_ENDPOINTS = METRICS.gauge('robotest_rpc_endpoints_connected', 'Endpoint libraries connected to the RPC proxy')
+RPC_CONNECTIONS = METRICS.counter('robotest_rpc_connections_total', 'Connections of the endpoints accepted by the RPC proxy')
+RPC_LOOP_LAG = METRICS.gauge('robotest_rpc_loop_lag_seconds', 'Seconds the RPC proxy\'s loop was late to wake up at the last check')
 
 def install_sio(sio):
     global RPC_SOCKET
     RPC_SOCKET = sio
 
 def event_handler_cancel_task(app, event):
-    global ROBOT_PROCESSES, TASK_THREADS
     endpoint_uid = event.message['endpoint_uid']
     priority = event.message['priority']
     task_id = event.message['task_id']
@@ -66,63 +114,53 @@ def event_handler_cancel_task(app, event):
         app.logger.error('Task not found for ' + task_id)
         return
 
+    state, process = TASK_STATES.cancel(task.id)
+    if state == LAUNCHING:
+        app.logger.info('Task {} is cancelled while launching'.format(task_id))
+        return
+    if state == CANCELLING and process is None:
+        # cancelled again while launching, the worker terminates the process once it's spawned
+        app.logger.info('Task {} is being cancelled already'.format(task_id))
+        return
+    if state in (RUNNING, CANCELLING):
+        task.modify(status='cancelled')
+        #os.kill(process.pid, signal.CTRL_C_EVENT)
+        process.terminate()
+        # the endpoint is served again in finish_task() when the robot process exits
+        app.logger.info('Running task cancelled with process running')
+        return
+
     if endpoint_uid:
         endpoint = Endpoint.objects(uid=endpoint_uid, organization=event.organization, team=event.team).first()
         if not endpoint:
             app.logger.error('Endpoint not found for {}'.format(endpoint_uid))
             return
 
-        taskqueue = TaskQueue.objects(organization=event.organization, team=event.team, endpoint=endpoint, priority=priority).first()
-        if not taskqueue:
-            app.logger.error('Task queue not found for {}:{}'.format(endpoint_uid, priority))
-            return
-    else:
-        taskqueue = TaskQueue.objects(organization=event.organization, team=event.team, priority=priority, tasks=task).first()
-        if not taskqueue:
-            app.logger.error('Task queue not found for task {}'.format(task_id))
-            return
-        taskqueue.modify(pull__tasks=task)
+        if get_config().RUNNER_MULTI_NODE:
+            owner = EndpointLease.owner(endpoint)
+            if owner and owner != RUNNER_ID:
+                return forward_event(app, event, owner)
+
+    if QueuedTask.objects(organization=event.organization, team=event.team, task=task).delete() != 0:
         task.modify(status='cancelled')
         app.logger.info('Waiting task cancelled')
         return
-
-    if task.status == 'waiting':
-        if taskqueue.running_task and taskqueue.running_task.id == task.id and str(endpoint.id) in TASK_THREADS:
-            app.logger.critical('Waiting task to run')
-            for i in range(20):
-                task.reload('status')
-                if task.status == 'running':
-                    break
-                time.sleep(0.1)
-            else:
-                app.logger.error('Waiting task to run timeouted out')
-                taskqueue.modify(running_task=None)
-                task.modify(status='cancelled')
-        else:
-            taskqueue.modify(running_task=None)
-            taskqueue.modify(pull__tasks=task)
-            task.modify(status='cancelled')
-            app.logger.info('Waiting task cancelled without process running')
-            return
-    if task.status == 'running':
-        if str(endpoint.id) in TASK_THREADS:
-            if task.id in ROBOT_PROCESSES:
-                taskqueue.modify(running_task=None)
-                task.modify(status='cancelled')
-
-                #os.kill(ROBOT_PROCESSES[task.id].pid, signal.CTRL_C_EVENT)
-                ROBOT_PROCESSES[task.id].terminate()
-                # del ROBOT_PROCESSES[task.id]  # will be done in the task loop when robot process exits
-                app.logger.info('Running task cancelled with process running')
-                return
-            else:
-                app.logger.error('Task process not found when cancelling task (%s)' % task_id)
-        taskqueue.modify(running_task=None)
+    if task.status in ('waiting', 'running'):
+        # popped by a worker which won't launch it, or left running by a runner gone
+        if task.endpoint_run:
+            TaskQueue.objects(organization=event.organization, team=event.team, endpoint=task.endpoint_run,
+                              priority=priority, running_task=task).update(running_task=None)
         task.modify(status='cancelled')
-        app.logger.info('Running task cancelled without process running')
+        app.logger.info('Task cancelled without process running')
+        return
+    app.logger.error('Task {} is {}, nothing to cancel'.format(task_id, task.status))
 
 def event_handler_start_task(app, event):
     endpoint_uid = event.message['endpoint_uid']
+    # the event pushed by deleting an endpoint has no task
+    task_ids = event.message.get('task_ids') or ([event.message['task_id']] if 'task_id' in event.message else [])
+    if task_ids:
+        mark_tasks(task_ids, 'dispatched')
     to_delete = event.message['to_delete'] if 'to_delete' in event.message else False
     organization = event.organization
     team = event.team
@@ -134,20 +172,15 @@ def event_handler_start_task(app, event):
             app.logger.error('Endpoint not found for {}@{}'.format(org_name, endpoint_uid))
         return
 
-    endpoint_id = str(endpoint.id)
-    TASK_LOCK.acquire()
-    if endpoint_id not in TASK_THREADS:
-        TASK_THREADS[endpoint_id] = 1
-        TASK_LOCK.release()
-        reset_task_queue_status(app, organization, team)
-        thread = threading.Thread(target=process_task_per_endpoint, args=(app, endpoint, organization, team), name='task_thread_per_endpoint')
-        thread.daemon = True
-        thread.start()
-        #del TASK_THREADS[endpoint_id]  ## will delete when task loop exits
-    else:
-        TASK_THREADS[endpoint_id] = 2
-        TASK_LOCK.release()
+    if get_config().RUNNER_MULTI_NODE:
+        lease = EndpointLease.claim(endpoint, RUNNER_ID, get_config().RUNNER_LEASE_TTL)
+        if not lease:
+            return forward_event(app, event, EndpointLease.owner(endpoint))
+
+    if not SCHEDULER.schedule(str(endpoint.id), process_task_per_endpoint, app, endpoint, organization, team):
         app.logger.info('Schedule the task to the pending queue')
+        if get_config().PIPELINED_LAUNCH:
+            SCHEDULER.submit(prefetch_next_task, app, endpoint)
 
 def event_handler_update_user_script(app, event):
     # TODO:
@@ -156,23 +189,45 @@ def event_handler_update_user_script(app, event):
     user = event.message['user']
     db_update_test(script=script, user=user)
 
+# a handler returns True if it has forwarded the event to another runner, which processes it then
 EVENT_HANDLERS = {
     EVENT_CODE_START_TASK: event_handler_start_task,
     EVENT_CODE_CANCEL_TASK: event_handler_cancel_task,
     EVENT_CODE_UPDATE_USER_SCRIPT: event_handler_update_user_script,
 }
 
+def forward_event(app, event, runner):
+    """
+    Forward the event to the runner owning the endpoint, or back to the shared event queue if the owner is gone
+    """
+    eventqueue = EventQueue.objects(runner=runner).first() if runner else None
+    if not eventqueue:
+        eventqueue = EventQueue.objects(runner=None).first()
+    if not eventqueue.push(event):
+        app.logger.error('Failed to forward the event {} to runner {}'.format(event.id, runner))
+        return False
+    app.logger.info('Forward the event {} to runner {}'.format(event.id, runner))
+    return True
+
 def event_loop(app):
-    eventqueue = EventQueue.objects().first()
+    eventqueue = EventQueue.objects(runner=None).first()
     if not eventqueue:
         app.logger.error('event queue not found')
+    runner_queue = None
+    if get_config().RUNNER_MULTI_NODE:
+        runner_queue = EventQueue(runner=RUNNER_ID, heartbeat=datetime.datetime.utcnow())
+        runner_queue.save()
 
     app.logger.info('Event loop started')
 
+    poll_interval = get_config().EVENT_POLL_INTERVAL
     while True:
-        event = eventqueue.pop()
+        EVENT_NOTIFIER.clear()
+        event = runner_queue.pop() if runner_queue else None
         if not event:
-            time.sleep(1)
+            event = eventqueue.pop()
+        if not event:
+            EVENT_NOTIFIER.wait(poll_interval)
             continue
 
         if isinstance(event, DBRef):
@@ -180,15 +235,43 @@ def event_loop(app):
             continue
 
         app.logger.info('Start to process event {} ...'.format(event.code))
+        if event.date:
+            EVENT_DISPATCH_LAG.observe(max((datetime.datetime.utcnow() - event.date).total_seconds(), 0))
+        EVENTS_PROCESSED.labels(event.code).inc()
 
-        try:
-            EVENT_HANDLERS[event.code](app, event)
-            event.modify(status='Processed')
-        except KeyError:
+        handler = EVENT_HANDLERS.get(event.code)
+        if not handler:
             app.logger.error('Unknown message: %s' % event.code)
+            continue
+        try:
+            with EVENT_HANDLER_DURATION.labels(event.code).time():
+                forwarded = handler(app, event)
+            if not forwarded:
+                event.modify(status='Processed')
+        except Exception:
+            # the event loop must survive whatever a handler raises
+            app.logger.exception('Failed to process event {}'.format(event.id))
+
+def event_watcher(app):
+    """
+    Wake up the event loop on changes of the event queue made by any process
+    """
+    collection = EventQueue._get_collection()
+    try:
+        with collection.watch([{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]) as stream:
+            app.logger.info('Event queue watcher started')
+            for change in stream:
+                EVENT_NOTIFIER.notify()
+    except OperationFailure as e:
+        app.logger.error('Watching event queue failed, fall back to in-process notification: {}'.format(e))
 
 def event_loop_parent(app):
     reset_event_queue_status(app)
+    migrate_task_queues(app)
+    if get_config().EVENT_DISPATCH_MODE == 'change_stream':
+        watcher = threading.Thread(target=event_watcher, args=(app,), name='event_watcher')
+        watcher.daemon = True
+        watcher.start()
     thread = threading.Thread(target=event_loop, args=(app,), name='event_loop')
     thread.daemon = True
     thread.start()
@@ -246,217 +329,344 @@ def convert_json_to_robot_variable(args, variables, variable_file):
 
     args.extend(['--variablefile', str(variable_file)])
 
+def prepare_launch(task, endpoint_uid):
+    """
+    Create the result directory and the variable file of the task, return the robot arguments to run it
+    """
+    result_dir = get_test_result_path(task)
+    scripts_dir = get_user_scripts_root(task)
+    args = ['robot', '--loglevel', 'debug', '--outputdir', str(result_dir), '--extension', 'md',
+            '--consolecolors', 'on', '--consolemarkers', 'on']
+    os.makedirs(result_dir, exist_ok=True)
+
+    if hasattr(task, 'testcases'):
+        for t in task.testcases:
+            args.extend(['-t', t])
+
+    if hasattr(task, 'variables'):
+        variable_file = Path(result_dir) / 'variablefile.py'
+        convert_json_to_robot_variable(args, task.variables, variable_file)
+
+    addr, port = get_config().XMLRPC_BRIDGE_ADDRESS, get_config().XMLRPC_BRIDGE_PORT
+    args.extend(['-v', f'address_daemon:{addr}', '-v', f'port_daemon:{port}',
+                '-v', f'task_id:{task.id}', '-v', f'endpoint_uid:{endpoint_uid}'])
+    if get_config().BINARY_BRIDGE_PORT and binary_bridge_supported():
+        args.extend(['-v', f'port_binary:{get_config().BINARY_BRIDGE_PORT}'])
+    args.extend(['--pythonpath', ROBOT_LIBRARY_PATH])
+    args.append(os.path.join(scripts_dir, task.test.path, task.test.test_suite + '.md'))
+    return args
+
+def prefetch_next_task(app, endpoint):
+    """
+    Prepare the launch of the task queued next for the endpoint while it's running a task in pipelined launch mode
+    """
+    task = TaskQueue.peek_next(endpoint)
+    if not task:
+        return
+    task.reload('kickedoff')
+    if task.kickedoff != 0 and not task.parallelization:
+        return
+    endpoint_id = str(endpoint.id)
+    with prepare_lock(endpoint_id):
+        if task.id in PREPARED_LAUNCHES.get(endpoint_id, {}):
+            return
+    # prepared out of the lock, a task prepared twice by a race gets the same arguments
+    args = prepare_launch(task, endpoint.uid)
+    with prepare_lock(endpoint_id):
+        PREPARED_LAUNCHES.setdefault(endpoint_id, {})[task.id] = args
+    app.logger.info('Prepared the launch of task {} on endpoint {}'.format(task.id, endpoint.uid))
+
+def prepare_lock(endpoint_id):
+    return PREPARE_LOCKS.setdefault(endpoint_id, threading.Lock())
+
+def take_prepared_launch(app, endpoint, task_id=None):
+    """
+    Take the robot arguments prepared for the task popped, None if it's not prepared
+
+    It's called by the worker serving the endpoint. The launches prepared for the other tasks
+    still queued are kept for later, those of the tasks gone from the queue are discarded.
+    """
+    endpoint_id = str(endpoint.id)
+    with prepare_lock(endpoint_id):
+        prepared = PREPARED_LAUNCHES.pop(endpoint_id, {})
+    args = prepared.pop(task_id, None)
+    if not prepared:
+        return args
+    queued = TaskQueue.queued_among(endpoint, prepared)
+    with prepare_lock(endpoint_id):
+        launches = PREPARED_LAUNCHES.setdefault(endpoint_id, {})
+        for prepared_id in queued:
+            launches.setdefault(prepared_id, prepared[prepared_id])
+    for prepared_id in prepared:
+        if prepared_id not in queued:
+            discard_prepared_launch(app, prepared_id)
+    return args
+
+def discard_prepared_launch(app, task_id):
+    """
+    Remove the result directory prepared for a task which hasn't been launched next, eg. cancelled or preempted
+    """
+    task = Task.objects(pk=task_id).first()
+    if task and task.kickedoff != 0:
+        return
+    if task:
+        result_dir = get_test_result_path(task)
+        if os.path.exists(result_dir):
+            shutil.rmtree(result_dir)
+    app.logger.info('Discarded the launch prepared for task {}'.format(task_id))
+
 def process_task_per_endpoint(app, endpoint, organization=None, team=None):
-    global ROBOT_PROCESSES, TASKS_CACHED
+    """
+    Launch the next task of the endpoint, return True if a task has been launched
 
+    It's called by the scheduler's workers, the endpoint stays occupied while the
+    task is running and will be served again by finish_task() when the task ends.
+    """
     if not organization and not team:
         app.logger.error('Argument organization and team must neither be None')
-        return
+        return False
     room_id = get_room_id(str(organization.id), str(team.id) if team else '')
 
+    if get_config().RUNNER_MULTI_NODE and not EndpointLease.claim(endpoint, RUNNER_ID, get_config().RUNNER_LEASE_TTL):
+        app.logger.info('Endpoint {} has been taken over by another runner'.format(endpoint.uid))
+        return False
+
     taskqueues = TaskQueue.objects(organization=organization, team=team, endpoint=endpoint)
     if taskqueues.count() == 0:
         app.logger.error('Taskqueue not found')
-        return
+        return False
     # taskqueues = [q for q in taskqueues]  # query becomes stale if the document it points to gets changed elsewhere, use document instead of query to perform deletion
     taskqueue_first = taskqueues.first()
 
-    endpoint_id = str(endpoint.id)
     endpoint_uid = endpoint.uid
     org_name = team.organization.name + '-' + team.name if team else organization.name
 
     while True:
         taskqueue_first.reload('to_delete')
         if taskqueue_first.to_delete:
+            QueuedTask.objects(endpoint=endpoint).delete()
             taskqueues.delete()
+            PREPARED_LAUNCHES.pop(str(endpoint.id), None)
+            PREPARE_LOCKS.pop(str(endpoint.id), None)
             endpoint.delete()
             app.logger.info('Abort the task loop: {} @ {}'.format(org_name, endpoint_uid))
-            break
-        # TODO: lower priority tasks will take precedence if higher priority queue is empty first
-        # but filled then when thread is searching for tasks in the lower priority task queues
-        for priority in QUEUE_PRIORITY:
-            exit_task = False
-            for taskqueue in taskqueues:
-                taskqueue.reload('to_delete')
-                if taskqueue.to_delete:
-                    exit_task = True
-                    break
-                if taskqueue.priority == priority:
-                    break
-            else:
-                app.logger.error('Found task queue with unknown priority')
-                continue
+            return False
+        taskqueue, task = TaskQueue.pop_next(endpoint, RUNNER_ID)
+        popped = datetime.datetime.utcnow()
+        if not task:
+            take_prepared_launch(app, endpoint)
+            return False
+        if not taskqueue:
+            app.logger.error('Task queue not found for task {}'.format(task.id))
+            continue
+        task_id = str(task.id)
+        if isinstance(task, DBRef):
+            app.logger.warning('task {} has been deleted, ignore it'.format(task_id))
+            taskqueue.modify(running_task=None)
+            continue
 
-            if exit_task:
-                break
+        if task.kickedoff != 0 and not task.parallelization:
+            app.logger.info('task has been taken over by other threads, do nothing')
+            taskqueue.modify(running_task=None)
+            continue
 
-            # "continue" to search for tasks in the lower priority task queues
-            # "break" to start over to search for tasks from the top priority task queue
-            task = taskqueue.pop()
-            if not task:
-                continue
-            task_id = str(task.id)
-            if isinstance(task, DBRef):
-                app.logger.warning('task {} has been deleted, ignore it'.format(task_id))
-                taskqueue.modify(running_task=None)
-                break
-
-            if task.kickedoff != 0 and not task.parallelization:
-                app.logger.info('task has been taken over by other threads, do nothing')
-                taskqueue.modify(running_task=None)
-                break
-
-            task.modify(inc__kickedoff=1)
-            if task.kickedoff != 1 and not task.parallelization:
-                app.logger.warning('a race condition happened')
-                taskqueue.modify(running_task=None)
-                break
-
-            app.logger.info('Start to run task {} in the thread {}'.format(task_id, threading.current_thread().name))
-
-            result_dir = get_test_result_path(task)
-            scripts_dir = get_user_scripts_root(task)
-            args = ['robot', '--loglevel', 'debug', '--outputdir', str(result_dir), '--extension', 'md',
-                    '--consolecolors', 'on', '--consolemarkers', 'on']
-            os.makedirs(result_dir)
-
-            if hasattr(task, 'testcases'):
-                for t in task.testcases:
-                    args.extend(['-t', t])
-
-            if hasattr(task, 'variables'):
-                variable_file = Path(result_dir) / 'variablefile.py'
-                convert_json_to_robot_variable(args, task.variables, variable_file)
-
-            addr, port = '127.0.0.1', 8270
-            args.extend(['-v', f'address_daemon:{addr}', '-v', f'port_daemon:{port}',
-                        '-v', f'task_id:{task_id}', '-v', f'endpoint_uid:{endpoint_uid}'])
-            args.append(os.path.join(scripts_dir, task.test.path, task.test.test_suite + '.md'))
-            app.logger.info('Arguments: ' + str(args))
-
-            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0,
-                                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0)
-            ROBOT_PROCESSES[task.id] = p
-
-            task.status = 'running'
-            task.run_date = datetime.datetime.utcnow()
-            task.endpoint_run = endpoint
-            task.save()
-            RPC_SOCKET.emit('task started', {'task_id': task_id}, room=room_id)
-
-            log_msg = StringIO()
-            if room_id not in ROOM_MESSAGES:
-                ROOM_MESSAGES[room_id] = {task_id: log_msg}
-            else:
-                if task_id not in ROOM_MESSAGES[room_id]:
-                    ROOM_MESSAGES[room_id][task_id] = log_msg
-            ss = b''
-            while True:
-                c = p.stdout.read(1)
-                if not c:
-                    break
-                try:
-                    c = c.decode(encoding=sys.getdefaultencoding())
-                except UnicodeDecodeError:
-                    ss += c
-                else:
-                    c = '\r\n' if c == '\n' else c
-                    log_msg.write(c)
-                    RPC_SOCKET.emit('test report', {'task_id': task_id, 'message': c}, room=room_id)
-            del ROBOT_PROCESSES[task.id]
-
-            if ss != b'':
-                ss = ss.decode(chardet.detect(ss)['encoding'])
-                log_msg_all = StringIO()
-                log_msg_all.write(ss)
-                log_msg_all.write(log_msg.getvalue())
-                app.logger.info('\n' + log_msg_all.getvalue())
-                RPC_SOCKET.emit('test report', {'task_id': task_id, 'message': ss}, room=room_id)
-            else:
-                app.logger.info('\n' + log_msg.getvalue())
-            #app.logger.info('\n' + log_msg.getvalue().replace('\r\n', '\n'))
-
-            p.wait()
-            if p.returncode == 0:
-                task.status = 'successful'
-            else:
-                task.reload('status')
-                if task.status != 'cancelled':
-                    task.status = 'failed'
-            task.save()
-            RPC_SOCKET.emit('task finished', {'task_id': task_id, 'status': task.status}, room=room_id)
-            ROOM_MESSAGES[room_id][task_id].close()
-            del ROOM_MESSAGES[room_id][task_id]
-            if task_id in TASKS_CACHED:
-                del TASKS_CACHED[task_id]
+        task.modify(inc__kickedoff=1)
+        if task.kickedoff != 1 and not task.parallelization:
+            app.logger.warning('a race condition happened')
+            taskqueue.modify(running_task=None)
+            continue
+
+        app.logger.info('Start to run task {} in the thread {}'.format(task_id, threading.current_thread().name))
+
+        result_dir = get_test_result_path(task)
+        args = take_prepared_launch(app, endpoint, task.id) or prepare_launch(task, endpoint_uid)
+        app.logger.info('Arguments: ' + str(args))
 
+        if not TASK_STATES.launching(task.id):
+            app.logger.info('Task {} was cancelled before being launched'.format(task_id))
             taskqueue.modify(running_task=None)
-            endpoint.modify(last_run_date=datetime.datetime.utcnow())
-
-            if task.upload_dir:
-                resource_dir_tmp = get_upload_files_root(task)
-                if os.path.exists(resource_dir_tmp):
-                    make_tarfile_from_dir(str(result_dir / 'resource.tar.gz'), resource_dir_tmp)
-
-            result_dir_tmp = result_dir / 'temp'
-            if os.path.exists(result_dir_tmp):
-                shutil.rmtree(result_dir_tmp)
-
-            notification_chain_call(task)
-            TASK_LOCK.acquire()
-            TASK_THREADS[endpoint_id] = 1
-            TASK_LOCK.release()
-            break
+            continue
+
+        log_msg = ConsoleBuffer(get_config().CONSOLE_BUFFER_SIZE)
+        if room_id not in ROOM_MESSAGES:
+            ROOM_MESSAGES[room_id] = {task_id: log_msg}
         else:
-            TASK_LOCK.acquire()
-            if TASK_THREADS[endpoint_id] != 1:
-                TASK_THREADS[endpoint_id] = 1
-                TASK_LOCK.release()
-                app.logger.info('Run the lately scheduled task')
-                continue
-            del TASK_THREADS[endpoint_id]
-            TASK_LOCK.release()
-            break
+            if task_id not in ROOM_MESSAGES[room_id]:
+                ROOM_MESSAGES[room_id][task_id] = log_msg
+
+        console_log = None
+
+        def emit_console(message):
+            offset = log_msg.write(message)
+            console_log.write(message)
+            RPC_SOCKET.emit('test report', {'task_id': task_id, 'message': message, 'offset': offset}, room=room_id)
+
+        def on_exit(returncode):
+            SCHEDULER.submit(finish_task, app, endpoint, task, taskqueue, room_id, console_log, returncode)
+
+        try:
+            console_log = ConsoleLogWriter(result_dir)
+            p = SCHEDULER.spawn(args, ConsolePump(emit_console), on_exit, env=console_env(),
+                                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0)
+        except Exception:
+            TASK_STATES.exited(task.id)
+            if console_log:
+                console_log.close()
+            raise
+        if RESOURCES:
+            RESOURCES.track(task.id, p.pid)
+
+        task.status = 'running'
+        task.run_date = datetime.datetime.utcnow()
+        task.endpoint_run = endpoint
+        task.trace['popped'] = popped
+        task.trace['launched'] = task.run_date
+        task.save()
+        TASK_LAUNCH_DURATION.observe((task.run_date - popped).total_seconds())
+        if task.schedule_date:
+            TASK_QUEUE_WAIT.observe(max((task.run_date - task.schedule_date).total_seconds(), 0))
+        if not TASK_STATES.started(task.id, p):
+            # the cancel came in while launching, the task is finished as usual when the process exits
+            task.modify(status='cancelled')
+            p.terminate()
+            app.logger.info('Task {} cancelled right after being launched'.format(task_id))
+            return True
+        FIRST_KEYWORDS[str(endpoint_uid)] = task.id
+        RPC_SOCKET.emit('task started', {'task_id': task_id}, room=room_id)
+        if get_config().PIPELINED_LAUNCH:
+            SCHEDULER.submit(prefetch_next_task, app, endpoint)
+        return True
+
+def finish_task(app, endpoint, task, taskqueue, room_id, console_log, returncode):
+    """
+    Post-process the task after its robot process exits and serve the endpoint again
+    """
+    task_id = str(task.id)
+    TASK_STATES.exited(task.id)
+    if FIRST_KEYWORDS.get(str(endpoint.uid)) == task.id:
+        del FIRST_KEYWORDS[str(endpoint.uid)]
+    console_log.close()
+    app.logger.info('Console log of task {}: {} bytes, {} compressed'.format(task_id, console_log.size, console_log.compressed_size))
+
+    if RESOURCES:
+        task.resources = RESOURCES.untrack(task.id) or {}
+    if returncode == 0:
+        task.status = 'successful'
+    else:
+        task.reload('status')
+        if task.status != 'cancelled':
+            task.status = 'failed'
+    task.trace['finished'] = datetime.datetime.utcnow()
+    task.save()
+    TASKS_FINISHED.labels(task.status).inc()
+    if task.run_date:
+        TASK_RUN_DURATION.labels(task.status).observe((datetime.datetime.utcnow() - task.run_date).total_seconds())
+    RPC_SOCKET.emit('task finished', {'task_id': task_id, 'status': task.status}, room=room_id)
+    ROOM_MESSAGES[room_id][task_id].close()
+    del ROOM_MESSAGES[room_id][task_id]
+    TASK_ROOMS.pop(task_id)
+
+    taskqueue.modify(running_task=None)
+    endpoint.modify(last_run_date=datetime.datetime.utcnow())
+
+    if get_config().PIPELINED_LAUNCH:
+        # launch the next task first, the post-processing is left to another worker
+        SCHEDULER.resume(str(endpoint.id))
+        SCHEDULER.submit(post_process_task, app, task)
+    else:
+        post_process_task(app, task)
+        SCHEDULER.resume(str(endpoint.id))
+
+def post_process_task(app, task):
+    """
+    Pack the uploaded resources into the task result, clean up and send the notifications
+    """
+    result_dir = get_test_result_path(task)
+    if task.upload_dir:
+        resource_dir_tmp = get_upload_files_root(task)
+        if os.path.exists(resource_dir_tmp):
+            make_tarfile_from_dir(str(result_dir / 'resource.tar.gz'), resource_dir_tmp)
+
+    result_dir_tmp = result_dir / 'temp'
+    if os.path.exists(result_dir_tmp):
+        shutil.rmtree(result_dir_tmp)
+
+    notification_chain_call(task)
+    if get_config().RESULT_INGEST_BATCH_SIZE > 0:
+        BACKGROUND.submit(ingest_test_results, app, task)
+    if get_config().RESULT_GZIP_MIN_SIZE > 0:
+        BACKGROUND.submit(compress_result_files, str(result_dir), get_config().RESULT_GZIP_MIN_SIZE)
+
+def ingest_test_results(app, task):
+    """
+    Parse the output.xml of the task into its case results in bulk, replacing those of an earlier ingestion
+    """
+    output = get_test_result_path(task) / 'output.xml'
+    if not os.path.exists(output):
+        return
+    collection = CaseResult._get_collection()
+    collection.delete_many({'task': task.pk})
+    common = {
+        'schema_version': '1',
+        'task': task.pk,
+        'organization': task.organization.pk if task.organization else None,
+        'team': task.team.pk if task.team else None,
+        'endpoint': task.endpoint_run.pk if task.endpoint_run else None,
+        'test_suite': task.test_suite,
+    }
+    batch_size = get_config().RESULT_INGEST_BATCH_SIZE
+    suites = {}
+    rows = []
+    count = 0
+    try:
+        for case in iter_test_cases(str(output), suites):
+            # the suite's long name is known after the parse, it's the suite id till then
+            case['suite'] = case.pop('suite_id')
+            case.update(common)
+            rows.append(case)
+            if len(rows) >= batch_size:
+                collection.insert_many(rows, ordered=False)
+                count += len(rows)
+                rows = []
+    except ParseError as e:
+        # robot was killed while writing it, keep the test cases before the error
+        app.logger.warning('output.xml of task {} is broken: {}'.format(task.id, e))
+    if rows:
+        collection.insert_many(rows, ordered=False)
+        count += len(rows)
+    for suite_id, long_name in suite_long_names(suites).items():
+        collection.update_many({'task': task.pk, 'suite': suite_id}, {'$set': {'suite': long_name}})
+    app.logger.info('Ingested {} test cases of task {}'.format(count, task.id))
+
+def mark_tasks(task_ids, mark, date=None):
+    """
+    Record the mark in the traces of the tasks which haven't passed it yet
+    """
+    Task.objects(pk__in=task_ids, **{'trace__{}__exists'.format(mark): False}) \
+        .update(**{'set__trace__' + mark: date or datetime.datetime.utcnow()})
+
+def keyword_called(path):
+    """
+    Mark the first remote keyword of the task running on the endpoint, it's called by the keyword bridges
+    """
+    task_id = FIRST_KEYWORDS.pop(path.lstrip('/').split('/', 1)[0], None)
+    if task_id and SCHEDULER:
+        SCHEDULER.submit(mark_tasks, [task_id], 'first_keyword', datetime.datetime.utcnow())
 
 def check_endpoint(app, endpoint_uid, organization, team):
     org_name = team.organization.name + '-' + team.name if team else organization.name
-    url = 'http://127.0.0.1:8270/{}'.format(endpoint_uid)
-    server = xmlrpc.client.ServerProxy(url)
     endpoint = Endpoint.objects(uid=endpoint_uid, organization=organization, team=team).first()
-    try:
-        ret = server.get_keyword_names()
-    except ConnectionRefusedError:
-        err_msg = 'Endpoint {} @ {} connecting failed'.format(endpoint.name, org_name)
-    except xmlrpc.client.Fault as e:
-        err_msg = 'Endpoint {} @ {} RPC calling error'.format(endpoint.name, org_name)
-        app.logger.exception(e)
-    except TimeoutError:
-        err_msg = 'Endpoint {} @ {} connecting timeouted'.format(endpoint.name, org_name)
-    except OSError as e:
-        err_msg = 'Endpoint {} @ {} unreachable'.format(endpoint.name, org_name)
-    except Exception as e:
-        err_msg = 'Endpoint {} @ {} has error:'.format(endpoint.name, org_name)
-        app.logger.exception(e)
-    else:
-        if ret:
-            if endpoint and endpoint.status == 'Offline':
-                endpoint.modify(status='Online')
-            return True
-        else:
-            err_msg = 'Endpoint {} @ {} RPC proxy not found'.format(endpoint.name, org_name)
-    if endpoint and endpoint.status == 'Online':
-        app.logger.error(err_msg)
-        endpoint.modify(status='Offline')
+    if not endpoint:
+        app.logger.error('Endpoint not found for {}@{}'.format(org_name, endpoint_uid))
+        return False
+    if LIVENESS.is_online(endpoint_uid):
+        return True
+    app.logger.error('Endpoint {} @ {} is not connected'.format(endpoint.name, org_name))
     return False
-    
+
 def heartbeat_monitor(app):
-    app.logger.info('Start endpoint online check thread')
-    expires = 0
-    while True:
-        endpoints = Endpoint.objects()
-        for endpoint in endpoints:
-            check_endpoint(app, endpoint.uid, endpoint.organization, endpoint.team)
-        time.sleep(30)
+    app.logger.info('Start endpoint liveness tracking thread')
+    LIVENESS.run(app)
 
 def normalize_url(url):
     if not url.startswith('/'):
@@ -465,9 +675,42 @@ def normalize_url(url):
         url = url[:-1]
     return url
 
+def get_task_room_id(task_id):
+    try:
+        task = Task.objects(pk=task_id).only('organization', 'team').first()
+    except ValidationError:
+        return None
+    if not task:
+        return None
+    return get_room_id(str(task.organization.pk), str(task.team.pk) if task.team else '')
+
+def emit_test_log(task_id, room_id, message):
+    RPC_SOCKET.emit('test log', {'task_id': task_id, 'message': message}, room=room_id)
+
+LOG_RELAY = LogRelay(emit_test_log, flush_delay=get_config().RELAY_FLUSH_DELAY, room_rate=get_config().RELAY_ROOM_RATE)
+
+@RPC_APP.listener('after_server_start')
+async def start_log_relay(app, loop):
+    loop.create_task(LOG_RELAY.run())
+
+BINARY_BRIDGE = None
+
+@RPC_APP.listener('after_server_start')
+async def start_loop_lag_monitor(app, loop):
+    async def monitor(interval=1):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            RPC_LOOP_LAG.set(max(loop.time() - start - interval, 0))
+    loop.create_task(monitor())
+
+@RPC_APP.listener('after_server_start')
+async def start_binary_bridge(app, loop):
+    if BINARY_BRIDGE:
+        await BINARY_BRIDGE.start()
+
 @RPC_APP.websocket('/msg')
 async def rpc_message_relay(request, ws):
-    global TASKS_CACHED
     while True:
         try:
             ret = await ws.recv()
@@ -480,14 +723,20 @@ async def rpc_message_relay(request, ws):
         if not task_id:
             # task daemon's message
             continue
-        data = ret['data']
-        if task_id not in TASKS_CACHED:
-            task = Task.objects(pk=task_id).first()
-            TASKS_CACHED[task_id] = task
-        else:
-            task = TASKS_CACHED[task_id]
-        room_id = get_room_id(str(task.organization.id), str(task.team.id) if task.team else '')
-        RPC_SOCKET.emit('test log', {'task_id': task_id, 'message': data}, room=room_id)
+        await relay_test_log(task_id, ret['data'])
+
+async def relay_test_log(task_id, data):
+    room_id = TASK_ROOMS.get(task_id)
+    if room_id is None:
+        # the messages of a task not found are dropped without looking it up again for a while
+        if UNKNOWN_TASKS.get(task_id):
+            return
+        room_id = await asyncio.get_event_loop().run_in_executor(None, get_task_room_id, task_id)
+        if room_id is None:
+            UNKNOWN_TASKS.put(task_id, True)
+            return
+        TASK_ROOMS.put(task_id, room_id)
+    LOG_RELAY.feed(task_id, room_id, data)
 
 @RPC_APP.websocket('/rpc')
 async def rpc_proxy(request, ws):
@@ -535,16 +784,22 @@ async def rpc_proxy(request, ws):
         await RPC_PROXIES[url].close()
         del RPC_PROXIES[url]
     RPC_PROXIES[url] = rpc
+    RPC_CONNECTIONS.inc()
+    KEYWORD_METADATA.connected(url, rpc)
+    LIVENESS.connected(uid)
 
+    # the connection is kept alive by the websocket ping/pong, it's closed if the endpoint stops answering
     try:
         await ws.wait_closed()
     except (CancelledError, ConnectionClosed):
         pass
+    LIVENESS.disconnected(uid)
     try:
-        await RPC_PROXIES[url].close()
+        await rpc.close()
     except websockets.exceptions.ConnectionClosedError:
         pass
-    del RPC_PROXIES[url]
+    if RPC_PROXIES.get(url) is rpc:
+        del RPC_PROXIES[url]
 
 def restart_interrupted_tasks(app, organization=None, team=None):
     """
@@ -552,49 +807,169 @@ def restart_interrupted_tasks(app, organization=None, team=None):
     """
     pass
 
+def recover_task_queues(app, endpoint):
+    """
+    Recover the task queues of an endpoint taken over from a dead runner
+    """
+    released = TaskQueue.release_claims(endpoint=endpoint, exclude_runner=RUNNER_ID)
+    if released:
+        app.logger.warning('Put {} tasks claimed by a dead runner back to the queues of endpoint {}'.format(released, endpoint.uid))
+    for taskqueue in TaskQueue.objects(endpoint=endpoint):
+        task = taskqueue.running_task
+        if not task or isinstance(task, DBRef):
+            continue
+        taskqueue.modify(running_task=None)
+        if task.status == 'running':
+            task.modify(status='failed', comment='Interrupted because its task runner was gone')
+            app.logger.warning('Task {} was interrupted on endpoint {}'.format(task.id, endpoint.uid))
+        elif task.status == 'waiting' and task.kickedoff == 0:
+            taskqueue.push(task)
+
+def lease_monitor(app):
+    """
+    Renew the leases of the endpoints owned by this runner and take over the ones of dead runners
+    """
+    ttl = get_config().RUNNER_LEASE_TTL
+    app.logger.info('Start endpoint lease monitor for runner {}'.format(RUNNER_ID))
+    while True:
+        now = datetime.datetime.utcnow()
+        EndpointLease.renew_all(RUNNER_ID, ttl)
+        EventQueue.objects(runner=RUNNER_ID).update(set__heartbeat=now)
+
+        for lease in EndpointLease.objects(expires__lt=now):
+            endpoint = lease.endpoint
+            if not endpoint or isinstance(endpoint, DBRef):
+                lease.delete()
+                continue
+            if not EndpointLease.claim(endpoint, RUNNER_ID, ttl):
+                continue
+            app.logger.warning('Take over endpoint {} from runner {}'.format(endpoint.uid, lease.runner))
+            recover_task_queues(app, endpoint)
+            SCHEDULER.schedule(str(endpoint.id), process_task_per_endpoint, app, endpoint, endpoint.organization, endpoint.team)
+
+        shared_queue = EventQueue.objects(runner=None).first()
+        for eventqueue in EventQueue.objects(runner__ne=None, heartbeat__lt=now - datetime.timedelta(seconds=ttl)):
+            for event in eventqueue.events:
+                shared_queue.push(event)
+            eventqueue.delete()
+            app.logger.warning('Move the events of runner {} back to the shared event queue'.format(eventqueue.runner))
+
+        time.sleep(get_config().RUNNER_LEASE_RENEW_INTERVAL)
+
+def release_endpoint(endpoint_id):
+    EndpointLease.release(ObjectId(endpoint_id), RUNNER_ID)
+
 def reset_event_queue_status(app):
-    queue = EventQueue.objects().first()
+    queue = EventQueue.objects(runner=None).first()
     if not queue:
         queue = EventQueue()
         queue.save()
         app.logger.error('Event queue has not been created')
 
-    ret = queue.modify({'rw_lock': True}, rw_lock=False)
-    if ret:
-        app.logger.info('Reset the read/write lock for event queue')
-
-def reset_task_queue_status(app, organization=None, team=None):
-    queues = TaskQueue.objects(organization=organization, team=team)
-    if queues.count() == 0:
-        app.logger.error('Task queue has not been created')
-        return 1
-    
-    for q in queues:
-        ret = q.modify({'rw_lock': True}, rw_lock=False)
-        if ret:
-            app.logger.info('Reset the read/write lock for queue {} with priority {}'.format(q.endpoint.uid, q.priority))
-    return 0
+def migrate_task_queues(app):
+    migrated = TaskQueue.migrate_embedded_tasks()
+    if migrated:
+        app.logger.info('Migrated {} queued tasks to the queued task collection'.format(migrated))
+    if not get_config().RUNNER_MULTI_NODE:
+        # the claims left by a crash of the last run, a dead runner's are released when its endpoints are taken over
+        released = TaskQueue.release_claims(exclude_runner=RUNNER_ID)
+        if released:
+            app.logger.warning('Put {} tasks claimed by the last run back to the queues'.format(released))
 
 def prepare_to_run(app, organization=None, team=None):
     ret = reset_event_queue_status(app)
     if ret:
         return ret
 
-    ret = reset_task_queue_status(app, organization, team)
-    if ret:
-        return ret
-
     ret = restart_interrupted_tasks(app, organization, team)
     if ret:
         return ret
 
     return 0
 
+def start_scheduler(app):
+    global SCHEDULER, BACKGROUND
+    app.logger.info('Start task scheduler with {} workers'.format(get_config().SCHEDULER_WORKERS))
+    pool = None
+    if get_config().ROBOT_POOL_SIZE > 0:
+        if robot_pool.is_supported():
+            app.logger.info('Start robot executor pool with {} warm executors'.format(get_config().ROBOT_POOL_SIZE))
+            pool = robot_pool.RobotPool(os.path.join(tempfile.gettempdir(), 'robot_pool_{}.sock'.format(os.getpid())),
+                                        get_config().ROBOT_POOL_SIZE, get_config().ROBOT_POOL_PRELOAD)
+        else:
+            app.logger.warning('Robot executor pool is not supported on this platform')
+    if get_config().RESOURCE_SAMPLE_INTERVAL > 0:
+        start_resource_monitor(app)
+    SCHEDULER = TaskScheduler(app, get_config().SCHEDULER_WORKERS,
+                              on_idle=release_endpoint if get_config().RUNNER_MULTI_NODE else None, pool=pool)
+    SCHEDULER.start()
+    BACKGROUND = BackgroundExecutor(app, get_config().BACKGROUND_WORKERS, get_config().BACKGROUND_QUEUE_SIZE)
+    BACKGROUND.start()
+
+def start_resource_monitor(app):
+    global RESOURCES
+    if not resources.is_supported():
+        app.logger.warning('Resource accounting of the robot processes is not supported on this platform')
+        return
+    app.logger.info('Start resource monitor of the robot processes')
+    RESOURCES = resources.ResourceMonitor(get_config().RESOURCE_SAMPLE_INTERVAL, logger=app.logger)
+    RESOURCES.start()
+
+def get_scheduler_stats():
+    if not SCHEDULER:
+        return None
+    stats = SCHEDULER.stats()
+    stats['background'] = BACKGROUND.stats()
+    return stats
+
+def get_relay_stats():
+    return {'task_rooms': TASK_ROOMS.stats(), 'unknown_tasks': UNKNOWN_TASKS.stats(), 'test_logs': LOG_RELAY.stats(), 'keyword_metadata': KEYWORD_METADATA.stats()}
+
+def count_queued_tasks():
+    counts = {str(ret['_id']): ret['count'] for ret in QueuedTask._get_collection().aggregate([
+        {'$group': {'_id': '$endpoint', 'count': {'$sum': 1}}}])}
+    endpoints = Endpoint.objects(pk__in=list(counts)).only('uid')
+    return {(endpoint.uid,): counts[str(endpoint.pk)] for endpoint in endpoints}
+
+def count_scheduler_workers():
+    stats = get_scheduler_stats()
+    if stats is None:
+        return {}
+    return {('busy',): stats['busy_workers'], ('idle',): stats['workers'] - stats['busy_workers']}
+
+def count_scheduler_endpoints():
+    stats = get_scheduler_stats()
+    if stats is None:
+        return {}
+    return {('ready',): stats['ready_endpoints'], ('active',): stats['active_endpoints']}
+
+TASKS_RUNNING.set_function(lambda: len(TASK_STATES))
+TASKS_QUEUED.set_function(count_queued_tasks)
+SCHEDULER_WORKERS.set_function(count_scheduler_workers)
+SCHEDULER_ENDPOINTS.set_function(count_scheduler_endpoints)
+RPC_ENDPOINTS.set_function(lambda: len(RPC_PROXIES) - ('loop' in RPC_PROXIES))
+
+def get_metrics():
+    return METRICS.exposition()
+
+def start_metrics_server(app):
+    if not get_config().METRICS_PORT:
+        return
+    app.logger.info('Start metrics server on port {}'.format(get_config().METRICS_PORT))
+    serve_metrics('0.0.0.0', get_config().METRICS_PORT)
+
 def start_event_thread(app):
     task_thread = threading.Thread(target=event_loop_parent, name='event_loop_parent', args=(app,))
     task_thread.daemon = True
     task_thread.start()
 
+def start_lease_thread(app):
+    if not get_config().RUNNER_MULTI_NODE:
+        return
+    thread = threading.Thread(target=lease_monitor, name='lease_monitor', args=(app,))
+    thread.daemon = True
+    thread.start()
+
 def start_heartbeat_thread(app):
     thread = threading.Thread(target=heartbeat_monitor, name='heartbeat_monitor', args=(app,))
     thread.daemon = True
@@ -604,6 +979,18 @@ def bootstrap_rpc_proxy(app):
     RPC_APP.run(host='0.0.0.0', port=5555, debug=True, protocol=WebSocketProtocol)
 
 def start_rpc_proxy(app):
+    global BINARY_BRIDGE
+    KEYWORD_METADATA.logger = app.logger
+    LOG_RELAY.logger = app.logger
+    if get_config().BINARY_BRIDGE_PORT:
+        if binary_bridge_supported():
+            BINARY_BRIDGE = BinaryRPCServer(RPC_PROXIES, host='0.0.0.0', port=get_config().BINARY_BRIDGE_PORT,
+                                            keyword_timeout=get_config().XMLRPC_KEYWORD_TIMEOUT, keyword_metadata=KEYWORD_METADATA,
+                                            on_run_keyword=keyword_called, logger=app.logger)
+        else:
+            app.logger.warning('msgpack is not installed, the binary bridge on port {} is disabled and BinaryRemote falls back '
+                               'to XML-RPC, install the extra binary-bridge or set BINARY_BRIDGE_PORT = 0'.format(get_config().BINARY_BRIDGE_PORT))
+
     app.logger.info('Start RPC proxy thread')
     thread = threading.Thread(target=bootstrap_rpc_proxy, name='rpc_proxy', args=(app,))
     thread.daemon = True
@@ -613,12 +1000,38 @@ def start_rpc_proxy(app):
 
 def start_xmlrpc_server(app):
     app.logger.info('Start local XML RPC server thread')
-    thread = XMLRPCServer(RPC_PROXIES, host='0.0.0.0', port=8270)
+    thread = XMLRPCServer(RPC_PROXIES, host='0.0.0.0', port=get_config().XMLRPC_BRIDGE_PORT,
+                          keyword_timeout=get_config().XMLRPC_KEYWORD_TIMEOUT, keyword_metadata=KEYWORD_METADATA,
+                          on_run_keyword=keyword_called)
     thread.daemon = True
     thread.start()
 
-def initialize_runner():
-    notification_chain_init()
+def check_multi_node_config(app):
+    """
+    Check the config of a runner in multi-node mode, return False if the runners can't work together with it
+    """
+    config = get_config()
+    ok = True
+    if config.EVENT_DISPATCH_MODE != 'change_stream' and \
+            (not config.EVENT_POLL_INTERVAL or config.EVENT_POLL_INTERVAL > MULTI_NODE_POLL_INTERVAL):
+        # only the runner of the web server is notified of the events pushed, the others have to poll
+        app.logger.error('RUNNER_MULTI_NODE requires EVENT_DISPATCH_MODE \'change_stream\' or EVENT_POLL_INTERVAL '
+                         'of at most {} seconds'.format(MULTI_NODE_POLL_INTERVAL))
+        ok = False
+    address = config.XMLRPC_BRIDGE_ADDRESS
+    try:
+        loopback = ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        loopback = address == 'localhost'
+    if loopback:
+        app.logger.warning('XMLRPC_BRIDGE_ADDRESS is the loopback address {}, the robot processes of a runner reach '
+                           'only the keyword bridges of their own node, set it to the address of the node whose RPC '
+                           'proxy the endpoints connect to'.format(address))
+    return ok
+
+def initialize_runner(app):
+    notification_chain_init(app)
+    start_metrics_server(app)
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+from task_runner.robotlib.msgpackrpc import FRAME_HEADER, MAX_FRAME_SIZE, msgpack, pack, unpack
+from task_runner.util.keywords import KeywordMetadataCache
+from task_runner.util.xmlrpcserver import KEYWORD_TIMEOUT, METADATA_TIMEOUT, BRIDGE_CALL_DURATION, BRIDGE_CALL_ERRORS, \
+        BRIDGE_CALL_TIMEOUTS
+
+
+def is_supported():
+    return msgpack is not None
+
+class BinaryRPCServer():
+    """
+    The keyword bridge of the BinaryRemote library, it serves msgpack frames in the RPC proxy's loop
+
+    It serves the same calls as XMLRPCServer, each request [msgid, method, path, params] is answered
+    with [msgid, error, result] on the connection it came in. The bytes are forwarded as they are,
+    wsrpc packs them with msgpack too and the endpoints take bytes in place of Binary objects.
+    """
+    def __init__(self, rpc_proxy, host='0.0.0.0', port=8271, keyword_timeout=KEYWORD_TIMEOUT, metadata_timeout=METADATA_TIMEOUT,
+                 keyword_metadata=None, on_run_keyword=None, logger=None):
+        self.rpc_proxy = rpc_proxy
+        self.logger = logger or logging.getLogger(__name__)
+        self.keyword_metadata = keyword_metadata or KeywordMetadataCache()
+        self.on_run_keyword = on_run_keyword  # called with the path of the library before a keyword is run
+        self.host = host
+        self.port = port
+        self.keyword_timeout = keyword_timeout
+        self.metadata_timeout = metadata_timeout
+        self.server = None
+        self.methods = {
+            'get_keyword_names': self.get_keyword_names,
+            'run_keyword': self.run_keyword,
+            'get_keyword_arguments': self.get_keyword_arguments,
+            'get_keyword_documentation': self.get_keyword_documentation,
+            'get_keyword_tags': self.get_keyword_tags,
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def serve(self, reader, writer):
+        calls = set()
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                size, = FRAME_HEADER.unpack(header)
+                if size > MAX_FRAME_SIZE:
+                    self.logger.warning('Binary bridge received a frame of {} bytes, closing the connection'.format(size))
+                    break
+                msgid, method, path, params = unpack(await reader.readexactly(size))
+                call = asyncio.ensure_future(self.answer(writer, msgid, method, path, params))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            self.logger.warning('Binary bridge received a malformed frame: {}'.format(e))
+        finally:
+            for call in calls:
+                call.cancel()
+            writer.close()
+
+    async def answer(self, writer, msgid, method, path, params):
+        try:
+            func = self.methods[method]
+        except KeyError:
+            error, result = 'method "{}" is not supported'.format(method), None
+        else:
+            start = time.perf_counter()
+            try:
+                error, result = None, await func(path, *params)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    BRIDGE_CALL_TIMEOUTS.labels('msgpack').inc()
+                BRIDGE_CALL_ERRORS.labels('msgpack', method).inc()
+                error, result = '{}:{}'.format(type(e), e), None
+            BRIDGE_CALL_DURATION.labels('msgpack', method).observe(time.perf_counter() - start)
+        try:
+            writer.write(pack([msgid, error, result]))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def get_keyword_names(self, path):
+        if path not in self.rpc_proxy:
+            return []
+        return await asyncio.wait_for(self.keyword_metadata.get_keyword_names(path, self.rpc_proxy[path]), self.metadata_timeout)
+
+    async def run_keyword(self, path, name, args, kwargs=None):
+        if path not in self.rpc_proxy:
+            return None
+        if self.on_run_keyword:
+            self.on_run_keyword(path)
+        try:
+            return await asyncio.wait_for(self.rpc_proxy[path].request.run_keyword(name, args, kwargs), self.keyword_timeout)
+        except asyncio.TimeoutError:
+            BRIDGE_CALL_TIMEOUTS.labels('msgpack').inc()
+            return {'status': 'FAIL', 'error': 'The endpoint did not answer in {} seconds'.format(self.keyword_timeout)}
+
+    async def get_keyword_arguments(self, path, name):
+        if path not in self.rpc_proxy:
+            return None
+        if name == 'stop_remote_server':
+            return []
+        return await asyncio.wait_for(self.keyword_metadata.get_keyword_arguments(path, self.rpc_proxy[path], name),
+                                      self.metadata_timeout)
+
+    async def get_keyword_documentation(self, path, name):
+        if path not in self.rpc_proxy:
+            return None
+        if name == 'stop_remote_server':
+            return ('Stop the remote server unless stopping is disabled.\n\n'
+                    'Return ``True/False`` depending was server stopped or not.')
+        return await asyncio.wait_for(self.keyword_metadata.get_keyword_documentation(path, self.rpc_proxy[path], name),
+                                      self.metadata_timeout)
+
+    async def get_keyword_tags(self, path, name):
+        if path not in self.rpc_proxy:
+            return None
+        if name == 'stop_remote_server':
+            return []
+        return await asyncio.wait_for(self.keyword_metadata.get_keyword_tags(path, self.rpc_proxy[path], name),
+                                      self.metadata_timeout)
@@ -0,0 +1,183 @@
+import codecs
+import os
+import tempfile
+import threading
+import time
+
+CONSOLE_READ_SIZE = 64 * 1024
+CONSOLE_BATCH_SIZE = 16 * 1024
+CONSOLE_BATCH_DELAY = 0.05
+CONSOLE_BUFFER_SIZE = 1024 * 1024
+CONSOLE_REPLAY_SIZE = 256 * 1024
+CONSOLE_ENCODING = 'utf-8'
+
+
+def utf8_boundary(data, end=None):
+    """
+    Return the largest offset not after `end` which doesn't split a UTF-8 character of the data
+    """
+    end = len(data) if end is None else min(end, len(data))
+    lead = end - 1
+    while lead >= 0 and end - lead < 4 and data[lead] & 0xC0 == 0x80:
+        lead -= 1
+    if lead < 0:
+        return end
+    byte = data[lead]
+    length = 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4 if byte >> 3 == 0b11110 else 1
+    return lead if lead + length > end else end
+
+def console_env(env=None):
+    """
+    Return the environment for a robot process to write its console output in CONSOLE_ENCODING
+
+    A pipe is written in the locale encoding otherwise, eg. cp936 on a Chinese Windows.
+    """
+    env = dict(os.environ if env is None else env)
+    env['PYTHONIOENCODING'] = CONSOLE_ENCODING
+    return env
+
+def read_utf8(data, limit):
+    """
+    Return the number of bytes to take from the data for at most `limit` bytes of whole characters,
+    a character longer than the limit is taken as a whole, the data should have 3 bytes over the limit
+    """
+    return utf8_boundary(data, limit) or utf8_boundary(data, min(len(data), 4))
+
+
+class ConsolePump():
+    """
+    Decode the console output of a robot process incrementally and coalesce it into batches
+
+    A batch is handed over to the callback `emit` when it reaches `batch_size` characters
+    or when it has been pending for `batch_delay` seconds. A size bounded batch is cut
+    after its last line break so that the lines are not split up between batches.
+    """
+    def __init__(self, emit, encoding=None, batch_size=CONSOLE_BATCH_SIZE, batch_delay=CONSOLE_BATCH_DELAY):
+        self.emit = emit
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._decoder = codecs.getincrementaldecoder(encoding or CONSOLE_ENCODING)(errors='replace')
+        self._pending = []
+        self._pending_size = 0
+        self._pending_since = None
+
+    @property
+    def timeout(self):
+        """
+        Seconds before the pending batch is due to be flushed, None if nothing is pending
+        """
+        if self._pending_since is None:
+            return None
+        return max(0, self._pending_since + self.batch_delay - time.monotonic())
+
+    def feed(self, data):
+        text = self._decoder.decode(data)
+        if text:
+            self._append(text)
+        if self._pending_size >= self.batch_size:
+            self._flush_lines()
+        else:
+            self.poll()
+
+    def poll(self):
+        if self._pending_since is not None and time.monotonic() - self._pending_since >= self.batch_delay:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        text = ''.join(self._pending)
+        self._reset()
+        self.emit(text)
+
+    def close(self):
+        text = self._decoder.decode(b'', final=True)
+        if text:
+            self._append(text)
+        self.flush()
+
+    def _append(self, text):
+        text = text.replace('\n', '\r\n')
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append(text)
+        self._pending_size += len(text)
+
+    def _flush_lines(self):
+        text = ''.join(self._pending)
+        pos = text.rfind('\n') + 1
+        if pos == 0:
+            pos = len(text)
+        self._reset()
+        if pos < len(text):
+            self._append(text[pos:])
+        self.emit(text[:pos])
+
+    def _reset(self):
+        self._pending = []
+        self._pending_size = 0
+        self._pending_since = None
+
+class ConsoleBuffer():
+    """
+    The console output of a running task for the browsers joining the room
+
+    The output is appended to a temporary file, only the tail of at most
+    `capacity` bytes is kept in memory. It can be replayed from any byte
+    offset so that a client can resume from the last offset it has seen.
+    """
+    def __init__(self, capacity=CONSOLE_BUFFER_SIZE):
+        self.capacity = capacity
+        self.size = 0
+        self._tail = bytearray()
+        self._spill = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+
+    @property
+    def tail_offset(self):
+        return self.size - len(self._tail)
+
+    def write(self, text):
+        """
+        Append the text and return the byte offset where it starts
+        """
+        data = text.encode('utf-8')
+        with self._lock:
+            offset = self.size
+            self._spill.seek(0, os.SEEK_END)
+            self._spill.write(data)
+            self._tail += data
+            self.size += len(data)
+            if len(self._tail) > self.capacity:
+                del self._tail[:len(self._tail) - self.capacity // 2]
+        return offset
+
+    def read(self, offset=0, limit=CONSOLE_REPLAY_SIZE):
+        """
+        Read at most `limit` bytes from the byte offset, return the text and the offset following it
+
+        The read ends before a character split by the limit, the offset returned is where it starts.
+        """
+        with self._lock:
+            offset = min(max(offset, 0), self.size)
+            end = min(offset + limit + 3, self.size)
+            if offset >= self.tail_offset:
+                start = offset - self.tail_offset
+                data = bytes(self._tail[start:start + end - offset])
+            else:
+                self._spill.flush()
+                self._spill.seek(offset)
+                data = self._spill.read(end - offset)
+        size = read_utf8(data, limit)
+        return data[:size].decode('utf-8', errors='replace'), offset + size
+
+    def getvalue(self):
+        with self._lock:
+            self._spill.flush()
+            self._spill.seek(0)
+            return self._spill.read().decode('utf-8', errors='replace')
+
+    def close(self):
+        with self._lock:
+            self._tail = bytearray()
+            self._spill.close()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+
+class KeywordMetadataCache():
+    """
+    Keyword metadata of the endpoints' test libraries kept per (endpoint, backing file, library version)
+
+    When an endpoint connects, the metadata of its library is fetched with one bulk introspection call
+    unless the version it reports is cached already. The version is a digest of the metadata made by the
+    endpoint, a changed library bundle replaces the cached metadata. The metadata calls robot makes to
+    import the library are answered from the cache, they are forwarded to the endpoint for the libraries
+    not cached, eg. served by the endpoints which can't introspect in bulk.
+    """
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.libraries = {}  # {url of the library: metadata}
+        self.fills = {}  # {url of the library: introspection started when the endpoint connected}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def connected(self, url, rpc):
+        fill = self.fills.get(url)
+        if fill:
+            fill.cancel()
+        fill = self.fills[url] = asyncio.ensure_future(self.fill(url, rpc))
+        fill.add_done_callback(lambda f: self.fills.pop(url) if self.fills.get(url) is f else None)
+
+    async def fill(self, url, rpc):
+        try:
+            version = await rpc.request.get_library_version()
+            cached = self.libraries.get(url)
+            if cached and cached['version'] == version:
+                return
+            metadata = await rpc.request.get_library_metadata()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.libraries.pop(url, None)
+            self.logger.warning('Keyword metadata of {} is not cached: {}'.format(url, e))
+            return
+        self.libraries[url] = metadata
+        self.fetches += 1
+
+    async def lookup(self, url):
+        fill = self.fills.get(url)
+        if fill:
+            await asyncio.wait([fill])
+        return self.libraries.get(url)
+
+    async def get_keyword_names(self, url, rpc):
+        library = await self.lookup(url)
+        if library is None:
+            self.misses += 1
+            return await rpc.request.get_keyword_names()
+        self.hits += 1
+        return library['names']
+
+    async def get_keyword_arguments(self, url, rpc, name):
+        return await self._get(url, rpc, name, 'args', rpc.request.get_keyword_arguments)
+
+    async def get_keyword_documentation(self, url, rpc, name):
+        return await self._get(url, rpc, name, 'doc', rpc.request.get_keyword_documentation)
+
+    async def get_keyword_tags(self, url, rpc, name):
+        return await self._get(url, rpc, name, 'tags', rpc.request.get_keyword_tags)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'libraries': len(self.libraries),
+            'fetches': self.fetches,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0,
+        }
+
+    async def _get(self, url, rpc, name, field, forward):
+        library = await self.lookup(url)
+        keyword = library['keywords'].get(name) if library else None
+        if keyword is None or field not in keyword:
+            self.misses += 1
+            return await forward(name)
+        self.hits += 1
+        return keyword[field]
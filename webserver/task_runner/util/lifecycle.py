@@ -0,0 +1,92 @@
+import threading
+import time
+
+LAUNCHING = 'launching'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+
+CANCEL_TOMBSTONE_TTL = 600
+
+
+class TaskLifecycle():
+    """
+    The states of the tasks launched by this runner, shared by the event dispatcher and the endpoint workers
+
+    A worker moves a task from LAUNCHING to RUNNING once its robot process is spawned, and drops it when
+    the process exits. A cancel never waits for the worker. A task still LAUNCHING is marked CANCELLING
+    and the worker terminates the process as soon as it's spawned. A RUNNING task hands its process
+    over to the dispatcher to be terminated. A task not launched yet leaves a tombstone which keeps
+    the workers from launching it if it has been popped from its queue already.
+    """
+    def __init__(self, tombstone_ttl=CANCEL_TOMBSTONE_TTL):
+        self.tombstone_ttl = tombstone_ttl
+        self._tasks = {}  # {task id: [state, process]}
+        self._tombstones = {}  # {task id: expiry time} of the tasks cancelled before being launched
+        self._cond = threading.Condition()
+
+    def launching(self, task_id):
+        """
+        Return False if the task has been cancelled, the worker should skip it
+        """
+        with self._cond:
+            self._expire_tombstones()
+            if self._tombstones.pop(task_id, None):
+                return False
+            self._tasks[task_id] = [LAUNCHING, None]
+            self._cond.notify_all()
+            return True
+
+    def started(self, task_id, process):
+        """
+        Return False if the task has been cancelled while launching, the worker should terminate the process
+        """
+        with self._cond:
+            entry = self._tasks[task_id]
+            entry[1] = process
+            if entry[0] == CANCELLING:
+                return False
+            entry[0] = RUNNING
+            self._cond.notify_all()
+            return True
+
+    def exited(self, task_id):
+        with self._cond:
+            self._tasks.pop(task_id, None)
+            self._cond.notify_all()
+
+    def cancel(self, task_id):
+        """
+        Request the cancel of a task, return the state it was in and its process
+
+        The state is None if the task has not been launched by this runner.
+        """
+        with self._cond:
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                self._expire_tombstones()
+                self._tombstones[task_id] = time.monotonic() + self.tombstone_ttl
+                return None, None
+            state, process = entry
+            entry[0] = CANCELLING
+            self._cond.notify_all()
+            return state, process
+
+    def state(self, task_id):
+        with self._cond:
+            entry = self._tasks.get(task_id)
+            return entry[0] if entry else None
+
+    def wait(self, task_id, states=(None,), timeout=None):
+        """
+        Wait until the task gets into one of the states, None for being exited or not launched
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: (self._tasks[task_id][0] if task_id in self._tasks else None) in states, timeout)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def _expire_tombstones(self):
+        now = time.monotonic()
+        for task_id in [t for t, expiry in self._tombstones.items() if expiry <= now]:
+            del self._tombstones[task_id]
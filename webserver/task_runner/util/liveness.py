@@ -0,0 +1,71 @@
+import threading
+import time
+
+from app.main.model.database import Endpoint
+
+
+class LivenessTracker():
+    """
+    Track the liveness of the endpoints by their websocket connections to the RPC proxy
+
+    An endpoint is online as long as one of its connections is open, the connections
+    are kept alive by the websocket ping/pong of the RPC proxy which closes the ones
+    not answering in time. Status changes are written to the database in batches.
+    """
+    def __init__(self, batch_delay=1):
+        self.batch_delay = batch_delay
+        self.connections = {}  # {endpoint uid: count of open connections}
+        self.changes = {}      # {endpoint uid: status not written yet}
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+
+    def connected(self, uid):
+        with self.lock:
+            self.connections[uid] = self.connections.get(uid, 0) + 1
+            if self.connections[uid] == 1:
+                self.changes[uid] = 'Online'
+                self.changed.set()
+
+    def disconnected(self, uid):
+        with self.lock:
+            count = self.connections.get(uid, 0) - 1
+            if count > 0:
+                self.connections[uid] = count
+                return
+            self.connections.pop(uid, None)
+            self.changes[uid] = 'Offline'
+            self.changed.set()
+
+    def is_online(self, uid):
+        return str(uid) in self.connections
+
+    def flush(self, app):
+        with self.lock:
+            changes, self.changes = self.changes, {}
+            self.changed.clear()
+        online = [uid for uid, status in changes.items() if status == 'Online']
+        offline = [uid for uid, status in changes.items() if status == 'Offline']
+        if online:
+            count = Endpoint.objects(uid__in=online, status='Offline').update(status='Online')
+            app.logger.info('{} endpoints became online'.format(count))
+        if offline:
+            count = Endpoint.objects(uid__in=offline, status='Online').update(status='Offline')
+            app.logger.info('{} endpoints became offline'.format(count))
+
+    def reset(self, app):
+        """
+        No endpoint is connected before the RPC proxy starts
+        """
+        count = Endpoint.objects(status='Online').update(status='Offline')
+        if count:
+            app.logger.info('Reset {} endpoints to offline'.format(count))
+
+    def run(self, app):
+        self.reset(app)
+        while True:
+            self.changed.wait()
+            time.sleep(self.batch_delay)
+            try:
+                self.flush(app)
+            except Exception as e:
+                app.logger.exception(e)
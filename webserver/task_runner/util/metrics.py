@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 86400)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=''):
+    labels = ','.join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values))
+    if extra:
+        labels = labels + ',' + extra if labels else extra
+    return '{' + labels + '}' if labels else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class _CounterValue():
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class _GaugeValue(_CounterValue):
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+class _HistogramValue():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+class _Timer():
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Metric():
+    """
+    A metric family, the values of each combination of the label values are made on first use
+
+    The metric itself stands for its only value if it has no labels.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        self.function = None
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._make_child())
+        return child
+
+    def set_function(self, function):
+        """
+        Collect the values from `function` when scraped, it returns the value or {label values: value}
+        """
+        self.function = function
+
+    def collect(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        if self.function:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            for labels, value in values.items():
+                lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(value)))
+            return lines
+        for labels, child in list(self.children.items()):
+            lines.extend(self._collect_child(labels, child))
+        return lines
+
+    def _collect_child(self, labels, child):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(child.value))]
+
+    def _make_child(self):
+        raise NotImplementedError
+
+    def __getattr__(self, name):
+        # inc(), set(), observe() and time() of the metric without labels
+        if name.startswith('_') or self.labelnames:
+            raise AttributeError(name)
+        return getattr(self.labels(), name)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _make_child(self):
+        return _CounterValue()
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _make_child(self):
+        return _GaugeValue()
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _collect_child(self, labels, child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, labels,
+                                                 'le="{}"'.format(_format_value(bound))), _format_value(cumulative)))
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labelnames, labels), _format_value(cumulative)))
+        return lines
+
+class Registry():
+    """
+    The metrics of the process, exposed in the Prometheus text format
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError('Metric {} is registered already'.format(metric.name))
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def exposition(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                lines.append('# {} is not collected: {}'.format(metric.name, _escape(e)))
+        return '\n'.join(lines) + '\n'
+
+METRICS = Registry()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = METRICS.exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(host, port):
+    """
+    Expose the metrics on an HTTP server of its own, for the processes without a web server
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics_server')
+    thread.daemon = True
+    thread.start()
+    return server
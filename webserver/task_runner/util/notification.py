@@ -1,71 +1,229 @@
+import heapq
+import itertools
+import queue
 import smtplib
-import socket
+import threading
+import time
 from email import encoders
 from email.header import Header
 from email.mime.text import MIMEText
 from email.utils import formataddr, parseaddr
-from socket import timeout
 
 # sys.path.append('.')
 from app.main.config import get_config
 from flask import current_app
 
 notification_chain = []
+DISPATCHER = None
 
 
 BODY_TEMPLATE = 'Test suite {} is {}.\n\nFor details please see http://localhost:9527/#/test-report/test-detail?task_id={}&organization={}{}'
 SUBJECT_TEMPLATE = 'Test Report for {}'
+DIGEST_SUBJECT_TEMPLATE = 'Test Reports for {} tasks'
+SMTP_TIMEOUT = 5
+SMTP_IDLE_TIMEOUT = 30
 
 
 def _format_addr(s):
     name, addr = parseaddr(s)
     return formataddr((Header(name).encode(), addr))
 
-def send_email(task):
-    from_addr = get_config().FROM_ADDR
-    password = get_config().SMTP_PASSWORD
-    smtp_user = get_config().SMTP_USER
-    smtp_server = get_config().SMTP_SERVER
-    smtp_server_port = get_config().SMTP_SERVER_PORT
-    smtp_always_cc = get_config().SMTP_ALWAYS_CC
+def _is_permanent_error(e):
+    """
+    Whether the SMTP error won't be fixed by retrying, ie. the server replied with 5xx
+    """
+    if isinstance(e, (smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code >= 500
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return False
+
+class SMTPConnection():
+    """
+    A connection to the SMTP server reused for the mails, it's reconnected if the server
+    has dropped it and closed when it has been idle for `idle_timeout` seconds
+    """
+    def __init__(self, server, port, user, password, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.host = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.server = None
+        self.last_used = 0
+
+    @property
+    def idle_deadline(self):
+        if self.server is None:
+            return None
+        return self.last_used + self.idle_timeout
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.server is None:
+            self._connect()
+        try:
+            self.server.sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connect()
+            self.server.sendmail(from_addr, to_addrs, msg)
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() >= self.idle_deadline:
+            self.close()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        # server.starttls()
+        # server.set_debuglevel(1)
+        try:
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.last_used = time.monotonic()
+
+class NotificationDispatcher(threading.Thread):
+    """
+    Run the notification chain for the finished tasks in the background
+
+    The mails are sent over one reused SMTP connection and retried with an exponential
+    backoff if they failed. With `digest_delay` the mails to the same recipient within
+    that many seconds are gathered into one digest mail.
+    """
+    def __init__(self, app, connection, from_addr, always_cc=None, digest_delay=0, retries=3, backoff=5):
+        super().__init__(name='notification_dispatcher')
+        self.daemon = True
+        self.app = app
+        self.connection = connection
+        self.from_addr = from_addr
+        self.always_cc = always_cc
+        self.digest_delay = digest_delay
+        self.retries = retries
+        self.backoff = backoff
+        self.tasks = queue.Queue()
+        self.digests = {}   # {recipient: (due time, [(subject, body)])}
+        self.retrying = []  # heap of (due time, sequence, attempts, recipient, [(subject, body)])
+        self.sequence = itertools.count()
+        self.sent = 0
+        self.failed = 0
+
+    def dispatch(self, task):
+        self.tasks.put(task)
 
+    def send_email(self, to_addr, subject, body):
+        """
+        Send a mail or gather it into the digest of the recipient, it's called by the notification chain
+        """
+        if self.digest_delay <= 0:
+            self._deliver(to_addr, [(subject, body)], 0)
+            return
+        if to_addr not in self.digests:
+            self.digests[to_addr] = (time.monotonic() + self.digest_delay, [])
+        self.digests[to_addr][1].append((subject, body))
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    task = self.tasks.get(timeout=self._timeout())
+                except queue.Empty:
+                    pass
+                else:
+                    for caller in notification_chain:
+                        try:
+                            caller(task)
+                        except Exception as e:
+                            current_app.logger.exception(e)
+                try:
+                    self._process_due()
+                except Exception as e:
+                    current_app.logger.exception(e)
+
+    def _timeout(self):
+        deadlines = [due for due, _ in self.digests.values()]
+        if self.retrying:
+            deadlines.append(self.retrying[0][0])
+        if self.connection.idle_deadline is not None:
+            deadlines.append(self.connection.idle_deadline)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def _process_due(self):
+        now = time.monotonic()
+        for to_addr in [to_addr for to_addr, (due, _) in self.digests.items() if due <= now]:
+            _, messages = self.digests.pop(to_addr)
+            self._deliver(to_addr, messages, 0)
+        while self.retrying and self.retrying[0][0] <= now:
+            _, _, attempts, to_addr, messages = heapq.heappop(self.retrying)
+            self._deliver(to_addr, messages, attempts)
+        self.connection.close_if_idle()
+
+    def _deliver(self, to_addr, messages, attempts):
+        if len(messages) == 1:
+            subject, body = messages[0]
+        else:
+            subject = DIGEST_SUBJECT_TEMPLATE.format(len(messages))
+            body = '\n\n'.join(body for _, body in messages)
+        msg = MIMEText(body, 'plain', 'utf-8')
+        msg['From'] = _format_addr(self.from_addr)
+        msg['To'] = _format_addr(to_addr)
+        if self.always_cc:
+            msg['cc'] = _format_addr(self.always_cc)
+        msg['Subject'] = Header(subject)
+
+        try:
+            self.connection.sendmail(self.from_addr, [to_addr], msg.as_string())
+        except (smtplib.SMTPException, OSError) as e:
+            if _is_permanent_error(e):
+                current_app.logger.error('Failed to send the mail to {}: {}'.format(to_addr, e))
+                self.failed += 1
+                return
+            self.connection.close()
+            if attempts >= self.retries:
+                current_app.logger.error('Gave up sending the mail to {}: {}'.format(to_addr, e))
+                self.failed += 1
+                return
+            delay = self.backoff * 2 ** attempts
+            current_app.logger.warning('Failed to send the mail to {}, retry in {} seconds: {}'.format(to_addr, delay, e))
+            heapq.heappush(self.retrying, (time.monotonic() + delay, next(self.sequence), attempts + 1, to_addr, messages))
+        else:
+            self.sent += 1
+
+def send_email(task):
     body_msg = BODY_TEMPLATE.format(task.test.test_suite, task.status, task.id, task.test.organization.id, '&team=%s' % task.test.team.id if task.test.team else '')
-    msg = MIMEText(body_msg, 'plain', 'utf-8')
-    msg['From'] = _format_addr(from_addr)
-    msg['To'] = _format_addr(task.tester.email)
-    msg['cc'] = _format_addr(smtp_always_cc)
-    msg['Subject'] = Header(SUBJECT_TEMPLATE.format(task.test.test_suite))
-
-    try:
-        server = smtplib.SMTP(smtp_server, smtp_server_port, timeout=5)
-    except TimeoutError:
-        current_app.logger.error('SMTP server connecting timeout')
-        return
-    except timeout:
-        current_app.logger.error('SMTP server connecting socket timeout')
-        return
-    except ConnectionRefusedError:
-        current_app.logger.error('SMTP server connecting refused')
-        return
-    except socket.gaierror:
-        current_app.logger.error('Network is not available')
-        return
-
-    # server.starttls()
-    # server.set_debuglevel(1)
-    try:
-        server.login(smtp_user, password)
-    except smtplib.SMTPAuthenticationError:
-        current_app.logger.error('SMTP authentication failed')
-        server.quit()
-        return
-    server.sendmail(from_addr, [task.tester.email], msg.as_string())
-    server.quit()
-
-def notification_chain_init():
+    DISPATCHER.send_email(task.tester.email, SUBJECT_TEMPLATE.format(task.test.test_suite), body_msg)
+
+def notification_chain_init(app):
+    global DISPATCHER
+
     if send_email not in notification_chain:
         notification_chain.append(send_email)
+    if DISPATCHER is None:
+        config = get_config()
+        connection = SMTPConnection(config.SMTP_SERVER, config.SMTP_SERVER_PORT, config.SMTP_USER, config.SMTP_PASSWORD)
+        DISPATCHER = NotificationDispatcher(app, connection, config.FROM_ADDR, config.SMTP_ALWAYS_CC,
+                                            digest_delay=config.NOTIFICATION_DIGEST_DELAY,
+                                            retries=config.NOTIFICATION_RETRIES,
+                                            backoff=config.NOTIFICATION_RETRY_BACKOFF)
+        DISPATCHER.start()
 
 def notification_chain_call(task):
-    for caller in notification_chain:
-        caller(task)
+    """
+    Hand the task over to the dispatcher, the notifications are sent in the background
+    """
+    DISPATCHER.dispatch(task)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+RELAY_FLUSH_DELAY = 0.05
+RELAY_BATCH_SIZE = 16 * 1024
+RELAY_ROOM_RATE = 512 * 1024
+RELAY_MAX_PENDING = 256 * 1024
+
+DROPPED_NOTICE = '\r\n[{} characters of the test log dropped, the browsers can\'t keep up]\r\n'
+
+
+class _Pending():
+    def __init__(self):
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, message):
+        self.chunks.append(message)
+        self.size += len(message)
+
+    def trim(self, limit):
+        """
+        Drop the oldest output to keep at most `limit` characters
+        """
+        while self.size > limit and self.chunks:
+            chunk = self.chunks[0]
+            excess = self.size - limit
+            if len(chunk) <= excess:
+                self.chunks.popleft()
+                dropped = len(chunk)
+            else:
+                self.chunks[0] = chunk[excess:]
+                dropped = excess
+            self.size -= dropped
+            self.dropped += dropped
+
+    def take(self):
+        message = ''.join(self.chunks)
+        if self.dropped:
+            message = DROPPED_NOTICE.format(self.dropped) + message
+        self.chunks.clear()
+        self.size = 0
+        self.dropped = 0
+        return message
+
+class LogRelay():
+    """
+    Coalesce the test log messages of the tasks into batched emits to their rooms
+
+    The messages of a task are buffered and handed over to `emit(task_id, room_id, message)`
+    every `flush_delay` seconds, or as soon as `batch_size` characters are pending. Each room
+    is allowed to receive `room_rate` characters per second, the output is held back beyond
+    that, and the oldest output is dropped with a notice once more than `max_pending`
+    characters of a task are held back.
+    """
+    def __init__(self, emit, flush_delay=RELAY_FLUSH_DELAY, batch_size=RELAY_BATCH_SIZE,
+                 room_rate=RELAY_ROOM_RATE, max_pending=RELAY_MAX_PENDING, logger=None):
+        self.emit = emit
+        self.logger = logger or logging.getLogger(__name__)
+        self.flush_delay = flush_delay
+        self.batch_size = batch_size
+        self.room_rate = room_rate
+        self.max_pending = max_pending
+        self.pending = {}  # {(task id, room id): pending output}
+        self.budgets = {}  # {room id: [characters allowed to emit, last refilled]}
+        self.frames = 0
+        self.emits = 0
+        self.dropped = 0
+        self.started = time.monotonic()
+
+    def feed(self, task_id, room_id, message):
+        key = (task_id, room_id)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = _Pending()
+        pending.append(message)
+        self.frames += 1
+        if pending.size > self.max_pending:
+            dropped = pending.dropped
+            pending.trim(self.max_pending)
+            self.dropped += pending.dropped - dropped
+        if pending.size >= self.batch_size:
+            self._flush(key, pending)
+
+    def flush(self):
+        for key, pending in list(self.pending.items()):
+            self._flush(key, pending)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception('Failed to relay the test logs')
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'frames': self.frames,
+            'emits': self.emits,
+            'frames_per_second': self.frames / elapsed if elapsed else 0,
+            'emits_per_second': self.emits / elapsed if elapsed else 0,
+            'dropped': self.dropped,
+            'pending_tasks': len(self.pending),
+        }
+
+    def _flush(self, key, pending):
+        if pending.size == 0 and not pending.dropped:
+            del self.pending[key]
+            return
+        room_id = key[1]
+        now = time.monotonic()
+        budget = self.budgets.get(room_id)
+        if budget is None:
+            budget = self.budgets[room_id] = [self.room_rate, now]
+        else:
+            budget[0] = min(self.room_rate, budget[0] + (now - budget[1]) * self.room_rate)
+            budget[1] = now
+        if budget[0] <= 0:
+            return
+        message = pending.take()
+        budget[0] -= len(message)
+        del self.pending[key]
+        self.emits += 1
+        self.emit(key[0], room_id, message)
@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+
+RESOURCE_SAMPLE_INTERVAL = 1
+RESOURCE_ERROR_LOG_INTERVAL = 60
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = PAGE_SIZE = None
+
+
+def is_supported():
+    return CLOCK_TICKS is not None and os.path.isdir('/proc/self')
+
+def read_stat(pid):
+    """
+    Return (ppid, cpu seconds of the process and its reaped children, rss bytes) from /proc/<pid>/stat
+    """
+    with open('/proc/{}/stat'.format(pid), 'rb') as f:
+        data = f.read()
+    # the command name in parentheses may contain spaces
+    fields = data[data.rindex(b')') + 2:].split()
+    ppid = int(fields[1])
+    utime, stime, cutime, cstime = (int(v) for v in fields[11:15])
+    rss = int(fields[21]) * PAGE_SIZE
+    return ppid, (utime + stime + cutime + cstime) / CLOCK_TICKS, rss
+
+def read_io(pid):
+    """
+    Return the bytes read from and written to the storage by the process and its reaped children
+    """
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/{}/io'.format(pid)) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name == 'read_bytes':
+                    read_bytes = int(value)
+                elif name == 'write_bytes':
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+class ProcessTree():
+    """
+    The resource usage of a process and its descendants accumulated from the samples
+
+    The kernel adds the CPU time and I/O of a reaped child to its parent's, so the last sample
+    of a descendant which has exited is dropped if its parent has been sampled since then.
+    """
+    def __init__(self, pid):
+        self.root = pid
+        self.started = time.monotonic()
+        self.ended = None
+        self.samples = {}  # {pid: (ppid, cpu seconds, read bytes, write bytes, generation of the sample)}
+        self.exited = {}  # {pid: (last sample, generation it's found exited)}
+        self.generation = 0
+        self.peak_rss = 0
+        self.processes = 0
+
+    def update(self, stats, children):
+        """
+        Take a sample of the tree from the stats of all processes, {pid: (ppid, cpu seconds, rss)}
+        """
+        self.generation += 1
+        alive = set()
+        pending = [self.root] if self.root in stats else []
+        rss = 0
+        while pending:
+            pid = pending.pop()
+            alive.add(pid)
+            ppid, cpu, process_rss = stats[pid]
+            rss += process_rss
+            if pid not in self.samples and pid not in self.exited:
+                self.processes += 1
+            self.samples[pid] = (ppid, cpu) + read_io(pid) + (self.generation,)
+            pending.extend(children.get(pid, ()))
+        self.peak_rss = max(self.peak_rss, rss)
+        for pid in [pid for pid in self.samples if pid not in alive]:
+            self.exited[pid] = (self.samples.pop(pid), self.generation)
+
+    def summary(self):
+        cpu = read_bytes = write_bytes = 0
+        samples = [(sample, None) for sample in self.samples.values()] + list(self.exited.values())
+        for (ppid, pid_cpu, pid_read, pid_write, _), exited in samples:
+            parent = self.samples.get(ppid) or self.exited.get(ppid, (None,))[0]
+            if exited and parent and parent[4] >= exited:
+                continue
+            cpu += pid_cpu
+            read_bytes += pid_read
+            write_bytes += pid_write
+        return {
+            'cpu_time': round(cpu, 3),
+            'peak_rss': self.peak_rss,
+            'read_bytes': read_bytes,
+            'write_bytes': write_bytes,
+            'wall_time': round((self.ended or time.monotonic()) - self.started, 3),
+            'processes': self.processes,
+        }
+
+class ResourceMonitor(threading.Thread):
+    """
+    Sample the process trees of the robot processes from /proc every `interval` seconds
+
+    All trees are sampled with one scan of /proc. The summary of a tree is taken when its
+    root process exits, the usage between the last sample and the exit is not counted. A failing
+    sample is logged at most once every `error_log_interval` seconds till the samples succeed again.
+    """
+    def __init__(self, interval=RESOURCE_SAMPLE_INTERVAL, logger=None, error_log_interval=RESOURCE_ERROR_LOG_INTERVAL):
+        super().__init__(name='resource_monitor')
+        self.daemon = True
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.error_log_interval = error_log_interval
+        self.trees = {}  # {task id: process tree}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def track(self, task_id, pid):
+        tree = ProcessTree(pid)
+        with self.lock:
+            self.trees[task_id] = tree
+        self.sample([tree])
+
+    def untrack(self, task_id):
+        with self.lock:
+            tree = self.trees.pop(task_id, None)
+        if tree is None:
+            return None
+        self.sample([tree])
+        tree.ended = time.monotonic()
+        return tree.summary()
+
+    def sample(self, trees=None):
+        stats = {}
+        children = {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                stat = read_stat(name)
+            except (OSError, ValueError, IndexError):
+                continue
+            stats[int(name)] = stat
+            children.setdefault(stat[0], []).append(int(name))
+        with self.lock:
+            if trees is None:
+                trees = list(self.trees.values())
+            for tree in trees:
+                tree.update(stats, children)
+
+    def run(self):
+        failures = 0
+        logged = None
+        while not self.stopped.wait(self.interval):
+            if not self.trees:
+                continue
+            try:
+                self.sample()
+            except Exception as e:
+                failures += 1
+                now = time.monotonic()
+                if logged is None:
+                    self.logger.exception('Failed to sample the robot processes')
+                    logged = now
+                elif now - logged >= self.error_log_interval:
+                    self.logger.warning('Failed to sample the robot processes {} times in a row: {}'.format(failures, e))
+                    logged = now
+                continue
+            if failures:
+                self.logger.info('Sampled the robot processes again after {} failures'.format(failures))
+                failures = 0
+                logged = None
+
+    def stop(self):
+        self.stopped.set()
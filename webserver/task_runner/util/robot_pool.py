@@ -0,0 +1,250 @@
+"""
+A pool of warm robot executors forked from a server which has imported Robot Framework
+and the common libraries once, it saves the interpreter start and the imports of each task.
+
+The server keeps `size` idle executors pre-forked, they wait for the tasks on a unix socket.
+A client sends the robot arguments along with the write end of a pipe, the executor takes it
+as its stdout and stderr, replies with its pid, runs robot and replies with the exit code.
+Each executor runs one task in a new session, then exits, the server forks another one.
+
+    python -m task_runner.util.robot_pool <socket path> [--size 2] [--preload robot ...]
+
+The server exits when its standard input is closed, ie. when the runner goes away.
+It works only on the platforms supporting fork() and passing file descriptors over unix sockets.
+"""
+import argparse
+import array
+import asyncio
+import gc
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+from task_runner.util.console import console_env
+
+ROBOT_POOL_PRELOAD = ['robot', 'robot.running', 'robot.libraries.BuiltIn', 'robot.libraries.Collections',
+                      'robot.libraries.String', 'robot.libraries.OperatingSystem', 'robot.libraries.Process']
+ROBOT_POOL_START_TIMEOUT = 30
+
+
+def is_supported():
+    return hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX') and hasattr(socket, 'SCM_RIGHTS')
+
+class WarmProcess():
+    """
+    A robot executor running a task, it behaves like asyncio.subprocess.Process for the supervisor
+    """
+    def __init__(self, pid, stdout, control, transport):
+        self.pid = pid
+        self.stdout = stdout
+        self.returncode = None
+        self._control = control
+        self._transport = transport
+
+    async def wait(self):
+        if self.returncode is None:
+            line = await self._control.readline()
+            try:
+                self.returncode = int(line)
+            except ValueError:
+                # the executor died without reporting, eg. killed
+                self.returncode = -signal.SIGKILL
+            self._transport.close()
+        return self.returncode
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+class RobotPool():
+    """
+    The client side of the pool, it starts the server and hands the tasks over to it
+    """
+    def __init__(self, path, size, preload=None):
+        self.path = path
+        self.size = size
+        self.preload = ROBOT_POOL_PRELOAD if preload is None else preload
+        self.server = None
+
+    def start(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        args = [sys.executable, '-m', 'task_runner.util.robot_pool', self.path, '--size', str(self.size)]
+        if self.preload:
+            args += ['--preload'] + self.preload
+        # the executors inherit the encoding of the server's standard streams
+        self.server = subprocess.Popen(args, stdin=subprocess.PIPE, env=console_env())
+        for i in range(ROBOT_POOL_START_TIMEOUT * 10):
+            if os.path.exists(self.path):
+                return True
+            if self.server.poll() is not None:
+                break
+            time.sleep(0.1)
+        self.stop()
+        return False
+
+    def stop(self):
+        if self.server:
+            self.server.stdin.close()
+            self.server.wait()
+            self.server = None
+
+    @property
+    def alive(self):
+        return self.server is not None and self.server.poll() is None
+
+    async def exec(self, args, cwd=None):
+        """
+        Run the robot command line `args` in an executor, args[0] is the robot command itself
+        """
+        loop = asyncio.get_event_loop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        read_fd, write_fd = os.pipe()
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, self.path)
+            request = json.dumps({'args': args[1:], 'cwd': cwd or os.getcwd()}).encode() + b'\n'
+            sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [write_fd]))])
+        except Exception:
+            sock.close()
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+
+        stdout = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), os.fdopen(read_fd, 'rb', 0))
+        control, writer = await asyncio.open_unix_connection(sock=sock)
+        line = await control.readline()
+        if not line:
+            writer.close()
+            raise RuntimeError('The robot executor exited unexpectedly')
+        return WarmProcess(int(line), stdout, control, writer)
+
+def _receive_request(conn):
+    data, ancdata, flags, addr = conn.recvmsg(64 * 1024, socket.CMSG_SPACE(array.array('i').itemsize))
+    fds = array.array('i')
+    for level, type_, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(64 * 1024)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data), fds[0]
+
+def _execute(listener, notify):
+    """
+    The executor forked, wait for a task, run it and exit
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    conn, _ = listener.accept()
+    listener.close()
+    os.write(notify, b'%d\n' % os.getpid())
+    os.close(notify)
+    returncode = 255
+    try:
+        request, fd = _receive_request(conn)
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        os.chdir(request['cwd'])
+        sys.argv = ['robot'] + request['args']
+        conn.sendall(b'%d\n' % os.getpid())
+
+        from robot import run_cli
+        returncode = run_cli(request['args'], exit=False)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(b'%d\n' % returncode)
+        finally:
+            os._exit(0)
+
+def serve(path, size, preload):
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            print('Failed to preload module {}: {}'.format(module, e), file=sys.stderr)
+    # keep the preloaded objects out of the garbage collector to share their memory pages with the executors
+    gc.collect()
+    gc.freeze()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path + '.tmp')
+    listener.listen(size * 2)
+    notify_r, notify_w = os.pipe()
+    idle, busy = set(), set()
+
+    def refill():
+        while len(idle) < size:
+            pid = os.fork()
+            if pid == 0:
+                os.close(notify_r)
+                _execute(listener, notify_w)
+            idle.add(pid)
+
+    refill()
+    # the clients wait for the socket to show up when the executors are ready
+    os.rename(path + '.tmp', path)
+    stdin = sys.stdin.fileno()
+    notifications = b''
+    try:
+        while True:
+            readable, _, _ = select.select([notify_r, stdin], [], [], 1)
+            if stdin in readable and not os.read(stdin, 4096):
+                break
+            if notify_r in readable:
+                notifications += os.read(notify_r, 4096)
+                *pids, notifications = notifications.split(b'\n')
+                for pid in pids:
+                    idle.discard(int(pid))
+                    busy.add(int(pid))
+            while idle or busy:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                idle.discard(pid)
+                busy.discard(pid)
+            refill()
+    finally:
+        for pid in idle | busy:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        listener.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pool of warm robot executors')
+    parser.add_argument('path', help='path of the unix socket to listen on')
+    parser.add_argument('--size', type=int, default=2, help='number of idle executors kept forked')
+    parser.add_argument('--preload', nargs='*', default=ROBOT_POOL_PRELOAD, help='modules imported before forking')
+    args = parser.parse_args()
+    serve(args.path, args.size, args.preload)
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from task_runner.util.console import CONSOLE_READ_SIZE
+
+ENDPOINT_QUEUED = 'queued'    # waiting in the ready queue for a worker
+ENDPOINT_ACTIVE = 'active'    # being served by a worker or running a task
+ENDPOINT_PENDING = 'pending'  # active and new tasks have been scheduled meanwhile
+
+
+class SupervisedProcess():
+    """
+    A handle of the robot process living in the supervisor's event loop
+    """
+    def __init__(self, loop, process):
+        self.loop = loop
+        self.process = process
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def terminate(self):
+        self.loop.call_soon_threadsafe(self._terminate)
+
+    def _terminate(self):
+        try:
+            self.process.terminate()
+        except ProcessLookupError:
+            pass
+
+class ProcessSupervisor(threading.Thread):
+    """
+    Supervise all robot processes asynchronously in one thread
+
+    The console output of a process is pumped to its console pump, the callback
+    `on_exit` is called with the return code in the supervisor thread once the
+    process exits, it should hand over the heavy work to the worker pool.
+    Robot processes are run by the warm executors of `pool` if it's given and alive.
+    """
+    def __init__(self, pool=None, logger=None):
+        super().__init__(name='process_supervisor')
+        self.daemon = True
+        self.loop = asyncio.new_event_loop()
+        self.processes = set()
+        self.pool = pool
+        self.logger = logger or logging.getLogger(__name__)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def spawn(self, args, pump, on_exit, **kwargs):
+        fut = asyncio.run_coroutine_threadsafe(self._spawn(args, pump, on_exit, **kwargs), self.loop)
+        return fut.result()
+
+    async def _spawn(self, args, pump, on_exit, **kwargs):
+        process = None
+        if self.pool and self.pool.alive and args[0] == 'robot':
+            try:
+                process = await self.pool.exec(args, kwargs.get('cwd'))
+            except Exception:
+                self.logger.exception('Failed to run robot in the executor pool, start it cold')
+        if process is None:
+            process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.STDOUT, **kwargs)
+        handle = SupervisedProcess(self.loop, process)
+        self.processes.add(handle)
+        self.loop.create_task(self._supervise(handle, pump, on_exit))
+        return handle
+
+    async def _supervise(self, handle, pump, on_exit):
+        process = handle.process
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(process.stdout.read(CONSOLE_READ_SIZE), pump.timeout)
+                except asyncio.TimeoutError:
+                    pump.poll()
+                    continue
+                if not data:
+                    break
+                pump.feed(data)
+            pump.close()
+        except Exception:
+            self.logger.exception('Failed to pump the console output of process {}'.format(process.pid))
+            # the rest of the output is discarded, robot would block on a full pipe otherwise
+            try:
+                while await process.stdout.read(CONSOLE_READ_SIZE):
+                    pass
+            except Exception:
+                self.logger.exception('Failed to drain the console output of process {}'.format(process.pid))
+        returncode = await process.wait()
+        self.processes.discard(handle)
+        try:
+            on_exit(returncode)
+        except Exception:
+            self.logger.exception('Failed to handle the exit of process {}'.format(process.pid))
+
+class TaskScheduler():
+    """
+    Serve the endpoints having runnable tasks with a fixed number of worker threads
+
+    An endpoint scheduled is put into the ready queue, a worker pops it and calls
+    the endpoint's job which returns True if it has launched a task. The endpoint
+    stays active until `resume()` puts it back into the ready queue after the task
+    finished, otherwise it's released and will be served again when scheduled.
+    The callback `on_idle` is called with the endpoint id when it's released.
+    """
+    def __init__(self, app, workers, on_idle=None, pool=None):
+        self.app = app
+        self.size = workers
+        self.on_idle = on_idle
+        self.jobs = queue.Queue()
+        self.endpoints = {}  # {endpoint id: [state, job, args]}
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.busy_time = 0
+        self.started = time.monotonic()
+        self.workers = []
+        self.pool = pool
+        self.supervisor = ProcessSupervisor(pool, logger=app.logger)
+
+    def start(self):
+        if self.pool and not self.pool.start():
+            self.app.logger.error('Failed to start the robot executor pool, robot processes will be started cold')
+        self.supervisor.start()
+        for i in range(self.size):
+            worker = threading.Thread(target=self._work, name='task_worker_{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, *args):
+        self.jobs.put((func, args))
+
+    def schedule(self, endpoint_id, job, *args):
+        """
+        Schedule the endpoint to be served, return True if it was idle
+        """
+        with self.lock:
+            entry = self.endpoints.get(endpoint_id)
+            if entry is None:
+                self.endpoints[endpoint_id] = [ENDPOINT_QUEUED, job, args]
+                self.submit(self._serve, endpoint_id)
+                return True
+            if entry[0] == ENDPOINT_ACTIVE:
+                entry[0] = ENDPOINT_PENDING
+            return False
+
+    def resume(self, endpoint_id):
+        """
+        Put the active endpoint back to the ready queue to look for its next task
+        """
+        with self.lock:
+            entry = self.endpoints.get(endpoint_id)
+            if entry is None:
+                return
+            entry[0] = ENDPOINT_QUEUED
+            self.submit(self._serve, endpoint_id)
+
+    def is_active(self, endpoint_id):
+        return endpoint_id in self.endpoints
+
+    def spawn(self, args, pump, on_exit, **kwargs):
+        return self.supervisor.spawn(args, pump, on_exit, **kwargs)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            states = [entry[0] for entry in self.endpoints.values()]
+            busy = self.busy
+        return {
+            'workers': self.size,
+            'busy_workers': busy,
+            'utilization': busy / self.size if self.size else 0,
+            'average_utilization': self.busy_time / self.size / (now - self.started) if self.size else 0,
+            'ready_endpoints': states.count(ENDPOINT_QUEUED),
+            'active_endpoints': len(states) - states.count(ENDPOINT_QUEUED),
+            'running_processes': len(self.supervisor.processes),
+            'warm_pool': bool(self.pool and self.pool.alive),
+        }
+
+    def _serve(self, endpoint_id):
+        with self.lock:
+            entry = self.endpoints[endpoint_id]
+            entry[0] = ENDPOINT_ACTIVE
+            job, args = entry[1], entry[2]
+        try:
+            occupied = job(*args)
+        except Exception as e:
+            self.app.logger.exception(e)
+            occupied = False
+        if occupied:
+            return
+        with self.lock:
+            if entry[0] == ENDPOINT_PENDING:
+                entry[0] = ENDPOINT_QUEUED
+                self.submit(self._serve, endpoint_id)
+                return
+            del self.endpoints[endpoint_id]
+        if self.on_idle:
+            self.on_idle(endpoint_id)
+
+    def _work(self):
+        while True:
+            func, args = self.jobs.get()
+            with self.lock:
+                self.busy += 1
+            start = time.monotonic()
+            try:
+                func(*args)
+            except Exception as e:
+                self.app.logger.exception(e)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.busy_time += time.monotonic() - start
+
+class BackgroundExecutor():
+    """
+    Run the post-processing jobs of the finished tasks, eg. parsing output.xml or compressing
+    the result files, with a few worker threads apart from the task scheduler's
+
+    At most `queue_size` jobs wait in the queue, `submit()` blocks when it's full so that
+    a backlog of heavy jobs slows down the callers instead of growing without bound.
+    """
+    def __init__(self, app, workers, queue_size):
+        self.app = app
+        self.size = workers
+        self.jobs = queue.Queue(queue_size)
+        self.workers = []
+
+    def start(self):
+        for i in range(self.size):
+            worker = threading.Thread(target=self._work, name='background_worker_{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, *args):
+        self.jobs.put((func, args))
+
+    def stats(self):
+        return {'workers': self.size, 'pending_jobs': self.jobs.qsize()}
+
+    def _work(self):
+        while True:
+            func, args = self.jobs.get()
+            try:
+                func(*args)
+            except Exception as e:
+                self.app.logger.exception(e)
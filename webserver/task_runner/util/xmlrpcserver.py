@@ -2,14 +2,19 @@ import asyncio
 import concurrent.futures
 import functools
 import threading
+import time
 import select
 import signal
+import socketserver
 import sys
 import traceback
 
 from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 from xmlrpc.client import Fault, dumps, loads
 
+from task_runner.util.keywords import KeywordMetadataCache
+from task_runner.util.metrics import METRICS
+
 
 def resolve_dotted_attribute(obj, attr, allow_dotted_names=True):
     """resolve_dotted_attribute(a, 'b.c.d') => a.b.c.d
@@ -35,11 +40,29 @@ def resolve_dotted_attribute(obj, attr, allow_dotted_names=True):
             obj = getattr(obj,i)
     return obj
 
+KEYWORD_TIMEOUT = 3600
+METADATA_TIMEOUT = 60
+
+BRIDGE_CALL_DURATION = METRICS.histogram('robotest_bridge_call_seconds', 'Seconds to answer a call of the keyword bridge',
+                                         ['transport', 'method'])
+BRIDGE_CALL_ERRORS = METRICS.counter('robotest_bridge_call_errors_total', 'Calls of the keyword bridge answered with an error',
+                                     ['transport', 'method'])
+BRIDGE_CALL_TIMEOUTS = METRICS.counter('robotest_bridge_call_timeouts_total', 'Calls of the keyword bridge not answered by the endpoint in time',
+                                       ['transport'])
+
+
 class MatchAllXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = None
+    # keep the connections of the robot processes alive across the keyword calls
+    protocol_version = 'HTTP/1.1'
 
-class StoppableXMLRPCServer(SimpleXMLRPCServer):
+class StoppableXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    Serve each connection in its own thread so that the keyword calls of the robot processes run in parallel
+    """
     allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
 
     def __init__(self, host, port):
         SimpleXMLRPCServer.__init__(self, (host, port),
@@ -149,7 +172,14 @@ class StoppableXMLRPCServer(SimpleXMLRPCServer):
             pass
         else:
             if func is not None:
-                return func(path, *params)
+                start = time.perf_counter()
+                try:
+                    return func(path, *params)
+                except:
+                    BRIDGE_CALL_ERRORS.labels('xmlrpc', method).inc()
+                    raise
+                finally:
+                    BRIDGE_CALL_DURATION.labels('xmlrpc', method).observe(time.perf_counter() - start)
             raise Exception('method "%s" is not supported' % method)
 
         if self.instance is not None:
@@ -193,10 +223,15 @@ class SignalHandler(object):
             signal.signal(getattr(signal, name), handler)
 
 class XMLRPCServer(threading.Thread):
-    def __init__(self, rpc_proxy, host='0.0.0.0', port=8270):
+    def __init__(self, rpc_proxy, host='0.0.0.0', port=8270, keyword_timeout=KEYWORD_TIMEOUT, metadata_timeout=METADATA_TIMEOUT,
+                 keyword_metadata=None, on_run_keyword=None):
         super().__init__()
         self.server = StoppableXMLRPCServer(host, port)
         self.rpc_proxy = rpc_proxy
+        self.keyword_metadata = keyword_metadata or KeywordMetadataCache()
+        self.on_run_keyword = on_run_keyword  # called with the path of the library before a keyword is run
+        self.keyword_timeout = keyword_timeout
+        self.metadata_timeout = metadata_timeout
         self.name = 'XMLRPCServer'
 
     @property
@@ -208,33 +243,48 @@ class XMLRPCServer(threading.Thread):
         self.server.register_function(self.run_keyword)
         self.server.register_function(self.get_keyword_arguments)
         self.server.register_function(self.get_keyword_documentation)
+        self.server.register_function(self.get_keyword_tags)
         # self.server.register_function(self.stop_remote_server)
 
         self.server.activate()
         with SignalHandler(self.server.stop):
             self.server.serve()
 
+    def call(self, coro, timeout):
+        """
+        Run the request to the endpoint in the RPC proxy's loop, cancel it if it's not answered in time
+        """
+        fut = asyncio.run_coroutine_threadsafe(coro, self.rpc_loop)
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            BRIDGE_CALL_TIMEOUTS.labels('xmlrpc').inc()
+            raise Fault(1, 'The endpoint did not answer in {} seconds'.format(timeout))
+
     def get_keyword_names(self, path):
         if path not in self.rpc_proxy:
             return []
-        fut = asyncio.run_coroutine_threadsafe(self.rpc_proxy[path].request.get_keyword_names(), self.rpc_loop)
-        return fut.result()
+        return self.call(self.keyword_metadata.get_keyword_names(path, self.rpc_proxy[path]), self.metadata_timeout)
 
     def run_keyword(self, path, name, args, kwargs=None):
         if path not in self.rpc_proxy:
             return None
+        if self.on_run_keyword:
+            self.on_run_keyword(path)
         # if name == 'stop_remote_server':
         #     return KeywordRunner(self.stop_remote_server).run_keyword(args, kwargs)
-        fut = asyncio.run_coroutine_threadsafe(self.rpc_proxy[path].request.run_keyword(name, args, kwargs), self.rpc_loop)
-        return fut.result()
+        try:
+            return self.call(self.rpc_proxy[path].request.run_keyword(name, args, kwargs), self.keyword_timeout)
+        except Fault as fault:
+            return {'status': 'FAIL', 'error': fault.faultString}
 
     def get_keyword_arguments(self, path, name):
         if path not in self.rpc_proxy:
             return None
         if name == 'stop_remote_server':
             return []
-        fut = asyncio.run_coroutine_threadsafe(self.rpc_proxy[path].request.get_keyword_arguments(name), self.rpc_loop)
-        return fut.result()
+        return self.call(self.keyword_metadata.get_keyword_arguments(path, self.rpc_proxy[path], name), self.metadata_timeout)
 
     def get_keyword_documentation(self, path, name):
         if path not in self.rpc_proxy:
@@ -242,13 +292,11 @@ class XMLRPCServer(threading.Thread):
         if name == 'stop_remote_server':
             return ('Stop the remote server unless stopping is disabled.\n\n'
                     'Return ``True/False`` depending was server stopped or not.')
-        fut = asyncio.run_coroutine_threadsafe(self.rpc_proxy[path].request.get_keyword_documentation(name), self.rpc_loop)
-        return fut.result()
+        return self.call(self.keyword_metadata.get_keyword_documentation(path, self.rpc_proxy[path], name), self.metadata_timeout)
 
     def get_keyword_tags(self, path, name):
         if path not in self.rpc_proxy:
             return None
         if name == 'stop_remote_server':
             return []
-        fut = asyncio.run_coroutine_threadsafe(self.rpc_proxy[path].request.get_keyword_tags(name), self.rpc_loop)
-        return fut.result()
+        return self.call(self.keyword_metadata.get_keyword_tags(path, self.rpc_proxy[path], name), self.metadata_timeout)